@@ -1,38 +1,41 @@
 from testdata import ALLERGIES_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class Allergy: 
     """Create instances of Allergy; 
 also maintains complete allergy lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'statement', 'type', 'allergen', 'system', 'code',
+                 'start', 'end', 'reaction', 'snomed', 'severity', 'severity_code',
+                 'typeDescription', 'criticality', 'loinc_code', 'loinc_display', 'text')
+
     allergies = {} # Dictionary of allergy lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Allergy observations"""
+    def load(cls,pid=None,allergies_file_name=ALLERGIES_FILE):
+      """Loads patient Allergy observations (only patient pid's, if given)"""
       
       # Loop through allergies and build patient allergy lists:
-      probs = csv.reader(open(ALLERGIES_FILE,'U'),dialect='excel-tab')
-      # header = probs.next()
-      header = next(probs)
+      header, probs = rowindex.reader(allergies_file_name, pid)
       for prob in probs:
           cls(dict(zip(header,prob))) # Create a allergy instance 
 
     def __init__(self,p):
         self.id = p['ID']
-        self.pid = p['PID']
-        self.statement = p['STATEMENT']
-        self.type = p['TYPE']
-        self.allergen = p['ALLERGEN']
-        self.system = p['SYSTEM']
-        self.code = p['CODE']
-        self.start = p['START_DATE']
-        self.end = p['END_DATE']
-        self.reaction= p['REACTION']
-        self.snomed= p['SNOMED'] 
-        self.severity= p['SEVERITY']
+        self.pid = intern(p['PID'])
+        self.statement = intern(p['STATEMENT'])
+        self.type = intern(p['TYPE'])
+        self.allergen = intern(p['ALLERGEN'])
+        self.system = intern(p['SYSTEM'])
+        self.code = intern(p['CODE'])
+        self.start = intern(p['START_DATE'])
+        self.end = intern(p['END_DATE'])
+        self.reaction= intern(p['REACTION'])
+        self.snomed= intern(p['SNOMED'])
+        self.severity= intern(p['SEVERITY'])
         
         if self.severity == 'mild':
             self.severity_code = 255604002
@@ -68,7 +71,7 @@ if __name__== '__main__':
      help='display allergies for a given patient id (default=1520204)')
   args = parser.parse_args()
  
-  Allergy.load()
+  Allergy.load(pid=args.pid)
   if args.pid:
     if not args.pid in Allergy.allergies:
       parser.error("No results found for pid = %s"%args.pid)
@@ -0,0 +1,477 @@
+"""Benchmarks for the test data generator stages"""
+from testdata import LABS_FILE, PATIENTS_FILE, MEDS_FILE, PROBLEMS_FILE, REFILLS_FILE
+from testdata import VITALS_FILE, IMMUNIZATIONS_FILE, PROCEDURES_FILE, SOCIALHISTORY_FILE
+from testdata import FAMILYHISTORY_FILE, CLINICAL_NOTES_FILE, ALLERGIES_FILE
+from testdata import IMAGINGSTUDIES_FILE, DOCUMENTS_FILE
+from patient import Patient
+from codes import Loinc
+from lab import Lab
+from vitals import VitalSigns
+from med import Med
+from refill import Refill
+from problem import Problem
+from procedure import Procedure
+from immunization import Immunization
+from allergy import Allergy
+from familyhistory import FamilyHistory
+from socialhistory import SocialHistory
+from clinicalnote import ClinicalNote
+from document import Document
+from imagingstudy import ImagingStudy
+from snapshot import TABLES, countRows
+import tracemalloc
+import subprocess
+import snapshot
+import platform
+import rowindex
+import datetime
+import json
+import argparse
+import tempfile
+import shutil
+import time
+import csv
+import gc
+import os
+
+def timed(fn, *args):
+   """Returns (result, seconds) for a single call of fn(*args)"""
+   start = time.perf_counter()
+   result = fn(*args)
+   return result, time.perf_counter() - start
+
+def benchRender(repeat=3):
+   """Compares the per-resource render cost of the precompiled templates with
+narrow contexts against the former dict(globals(), **locals()) contexts"""
+   import fhir
+   from generate import initData
+   initData()
+
+   # Collect every resource of every patient once, so only rendering is timed
+   resources = []
+   for pid in Patient.mpi:
+     resources.extend(fhir.FHIRSamplePatient(pid, '.').resources())
+
+   def wide():
+     for template, context in resources:
+       fhir.template_env.get_template(template+'.xml').render(dict(vars(fhir), **context))
+
+   def narrow():
+     for template, context in resources:
+       fhir.TEMPLATES[template].render(context)
+
+   print ("%d resources for %d patients"%(len(resources), len(Patient.mpi)))
+   for name, fn in (("globals() context", wide), ("narrow context", narrow)):
+     best = min(timed(fn)[1] for i in range(repeat))
+     print ("%-20s%10.1f us/resource"%(name, best*1e6/len(resources)))
+
+def benchTemplates(repeat=3):
+   """Times loading every FHIR template into a fresh environment from source
+against loading them from the compiled template cache"""
+   import templates
+   directory = tempfile.mkdtemp(prefix='templates')
+   try:
+     compiled = os.path.join(directory, 'compiled')
+     print ("%d templates compiled"%templates.compile(path=compiled))
+     for name, path in (("from source", os.path.join(directory, 'none')), ("compiled", compiled)):
+       def load():
+         env = templates.environment(path=path)
+         for t in env.list_templates(extensions=['xml']): env.get_template(t)
+       print ("%-20s%8.1f ms"%(name, min(timed(load)[1] for i in range(repeat))*1e3))
+   finally:
+     shutil.rmtree(directory, True)
+
+def synthesizeLabs(file_name, rows):
+   """Writes a labs file of the given number of rows by cycling through the
+shipped labs, with fresh IDs and one patient per 50 results"""
+   source = csv.reader(open(LABS_FILE, newline='', encoding='utf-8'),dialect='excel-tab')
+   header = next(source)
+   labs = list(source)
+   iid, ipid = header.index('ID'), header.index('PID')
+   out = open(file_name, 'w')
+   print ("\t".join(header), file=out)
+   for n in range(rows):
+     lab = list(labs[n % len(labs)])
+     lab[iid] = str(n+1)
+     lab[ipid] = str(1000000 + n//50)
+     print ("\t".join(lab), file=out)
+   out.close()
+
+def twoPassLoad(file_name):
+   """Reference loader reading the labs file twice, as Lab.load used to"""
+   header = None
+   for lab in csv.reader(open(file_name, newline='', encoding='utf-8'),dialect='excel-tab'):
+     if header is None: header = lab; cindex = header.index('LOINC'); continue
+     Lab.codes[lab[cindex]] = Lab.codes.get(lab[cindex], 0) + 1
+   Loinc.load(Lab.codes.keys())
+   labs = csv.reader(open(file_name, newline='', encoding='utf-8'),dialect='excel-tab')
+   header = next(labs)
+   for lab in labs:
+     Lab.add(dict(zip(header,lab)))
+
+def benchLabs(rows, repeat=1):
+   """Times Lab.load against the former two-pass loader on a synthetic file"""
+   directory = tempfile.mkdtemp(prefix='labs')
+   try:
+     file_name = os.path.join(directory, 'labs.txt')
+     synthesizeLabs(file_name, rows)
+     print ("%d synthetic lab rows (%.1f MB)"%(rows, os.path.getsize(file_name)/1e6))
+     for name, fn in (("two-pass load", twoPassLoad), ("Lab.load", Lab.load)):
+       times = []
+       for i in range(repeat):
+         Lab.codes, Loinc.info = {}, {}
+         Lab.results.clear()
+         times.append(timed(fn, file_name)[1])
+       best = min(times)
+       print ("%-20s%8.2f s%12.0f rows/s"%(name, best, rows/best))
+   finally:
+     shutil.rmtree(directory, True)
+
+def benchPatientLoad(rows, repeat=1):
+   """Times loading one patient's labs through the row index against loading
+the whole of a synthetic labs file"""
+   directory = tempfile.mkdtemp(prefix='labs')
+   try:
+     file_name = os.path.join(directory, 'labs.txt')
+     synthesizeLabs(file_name, rows)
+     pid = str(1000000 + rows//100) # A patient in the middle of the file
+     print ("%d synthetic lab rows (%.1f MB)"%(rows, os.path.getsize(file_name)/1e6))
+     db, seconds = timed(rowindex.index, file_name)
+     db.close()
+     print ("%-20s%8.3f s"%("row index build", seconds))
+     for name, p in (("whole file", None), ("one patient", pid)):
+       times = []
+       for i in range(repeat):
+         Lab.codes, Loinc.info = {}, {}
+         Lab.results.clear()
+         times.append(timed(Lab.load, file_name, p)[1])
+       print ("%-20s%8.3f s%10d results"%(name, min(times), countRows(Lab.results)))
+   finally:
+     shutil.rmtree(directory, True)
+     if os.path.exists(rowindex.index_file(file_name)):
+       os.remove(rowindex.index_file(file_name))
+
+def synthesizeVitals(pid, rows):
+   """Creates the given number of vitals for one patient, two readings with
+blood pressure per encounter, one encounter a day"""
+   start = datetime.datetime(2000, 1, 1)
+   sites = [pc['name'] for pc in VitalSigns.bpPositionCodes]
+   for n in range(rows):
+     date = (start + datetime.timedelta(days=n//2)).isoformat()
+     VitalSigns.add({'ID': 'stress-%d'%n, 'PID': pid, 'TIMESTAMP': date,
+         'START_DATE': date, 'END_DATE': date, 'ENCOUNTER_TYPE': 'ambulatory',
+         'HEART_RATE': '60', 'RESPIRATORY_RATE': '', 'TEMPERATURE': '',
+         'WEIGHT': '80', 'HEIGHT': '', 'BMI': '', 'SYSTOLIC': '120',
+         'DIASTOLIC': '80', 'OXYGEN_SATURATION': '', 'HEAD_CIRCUMFERENCE': '',
+         'BP_SITE': sites[n % 3 + 3], 'BP_METHOD': sites[n % 3 + 8],
+         'BP_POSITION': sites[n % 3]})
+
+def listScanEncounters(vitals):
+   """Reference encounter lookup scanning a list, as the vitals pass used to;
+vitals are (id, start_date, encounter_type) tuples"""
+   encounters = []
+   for id, start_date, encounter_type in vitals:
+     e = [i for i in encounters if i['date'] == start_date and i['type'] == encounter_type]
+     if not e:
+       encounters.append({'date': start_date, 'type': encounter_type, 'id': id})
+
+def benchVitals(rows, repeat=1):
+   """Times the vitals pass of the bundle resources for one patient with the
+given number of vitals rows"""
+   import fhir
+   Patient.load()
+   pid = sorted(Patient.mpi)[0]
+   synthesizeVitals(pid, rows)
+   print ("%d synthetic vitals rows for patient %s"%(rows, pid))
+   patient = fhir.FHIRSamplePatient(pid, '.')
+   best = min(timed(lambda: sum(1 for r in patient.resources()))[1] for i in range(repeat))
+   print ("%-20s%8.2f s%12.0f rows/s"%("vitals pass", best, rows/best))
+   # The former list scan is quadratic, so it is only timed on a sample
+   sample = [(v.id, v.start_date, v.encounter_type)
+             for v in VitalSigns.vitals[pid][:min(rows, 10000)]]
+   best = min(timed(listScanEncounters, sample)[1] for i in range(repeat))
+   print ("%-20s%8.2f s%12.0f rows/s (first %d rows, encounters only)"%(
+       "list scan", best, len(sample)/best, len(sample)))
+
+def benchGrowth(rows, repeat=1):
+   """Times growth-curve vitals sampling, one age at a time through
+interpolate() and fuzz() against the batched Growth tables, and whole
+generated patients"""
+   import vitalspatientgenerator as vpg
+   import random
+   ts = [random.uniform(vpg.stats[0][0], vpg.stats[-1][0]) for i in range(rows)]
+   def perSample():
+     return [vpg.fuzz(*vpg.interpolate(t)) for t in ts]
+   def batched():
+     return vpg.growth.rows(ts)
+   def patients():
+     for i in range(rows//50):
+       vpg.generate_patient()
+   print ("%d synthetic vitals rows"%rows)
+   for name, fn in (("per sample", perSample), ("batched", batched), ("generate_patient", patients)):
+     best = min(timed(fn)[1] for i in range(repeat))
+     print ("%-20s%8.2f s%12.0f rows/s"%(name, best, rows/best))
+
+def benchBundle(mb):
+   """Writes the bundles of a patient whose documents are replaced by files
+of mb MB each, reporting the bytes, flushes and peak traced memory"""
+   import fhir
+   import docs
+   import bundlewriter
+   from generate import initData, writeBundle
+   initData()
+   pid = sorted(Document.documents)[0]
+   directory = tempfile.mkdtemp(prefix='bundle')
+   base, cachePath = docs.BASE_DOCUMENTS_PATH, docs.cache.path
+   try:
+     shutil.copytree(os.path.join(base, pid), os.path.join(directory, 'documents', pid))
+     for d in Document.documents[pid]:
+       with open(os.path.join(directory, 'documents', pid, d.file_name), 'wb') as f:
+         for i in range(mb): f.write(os.urandom(1<<20))
+     docs.BASE_DOCUMENTS_PATH = os.path.join(directory, 'documents')
+     docs.cache.path = os.path.join(directory, 'cache')
+     for d in Document.documents[pid]: # Encode them before timing
+       docs.fetch_document(pid, d.file_name)
+     print ("patient %s with %d documents of %d MB"%(pid, len(Document.documents[pid]), mb))
+     for format in ('xml', 'json'):
+       before = dict(bundlewriter.stats)
+       tracemalloc.start()
+       seconds = timed(writeBundle, fhir.FHIRSamplePatient(pid, directory), None, format)[1]
+       peak = tracemalloc.get_traced_memory()[1]
+       tracemalloc.stop()
+       print ("%-6s%8.2f s%10.1f MB%8d flushes%10.1f MB peak"%(format, seconds,
+           (bundlewriter.stats['bytes']-before['bytes'])/1e6,
+           bundlewriter.stats['flushes']-before['flushes'], peak/1e6))
+   finally:
+     docs.BASE_DOCUMENTS_PATH, docs.cache.path = base, cachePath
+     shutil.rmtree(directory, True)
+
+def benchMemory():
+   """Reports the memory retained by each loaded table, in bytes per row"""
+   tracemalloc.start()
+   total = 0
+   for cls, store in TABLES:
+     gc.collect()
+     before = tracemalloc.get_traced_memory()[0]
+     cls.load()
+     gc.collect()
+     used = tracemalloc.get_traced_memory()[0] - before
+     rows = countRows(getattr(cls, store))
+     total += used
+     print ("%-16s%8d rows%10.0f bytes/row"%(cls.__name__, rows, used/max(rows, 1)))
+   tracemalloc.stop()
+   print ("%-16s%27.1f MB"%("total", total/1e6))
+
+# The loaders of the suite, in initData() order, as (class, data file, the
+# keyword argument of load() taking the file name)
+LOADS = [(Patient, PATIENTS_FILE, 'patient_file_name'), (Med, MEDS_FILE, 'meds_file_name'),
+         (Problem, PROBLEMS_FILE, 'problems_file_name'), (Lab, LABS_FILE, 'labs_file_name'),
+         (Refill, REFILLS_FILE, 'refills_file_name'), (VitalSigns, VITALS_FILE, 'vitals_file_name'),
+         (Immunization, IMMUNIZATIONS_FILE, 'immunizations_file_name'),
+         (Procedure, PROCEDURES_FILE, 'procedures_file_name'),
+         (SocialHistory, SOCIALHISTORY_FILE, 'histories_file_name'),
+         (FamilyHistory, FAMILYHISTORY_FILE, 'histories_file_name'),
+         (ClinicalNote, CLINICAL_NOTES_FILE, 'notes_file_name'),
+         (Allergy, ALLERGIES_FILE, 'allergies_file_name'),
+         (ImagingStudy, IMAGINGSTUDIES_FILE, 'studies_file_name'),
+         (Document, DOCUMENTS_FILE, 'documents_file_name')]
+
+def synthesizeFixtures(directory, scale):
+   """Writes the shipped data files to directory scale times over.  Copy 0
+is the shipped data; in copy k the PID and ID values get a '-k' suffix, so
+every copy is a distinct set of patients.  The copies are streamed, so
+fixtures of any scale take no more memory than the shipped data."""
+   for cls, file_name, keyword in LOADS:
+     source = csv.reader(open(file_name, newline='', encoding='utf-8'), dialect='excel-tab')
+     header = next(source)
+     rows = list(source)
+     keys = [header.index(c) for c in ('PID', 'ID') if c in header]
+     with open(os.path.join(directory, os.path.basename(file_name)), 'w', newline='', encoding='utf-8') as f:
+       out = csv.writer(f, dialect='excel-tab', lineterminator='\n')
+       out.writerow(header)
+       out.writerows(rows)
+       for k in range(1, scale):
+         suffix = "-%d"%k
+         for row in rows:
+           row = list(row)
+           for i in keys: row[i] += suffix
+           out.writerow(row)
+
+def clearStores():
+   """Empties the class-level stores the loaders fill"""
+   for cls, name in snapshot.STORES:
+     getattr(cls, name).clear()
+
+def best(fn, repeat, reset=None):
+   """The best time of repeat calls of fn(), calling reset() before each"""
+   times = []
+   for i in range(repeat):
+     if reset: reset()
+     times.append(timed(fn)[1])
+   return min(times)
+
+def benchSuite(scales, repeat=1):
+   """Times the stages on synthetic fixtures of each scale: each table's
+load(), Loinc.load, Refill.refill_list, writePatientData and fetch_document.
+Returns the results as a list of {'scale', 'stage', 'seconds', 'count'}
+dictionaries, seconds being the best of repeat runs and count the rows,
+calls or patients processed."""
+   import fhir
+   import docs
+   from generate import initVitalsPatient
+   results = []
+   def result(scale, stage, seconds, count):
+     results.append({'scale': scale, 'stage': stage, 'seconds': seconds, 'count': count})
+     print ("%6dx %-24s%10.3f s%10d%14.0f /s"%(scale, stage, seconds, count, count/max(seconds, 1e-9)))
+   for scale in scales:
+     directory = tempfile.mkdtemp(prefix='fixtures')
+     try:
+       synthesizeFixtures(directory, scale)
+       clearStores()
+       for cls, file_name, keyword in LOADS:
+         kw = {keyword: os.path.join(directory, os.path.basename(file_name))}
+         # Loads are timed on their own, so each repeat starts from empty
+         # stores of this table, with the tables loaded before it in place
+         stores = [name for c, name in snapshot.STORES if c is cls]
+         def reset():
+           for name in stores: getattr(cls, name).clear()
+         seconds = best(lambda: cls.load(**kw), repeat, reset)
+         result(scale, "%s.load"%cls.__name__, seconds, snapshot.rows(cls))
+       # The vitals patient's generated rows, as initData() adds them
+       initVitalsPatient()
+       codes = list(Lab.codes)
+       result(scale, "Loinc.load", best(lambda: Loinc.load(codes), repeat, Loinc.info.clear),
+              len(codes))
+       lookups = [(pid, m.rxn) for pid in Med.meds for m in Med.meds[pid]]
+       def refills():
+         for pid, rxn in lookups: Refill.refill_list(pid, rxn)
+       result(scale, "Refill.refill_list", best(refills, repeat), len(lookups))
+       # Documents and bundles are only timed for the shipped patients (copy
+       # 0), whose document files exist
+       shipped = [pid for pid in Patient.mpi if not '-' in pid]
+       documents = [(pid, d.file_name) for pid in shipped for d in Document.documents.get(pid, [])]
+       def fetch():
+         for pid, file_name in documents: docs.fetch_document(pid, file_name)
+       cachePath, entries = docs.cache.path, docs.cache.entries
+       try:
+         docs.cache.path = os.path.join(directory, 'cache')
+         def cold():
+           shutil.rmtree(docs.cache.path, True)
+           docs.cache.entries = {}
+         result(scale, "fetch_document (cold)", best(fetch, repeat, cold), len(documents))
+         result(scale, "fetch_document (warm)", best(fetch, repeat), len(documents))
+         output = os.path.join(directory, 'bundles')
+         os.mkdir(output)
+         def write():
+           for pid in shipped: fhir.FHIRSamplePatient(pid, output).writePatientData()
+         result(scale, "writePatientData", best(write, repeat), len(shipped))
+       finally:
+         docs.cache.path, docs.cache.entries = cachePath, entries
+     finally:
+       shutil.rmtree(directory, True)
+       for cls, file_name, keyword in LOADS:
+         index = rowindex.index_file(os.path.join(directory, os.path.basename(file_name)))
+         if os.path.exists(index): os.remove(index)
+   return results
+
+def version():
+   """The git commit of the working tree, if it is a git checkout"""
+   try:
+     return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                    stderr=subprocess.DEVNULL).decode().strip()
+   except (OSError, subprocess.CalledProcessError):
+     return None
+
+def saveResults(results, file_name, repeat):
+   """Writes suite results as JSON, with what is needed to compare them"""
+   with open(file_name, 'w') as f:
+     json.dump({'version': version(), 'python': platform.python_version(),
+                'machine': platform.machine(), 'repeat': repeat,
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'results': results}, f, indent=2)
+     f.write("\n")
+
+def compareResults(base, new, threshold=0.1):
+   """Prints the time of each stage of the new results against the base
+ones; stages more than threshold (and a millisecond) slower are flagged, as
+shorter differences are timer noise.  Returns the number of regressions."""
+   before = dict(((r['scale'], r['stage']), r) for r in base['results'])
+   print ("%s -> %s"%(base.get('version'), new.get('version')))
+   regressions = 0
+   for r in new['results']:
+     b = before.get((r['scale'], r['stage']))
+     if not b: continue
+     ratio = r['seconds']/max(b['seconds'], 1e-9)
+     flag = ''
+     if abs(r['seconds'] - b['seconds']) < 1e-3: pass
+     elif ratio > 1 + threshold:
+       flag = 'SLOWER'
+       regressions += 1
+     elif ratio < 1 - threshold: flag = 'faster'
+     print ("%6dx %-24s%10.3f s%10.3f s%8.2fx %s"%(r['scale'], r['stage'],
+         b['seconds'], r['seconds'], ratio, flag))
+   return regressions
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Test Data Benchmarks')
+  parser.add_argument('--render', action='store_true',
+     help='compares per-resource template render cost')
+  parser.add_argument('--templates', action='store_true',
+     help='compares loading the templates from source and from the compiled template cache')
+  parser.add_argument('--labs', metavar='rows', type=int,
+     help='times Lab.load on a synthetic labs file with the given number of rows')
+  parser.add_argument('--patient-load', dest='patientLoad', metavar='rows', type=int,
+     help='times loading one patient through the row index on a synthetic labs file')
+  parser.add_argument('--vitals', metavar='rows', type=int,
+     help='times the vitals pass for one patient with the given number of vitals rows')
+  parser.add_argument('--growth', metavar='rows', type=int,
+     help='times growth-curve vitals sampling for the given number of rows')
+  parser.add_argument('--bundle', metavar='MB', type=int,
+     help='writes a patient bundle with documents of the given size, reporting peak memory')
+  parser.add_argument('--memory', action='store_true',
+     help='reports the memory retained by each loaded table, in bytes per row')
+  parser.add_argument('--suite', metavar='scale', type=int, nargs='+',
+     help='times each stage on fixtures of the given scales (e.g. 1 100 10000) times the shipped data')
+  parser.add_argument('--output', metavar='file.json',
+     help='with --suite, writes the results as JSON to file.json')
+  parser.add_argument('--compare', metavar='file.json', nargs=2,
+     help='compares two --suite results files, flagging stages slower by more than --threshold')
+  parser.add_argument('--threshold', type=float, default=0.1,
+     help='slowdown flagged by --compare, as a fraction (default=0.1)')
+  parser.add_argument('--repeat', type=int, default=3,
+     help='number of timing repeats; the best is reported (default=3)')
+  args = parser.parse_args()
+
+  if args.suite:
+    results = benchSuite(args.suite, args.repeat)
+    if args.output: saveResults(results, args.output, args.repeat)
+    parser.exit()
+  if args.compare:
+    base, new = [json.load(open(f)) for f in args.compare]
+    parser.exit(1 if compareResults(base, new, args.threshold) else 0)
+  if args.render:
+    benchRender(args.repeat)
+    parser.exit()
+  if args.templates:
+    benchTemplates(args.repeat)
+    parser.exit()
+  if args.labs:
+    benchLabs(args.labs, args.repeat)
+    parser.exit()
+  if args.memory:
+    benchMemory()
+    parser.exit()
+  if args.patientLoad:
+    benchPatientLoad(args.patientLoad, args.repeat)
+    parser.exit()
+  if args.vitals:
+    benchVitals(args.vitals, args.repeat)
+    parser.exit()
+  if args.bundle:
+    benchBundle(args.bundle)
+    parser.exit()
+  if args.growth:
+    benchGrowth(args.growth, args.repeat)
+    parser.exit()
+  parser.error("No arguments given")
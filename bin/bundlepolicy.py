@@ -0,0 +1,164 @@
+"""Bundle sizing: caps on the resources and bytes of a bundle.
+
+Under a BundlePolicy, a patient too large for one bundle is split over
+several (patient-<pid>.fhir-bundle.xml, then .part2.xml, .part3.xml, ...),
+and patients small enough are packed together into one bundle, named after
+the first and last of them (patients-<pid>-<pid>.fhir-bundle.xml).
+
+The Patient resource always comes first, with the photograph Binaries it
+refers to.  The other resources keep the order FHIRSamplePatient.resources()
+gives them, in which every reference is to an earlier resource, so a split
+patient only ever refers to resources in the same or an earlier part.  Parts
+must therefore be posted in order (upload.py does)."""
+from fhir import bundleFileName, bundleHeader, writeEntry, BUNDLE_FOOTERS
+from bundlewriter import BundleWriter
+import tempfile
+import os
+
+SPOOL_SIZE = 8*1024*1024 # Rendered entries of a patient beyond this are spooled to disk
+GROUP_SIZE = 100 # Patients per group; bundles are packed within a group only
+COPY_SIZE = 1024*1024 # Bytes per read when copying entries into a bundle
+
+class BundlePolicy(object):
+    """At most maxResources entries and maxBytes bytes per bundle (None for
+    no limit).  A single resource larger than maxBytes still gets a bundle
+    of its own."""
+
+    def __init__(self, maxResources=None, maxBytes=None):
+        self.maxResources = maxResources
+        self.maxBytes = maxBytes
+
+    def __bool__(self):
+        return bool(self.maxResources or self.maxBytes)
+
+    def fits(self, resources, size):
+        return (not self.maxResources or resources <= self.maxResources) and \
+               (not self.maxBytes or size <= self.maxBytes)
+
+class Entries(object):
+    """A patient's bundle entries, rendered once into a spooled file and
+    grouped into units that are never split: the Patient with its photograph
+    Binaries, then each other resource."""
+
+    def __init__(self, patient, format, prefix, now):
+        self.pid = patient.pid
+        self.file = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        writer = BundleWriter(self.file)
+        entries = [] # (resource id, offset, length)
+        head = 0
+        for template, context in patient.resources(prefix, now):
+            start = writer.tell()
+            writeEntry(writer, format, template, context)
+            entries.append((context['id'], start, writer.tell() - start))
+            if template == 'patient': head = len(entries)
+        writer.close()
+        entries = entries[head-1:head] + entries[:head-1] + entries[head:]
+        self.units = [entries[:head]] + [[e] for e in entries[head:]]
+        self.resources = len(entries)
+        self.size = sum(e[2] for e in entries)
+
+    def read(self, offset, length):
+        """Yields the bytes of an entry in blocks"""
+        self.file.seek(offset)
+        while length > 0:
+            data = self.file.read(min(length, COPY_SIZE))
+            length -= len(data)
+            yield data
+
+    def close(self):
+        self.file.close()
+
+class BundlePacker(object):
+    """Writes the bundles of a sequence of patients to path under a policy.
+    Each patient is added whole to the open bundle if it fits, or else to a
+    new one, or else split over bundles of its own."""
+
+    def __init__(self, path, format, policy, now):
+        self.path = path
+        self.format = format
+        self.policy = policy
+        self.now = now
+        self.footer = BUNDLE_FOOTERS[format]
+        self.writer = None
+        self.resources = self.size = 0
+        self.appended = 0 # Resources appended to all the bundles
+        self.written = 0 # Bytes of the bundles closed
+
+    def tell(self):
+        """The number of bytes written to all the bundles so far"""
+        return self.written + (self.writer.tell() if self.writer else 0)
+
+    def add(self, patient, prefix=None):
+        """Adds a patient's resources; returns the number of resources and of
+        bytes this wrote, including the headers and footers of the bundles
+        it opened and closed"""
+        start, appended = self.tell(), self.appended
+        entries = Entries(patient, self.format, prefix, self.now)
+        try:
+            if self.writer and self.fits(entries.resources, entries.size):
+                self.append(entries, entries.units)
+            else:
+                self.close()
+                self.open(patient)
+                if self.fits(entries.resources, entries.size):
+                    self.append(entries, entries.units)
+                else:
+                    for unit in entries.units:
+                        if self.resources and not self.fits(len(unit), sum(e[2] for e in unit)):
+                            self.close()
+                            self.open(patient, self.part + 1)
+                        self.append(entries, [unit])
+                    self.close() # A split patient shares its bundles with no one
+        finally:
+            entries.close()
+        return self.appended - appended, self.tell() - start
+
+    def fits(self, resources, size):
+        # JSON entries are separated by ",\n", counted with each entry
+        separators = 2*resources if self.format == 'json' else 0
+        return self.policy.fits(self.resources + resources, self.size + size + separators)
+
+    def open(self, patient, part=1):
+        self.pids = [patient.pid]
+        self.part = part
+        self.ids = set()
+        self.resources = 0
+        self.temp = os.path.join(self.path, ".%s.tmp"%bundleFileName(patient.pid, self.format, part))
+        self.writer = BundleWriter(self.temp)
+        header = bundleHeader(self.format, patient.ids.next("Bundle"), self.now)
+        self.writer.write(header)
+        self.size = len(header.encode('utf-8')) + len(self.footer.encode('utf-8'))
+
+    def append(self, entries, units):
+        for unit in units:
+            for id, offset, length in unit:
+                # Shared resources (the Practitioner) go in a bundle only once
+                if id in self.ids: continue
+                self.ids.add(id)
+                if self.format == 'json':
+                    self.writer.write(",\n" if self.resources else "\n")
+                    self.size += 2
+                for data in entries.read(offset, length):
+                    self.writer.writeBytes(data)
+                self.resources += 1
+                self.appended += 1
+                self.size += length
+        if self.pids[-1] != entries.pid: self.pids.append(entries.pid)
+
+    def close(self):
+        """Finishes the open bundle, if any, naming it after its patients.
+        Returns the number of bytes this wrote (the footer)."""
+        if not self.writer: return 0
+        start = self.writer.tell()
+        self.writer.write(self.footer)
+        self.writer.close()
+        self.written += self.writer.tell()
+        if len(self.pids) > 1:
+            name = "patients-%s-%s.fhir-bundle.%s"%(self.pids[0], self.pids[-1], self.format)
+        else:
+            name = bundleFileName(self.pids[0], self.format, self.part)
+        os.replace(self.temp, os.path.join(self.path, name))
+        size = self.writer.tell() - start
+        self.writer = None
+        self.resources = self.size = 0
+        return size
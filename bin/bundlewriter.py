@@ -0,0 +1,103 @@
+"""Buffered writing of bundle files, with bounded memory"""
+from docs import Base64Content
+import instrument
+import json
+import time
+
+BUFFER_SIZE = 1024*1024 # Bytes collected before they are written to the file
+
+# Totals over the bundles written by this process
+stats = {'files': 0, 'bytes': 0, 'flushes': 0}
+
+class StreamingEncoder(json.JSONEncoder):
+    """JSON encoder writing Base64Content values as markers, which
+    BundleWriter.writeJSON replaces with the content streamed chunk by chunk"""
+
+    def __init__(self):
+        json.JSONEncoder.__init__(self)
+        self.streams = []
+
+    def default(self, o):
+        if isinstance(o, Base64Content):
+            self.streams.append(o)
+            return "\0stream\0"
+        return json.JSONEncoder.default(self, o)
+
+# A marker as it appears in the encoded JSON
+MARKER = json.dumps("\0stream\0")
+
+class BundleWriter(object):
+    """Writes text to a file as UTF-8 through a buffer of about size bytes.
+
+    The buffer is written out in one call whenever it fills, so a bundle
+    takes a few large writes whatever its size, and memory never holds more
+    than the buffer and the chunk being added.  Counts the bytes written and
+    the flushes (writes to the file).  file_name can also be an open binary
+    file, which is then left open and not counted in the stats."""
+
+    def __init__(self, file_name, size=BUFFER_SIZE):
+        self.owned = isinstance(file_name, str)
+        self.file = open(file_name, 'wb', buffering=0) if self.owned else file_name
+        self.size = size
+        self.chunks = []
+        self.pending = 0
+        self.bytes = 0
+        self.flushes = 0
+
+    def write(self, text):
+        self.writeBytes(text.encode('utf-8'))
+
+    def writeBytes(self, data):
+        self.chunks.append(data)
+        self.pending += len(data)
+        if self.pending >= self.size: self.flush()
+
+    def writelines(self, texts):
+        """Writes each text in turn, e.g. the pieces of template.generate()"""
+        for text in texts:
+            self.write(text)
+
+    def writeJSON(self, o):
+        """Writes o as JSON like json.dump, streaming any Base64Content in it
+        (see docs) rather than building its text as one string"""
+        encoder = StreamingEncoder()
+        for chunk in encoder.iterencode(o):
+            if MARKER in chunk:
+                before, marker, after = chunk.partition(MARKER)
+                self.write(before + '"')
+                self.writelines(encoder.streams.pop(0))
+                chunk = '"' + after
+            self.write(chunk)
+
+    def flush(self):
+        if not self.chunks: return
+        if instrument.enabled: start = time.perf_counter()
+        self.file.write(b''.join(self.chunks))
+        if instrument.enabled and self.owned:
+            instrument.record('stage', 'write', time.perf_counter() - start, 0, self.pending)
+        self.bytes += self.pending
+        self.flushes += 1
+        self.chunks = []
+        self.pending = 0
+
+    def tell(self):
+        """The number of bytes written so far, buffered or not"""
+        return self.bytes + self.pending
+
+    def close(self):
+        self.flush()
+        if not self.owned: return
+        self.file.close()
+        stats['files'] += 1
+        stats['bytes'] += self.bytes
+        stats['flushes'] += self.flushes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def report(counts=stats):
+    return "Bundle writer: %d files, %.1f MB in %d flushes"%(
+        counts['files'], counts['bytes']/1e6, counts['flushes'])
@@ -1,31 +1,33 @@
 from testdata import CLINICAL_NOTES_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class ClinicalNote: 
     """Create instances of Clinical Note; 
 also maintains complete clinical notes lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'date', 'title', 'mime_type', 'file_name',
+                 'content', 'binary_id', 'system', 'code', 'display')
+
     clinicalNotes = {} # Dictionary of clinical notes lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient clinical notes"""
+    def load(cls,pid=None,notes_file_name=CLINICAL_NOTES_FILE):
+      """Loads patient clinical notes (only patient pid's, if given)"""
       
       # Loop through clinical notes and build patient clinical notes lists:
-      probs = csv.reader(open(CLINICAL_NOTES_FILE,'U'),dialect='excel-tab')
-      # header = probs.next()
-      header = next(probs)
+      header, probs = rowindex.reader(notes_file_name, pid)
       for prob in probs:
           cls(dict(zip(header,prob))) # Create a clinical note instance 
 
     def __init__(self,p):
         self.id = p['ID']
-        self.pid = p['PID']
-        self.date = p['DATE']
+        self.pid = intern(p['PID'])
+        self.date = intern(p['DATE'])
         self.title = p['TITLE']
-        self.mime_type = p['MIME_TYPE']
+        self.mime_type = intern(p['MIME_TYPE'])
         self.file_name = p['FILE_NAME']
         
         # Append clinical note to the patient's clinical notes list:
@@ -51,7 +53,7 @@ if __name__== '__main__':
      help='display clinical notes for a given patient id (default=2169591)')
   args = parser.parse_args()
  
-  ClinicalNote.load()
+  ClinicalNote.load(pid=args.pid)
   if args.pid:
     if not args.pid in ClinicalNote.clinicalNotes:
       parser.error("No results found for pid = %s"%args.pid)
@@ -1,5 +1,6 @@
 """Module for importing code mapping files: only LOINC required for now"""
-from testdata import LOINC_FILE
+from testdata import LOINC_FILE, LOINC_INDEX
+import rowindex
 import argparse
 import csv
 
@@ -7,19 +8,39 @@ class Loinc:
     """Creates loinc code instances and holds global loinc dictionary"""
     info = {} # Dictionary of loinc code information
 
+    BATCH = 500 # Codes per lookup query (below SQLite's bound parameter limit)
+
     @classmethod
     def load(cls,loinc_list):
       """Loads code_info dictionary for LOINC codes in loinc_list"""
-      
-      # Open data file and read in the first (header) record
-      loincs = csv.reader(open(LOINC_FILE,'U'),dialect='excel-tab')
-      header = next(loincs)
-      # header = loincs.next() 
-      # Now, read in loinc codes:
-      for loinc in loincs: 
-        l = dict(zip(header,loinc)) # build row dictionary of values
-        if l['LOINC_NUM'] in loinc_list: # See if we're interested in this code  
-          cls(l) # If so, creat a loinc instance and store it in Loinc.info
+
+      # Look the codes up in the index instead of scanning the whole file
+      db = cls.index()
+      header = [c[1] for c in db.execute("PRAGMA table_info(loinc)")]
+      codes = list(loinc_list)
+      for i in range(0, len(codes), cls.BATCH):
+        batch = codes[i:i+cls.BATCH]
+        query = "SELECT * FROM loinc WHERE LOINC_NUM IN (%s)"%",".join("?"*len(batch))
+        for loinc in db.execute(query, batch):
+          cls(dict(zip(header,loinc))) # creat a loinc instance and store it in Loinc.info
+      db.close()
+
+    @classmethod
+    def index(cls,loinc_file_name=LOINC_FILE,index_file_name=LOINC_INDEX):
+      """Returns a connection to the SQLite index of the LOINC file,
+      (re)building it first if it is missing or older than the file"""
+      return rowindex.connect(loinc_file_name, index_file_name, cls.fill)
+
+    @classmethod
+    def fill(cls,db,loinc_file_name):
+      """Fills the SQLite index of the LOINC file, keyed by LOINC_NUM"""
+      with open(loinc_file_name, newline='', encoding='utf-8') as f:
+        loincs = csv.reader(f,dialect='excel-tab')
+        header = next(loincs)
+        db.execute("CREATE TABLE loinc (%s, PRIMARY KEY (LOINC_NUM)) WITHOUT ROWID"%
+                   ", ".join("%s TEXT"%h for h in header))
+        db.executemany("INSERT OR REPLACE INTO loinc VALUES (%s)"%",".join("?"*len(header)),
+                       (loinc for loinc in loincs if len(loinc) == len(header)))
 
     def __init__(self,l):
         """Creates a loinc instance and save it in Loinc.info"""
@@ -0,0 +1,194 @@
+"""Synthetic patient cohorts of any size, for load testing.
+
+Patients are sampled from distribution tables built from the shipped data
+files (how many labs, meds and problems a patient has, and which ones), with
+growth-curve vitals from vitalspatientgenerator.  They are generated one at
+a time and streamed into data files or straight into bundles, so memory use
+does not grow with the size of the cohort."""
+from testdata import DATA_PATH, PATIENTS_FILE, VITALS_FILE, LABS_FILE, MEDS_FILE, PROBLEMS_FILE
+from testdata import rndName, rndAddress, rndTelephone, rndGestAge, toEmail, stream
+from vitalspatientgenerator import generate_patient
+from patient import Patient
+from vitals import VitalSigns
+from lab import Lab
+from med import Med
+from problem import Problem
+from codes import Loinc
+from collections import Counter
+from itertools import accumulate
+import datetime
+import testdata
+import rowindex
+import argparse
+import glob
+import csv
+import ids
+import os
+
+START_PID = 20000000 # Cohort patient ids count up from here, clear of the shipped ones
+LAST_DATE = datetime.date(2012, 12, 31) # Sampled lab, med and problem dates end here
+
+# The tables of a cohort, with the data files they are written to
+TABLES = (('patients', PATIENTS_FILE), ('vitals', VITALS_FILE), ('labs', LABS_FILE),
+          ('meds', MEDS_FILE), ('problems', PROBLEMS_FILE))
+
+# Columns of the shipped rows sampled together, for the tables with sampled rows
+SAMPLED = {'labs': ('LOINC', 'SCALE', 'NAME', 'VALUE', 'LOW', 'HIGH', 'UNITS'),
+           'meds': ('RxNorm', 'Name', 'SIG', 'Q', 'DAYS', 'REFILLS', 'Q_TO_TAKE_VALUE',
+                    'Q_TO_TAKE_UNIT', 'FREQUENCY_VALUE', 'FREQUENCY_UNIT'),
+           'problems': ('SNOMED', 'NAME')}
+DATES = {'labs': 'DATE', 'meds': 'START_DATE', 'problems': 'START_DATE'}
+
+class Distribution(object):
+    """A discrete distribution over values with the given counts, sampled by
+    binary search of the cumulative counts"""
+
+    def __init__(self, counts):
+        self.values = list(counts)
+        self.cum_weights = list(accumulate(counts.values()))
+
+    def sample(self, rng, k=1):
+        """Returns a list of k values drawn with rng"""
+        return rng.choices(self.values, cum_weights=self.cum_weights, k=k)
+
+class Cohort(object):
+    """Synthesizes patients resembling the shipped ones, numbered from start"""
+
+    def __init__(self, start=START_PID):
+        self.start = start
+        self.headers = {}
+        header, rows = rowindex.reader(PATIENTS_FILE)
+        patients = [dict(zip(header, row)) for row in rows]
+        self.headers['patients'] = header
+        self.headers['vitals'] = next(csv.reader(open(VITALS_FILE), dialect='excel-tab'))
+        self.genders = Distribution(Counter(p['gender'] for p in patients))
+        self.races = Distribution(Counter(p['RACE'] for p in patients))
+        self.counts = {} # Distribution of the number of rows per patient, by table
+        self.rows = {}   # Distribution of the SAMPLED column values, by table
+        for table, file_name in TABLES:
+            if not table in SAMPLED: continue
+            header, rows = rowindex.reader(file_name)
+            self.headers[table] = header
+            pindex = header.index('PID')
+            columns = [header.index(c) for c in SAMPLED[table]]
+            perPatient, values = Counter(), Counter()
+            for row in rows:
+                perPatient[row[pindex]] += 1
+                values[tuple(row[c] for c in columns)] += 1
+            self.counts[table] = Distribution(Counter(perPatient[p['PID']] for p in patients))
+            self.rows[table] = Distribution(values)
+
+    def patient(self, n):
+        """Returns the pid and the row dictionaries, by table, of patient n.
+        Each patient draws from its own random stream, so with a seed a
+        patient is the same however many others are generated."""
+        pid = str(self.start + n)
+        rng = stream('cohort', pid)
+        gender = self.genders.sample(rng)[0]
+        GENDER = 'M' if gender == 'male' else 'F'
+        vp = generate_patient(rng, pid)
+        name = rndName(GENDER, rng)
+        p = dict(rndAddress(rng)) # A copy, as rndAddress returns shared dictionaries
+        p.update({'PID': pid, 'GENDER': GENDER, 'gender': gender,
+                  'RACE': self.races.sample(rng)[0], 'dob': vp['birthday'],
+                  'YOB': vp['birthday'][:4], 'fname': name[0], 'initial': name[1],
+                  'lname': name[2], 'email': toEmail(name),
+                  'home': '' if rng.randint(0,1) else rndTelephone(rng),
+                  'cell': '' if rng.randint(0,1) else rndTelephone(rng),
+                  'gestage': '' if rng.randint(0,1) else rndGestAge(rng)})
+        tables = {'patients': [p],
+                  'vitals': VitalSigns.vitalsPatientRows(vp, "%s-vp-"%pid)}
+        first = datetime.date(*map(int, vp['birthday'].split('-'))).toordinal()
+        last = LAST_DATE.toordinal()
+        for table in SAMPLED:
+            k = self.counts[table].sample(rng)[0]
+            dates = sorted(rng.randint(first, last) for i in range(k))
+            rows = []
+            for i, (values, date) in enumerate(zip(self.rows[table].sample(rng, k), dates)):
+                row = dict.fromkeys(self.headers[table], '')
+                row.update(zip(SAMPLED[table], values))
+                row.update({'ID': "%s-%d"%(pid, i+1), 'PID': pid,
+                            DATES[table]: datetime.date.fromordinal(date).isoformat()})
+                rows.append(row)
+            tables[table] = rows
+        return pid, tables
+
+    def patients(self, count):
+        """Yields (pid, rows by table) for the first count patients"""
+        for n in range(count):
+            yield self.patient(n)
+
+def writeData(cohort, count, path):
+    """Writes count cohort patients as data files in path, patient by patient.
+    The data files without cohort rows get just their header, so path can
+    stand in for the data directory."""
+    files = {}
+    for table, file_name in TABLES:
+        f = open(os.path.join(path, os.path.basename(file_name)), 'w', newline='')
+        files[table] = (f, csv.writer(f, dialect='excel-tab', lineterminator='\n'),
+                        cohort.headers[table])
+        files[table][1].writerow(cohort.headers[table])
+    written = set(os.path.basename(file_name) for table, file_name in TABLES)
+    for file_name in glob.glob(os.path.join(DATA_PATH, '*.txt')):
+        if os.path.basename(file_name) in written: continue
+        with open(file_name) as source, open(os.path.join(path, os.path.basename(file_name)), 'w') as f:
+            f.write(source.readline())
+    for pid, tables in cohort.patients(count):
+        for table, rows in tables.items():
+            f, writer, header = files[table]
+            writer.writerows([row[c] for c in header] for row in rows)
+    for f, writer, header in files.values():
+        f.close()
+
+def writeFHIR(cohort, count, path, format='xml', idStrategy='hash'):
+    """Writes the bundles of count cohort patients to path.  Each patient is
+    added to the data stores only while its bundle is written."""
+    import fhir
+    from generate import writeBundle
+    Loinc.load(set(values[0] for values in cohort.rows['labs'].values))
+    for index, (pid, tables) in enumerate(cohort.patients(count)):
+        Patient(tables['patients'][0])
+        VitalSigns.extend(pid, [VitalSigns.record(m) for m in tables['vitals']])
+        rng = stream('accession', pid)
+        Lab.results.extend(pid, [Lab.record(o, None, rng) for o in tables['labs']])
+        for m in tables['meds']: Med(m)
+        for p in tables['problems']: Problem(p)
+        writeBundle(fhir.FHIRSamplePatient(pid, path, ids=ids.allocator(idStrategy, pid, index)),
+                    None, format)
+        # Drop the patient, so the stores never hold more than one
+        del Patient.mpi[pid]
+        Med.meds.pop(pid, None)
+        Problem.problems.pop(pid, None)
+        VitalSigns.vitals.clear()
+        VitalSigns.encounters.clear()
+        Lab.results.clear()
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='Synthetic Cohort Generator')
+  parser.add_argument('count', type=int, help='number of patients to generate')
+  group = parser.add_mutually_exclusive_group(required=True)
+  group.add_argument('--data', metavar='dir',
+     help='writes the cohort as data files (patients.txt, vitals.txt, ...) to dir')
+  group.add_argument('--write-fhir', dest='writeFHIR', metavar='dir',
+     help='writes a bundle per cohort patient to dir')
+  parser.add_argument('--format', choices=('xml','json'), default='xml',
+     help='output format of the bundles (default=xml)')
+  parser.add_argument('--ids', choices=sorted(ids.STRATEGIES), default='hash',
+     help='bundle id allocation (default=hash)')
+  parser.add_argument('--seed', metavar='N', type=int,
+     help='seeds every patient\'s random stream, so the cohort is reproducible')
+  parser.add_argument('--start', metavar='pid', type=int, default=START_PID,
+     help='id of the first patient (default=%d)'%START_PID)
+  args = parser.parse_args()
+
+  testdata.SEED = args.seed
+  path = args.data or args.writeFHIR
+  if not os.path.exists(path):
+    parser.error("Invalid path: '%s'.Path must already exist."%path)
+  cohort = Cohort(args.start)
+  if args.data:
+    writeData(cohort, args.count, path)
+  else:
+    writeFHIR(cohort, args.count, path, args.format, args.ids)
+  print ("Done writing %d cohort patients to %s"%(args.count, path))
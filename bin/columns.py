@@ -0,0 +1,121 @@
+"""Column-oriented storage for large per-patient tables (labs and vitals)"""
+from collections.abc import Mapping, Sequence
+from array import array
+
+MISSING = float('nan') # Numeric columns hold nan where the source value is empty
+
+def toFloat(value):
+    """Converts a source value to float for a numeric column, nan if it is not a number"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return MISSING
+
+def field(name, numeric=False):
+    """Property reading a Row's value from the store column of the given name.
+    Missing numeric values read as None, so float() and int() of them fail
+    as they did for the empty strings they come from."""
+    if numeric:
+        def get(self):
+            value = self.store.columns[name][self.row]
+            return None if value != value else value
+    else:
+        def get(self):
+            return self.store.columns[name][self.row]
+    return property(get)
+
+class Row(object):
+    """A lazy view of one row of a ColumnStore.
+
+    The ColumnStore gives its record class a property per field, reading
+    the store's columns.  Subclasses add slots for the attributes set on a
+    row while it is being rendered."""
+
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+class RowsView(Sequence):
+    """The rows of one patient in a ColumnStore, as a sequence of Row views"""
+
+    def __init__(self, store, start, stop):
+        self.store = store
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        return self.store.record(self.store, self.start + i)
+
+    def __iter__(self):
+        record, store = self.store.record, self.store
+        for row in range(self.start, self.stop):
+            yield record(store, row)
+
+    def column(self, name):
+        """Returns this patient's values of a column, without building rows"""
+        return self.store.columns[name][self.start:self.stop]
+
+class ColumnStore(Mapping):
+    """Holds a table as one column per field, with each patient's rows kept
+    contiguous and located by a per-patient (start, stop) offset index.
+
+    Numeric fields are array('d') columns converted once when the rows are
+    added; other fields are lists.  As a mapping the store gives, for each
+    patient id, a RowsView whose rows are instances of record (a Row
+    subclass), so store[pid] can be used like the former lists of objects."""
+
+    def __init__(self, record, fields, numeric=()):
+        self.record = record
+        self.fields = tuple(fields)
+        self.numeric = tuple(numeric)
+        for f in self.fields:
+            setattr(record, f, field(f, f in self.numeric))
+        self.clear()
+
+    def clear(self):
+        self.columns = dict((f, array('d') if f in self.numeric else [])
+                            for f in self.fields)
+        self.offsets = {} # (start, stop) of each patient's rows, by patient id
+        self.size = 0
+
+    def __getitem__(self, pid):
+        start, stop = self.offsets[pid]
+        return RowsView(self, start, stop)
+
+    def __contains__(self, pid):
+        return pid in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def extend(self, pid, records):
+        """Appends records, sequences of values in field order, to the rows
+        of patient pid.  Numeric values are converted to float here."""
+        records = list(records)
+        if not records: return
+        if pid in self.offsets and self.offsets[pid][1] != self.size:
+            # The patient's rows are no longer at the end: move them there
+            # so they stay contiguous (the old rows are left unused)
+            start, stop = self.offsets[pid]
+            for column in self.columns.values():
+                column.extend(column[start:stop])
+            self.offsets[pid] = (self.size, self.size + stop - start)
+            self.size += stop - start
+        start = self.offsets[pid][0] if pid in self.offsets else self.size
+        for field, values in zip(self.fields, zip(*records)):
+            column = self.columns[field]
+            column.extend(map(toFloat, values) if field in self.numeric else values)
+        self.size += len(records)
+        self.offsets[pid] = (start, self.size)
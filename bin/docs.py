@@ -1,28 +1,164 @@
-import os
-import hashlib
-import base64
-
-BASE_DOCUMENTS_PATH = os.path.join('..','data','documents')
-
-def compute_hash(fileName):
-    """Compute sha1 hash of the specified file"""
-    m = hashlib.sha1()
-    try:
-        fd = open(fileName,"rb")
-    except IOError:
-        print ("Unable to open the file in readmode:", fileName)
-        return
-    content = fd.readlines()
-    fd.close()
-    for eachLine in content:
-        m.update(eachLine)
-    return m.hexdigest()
-   
-def fetch_document(pid, filename):
-    path = os.path.join(BASE_DOCUMENTS_PATH, pid, filename)
-    hash = compute_hash(path)
-    file_size = os.path.getsize(path)
-    f = open(path, 'rb')
-    encoded_file_content = base64.b64encode(f.read())
-    f.close()
-    return {'path': path, 'hash': hash, 'size': file_size, 'base64_content': encoded_file_content}
\ No newline at end of file
+from testdata import DOCUMENTS_CACHE_PATH
+import os
+import json
+import atexit
+import shutil
+import hashlib
+import base64
+import glob
+import tempfile
+import instrument
+
+BASE_DOCUMENTS_PATH = os.path.join('..','data','documents')
+# A multiple of 3 bytes, so base64 chunks concatenate without padding
+CHUNK_SIZE = 3*256*1024
+
+def compute_hash(fileName):
+    """Compute sha1 hash of the specified file"""
+    m = hashlib.sha1()
+    try:
+        fd = open(fileName,"rb")
+    except IOError:
+        print ("Unable to open the file in readmode:", fileName)
+        return
+    for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+        m.update(chunk)
+    fd.close()
+    return m.hexdigest()
+
+def encode_file(fileName, out):
+    """Reads fileName once, in chunks, writing its base64 text to the binary
+    file out.  Returns the sha1 hex digest and the size of the file."""
+    m = hashlib.sha1()
+    size = 0
+    with open(fileName, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            m.update(chunk)
+            size += len(chunk)
+            out.write(base64.b64encode(chunk))
+    return m.hexdigest(), size
+
+class Base64Content(object):
+    """Base64 text of a document, streamed from its encoded file in chunks.
+
+    Iterating yields str chunks, so a template can write the content piece by
+    piece with {% for chunk in b.content %}; str() returns the whole text."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'r') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                yield chunk
+
+    def __len__(self):
+        return os.path.getsize(self.path)
+
+    def __str__(self):
+        return ''.join(self)
+
+class DocumentCache(object):
+    """Caches the hash, size and base64 content of document files.
+
+    Entries are keyed by the file's resolved real path, mtime and size, so
+    symlinks to one file share an entry and edited files are re-read.  Entries
+    live in memory for the current run and, when path is set, on disk so they
+    are shared across runs and worker processes.  Without a path the encoded
+    content goes to a temporary directory removed at exit.  Saving the entry
+    of an edited file removes the file's earlier entries from disk.
+
+    Only the hash and size are held in memory; the base64 text stays in its
+    .b64 file and is streamed from there (see Base64Content)."""
+
+    def __init__(self, path=DOCUMENTS_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def key(self, path):
+        real_path = os.path.realpath(path)
+        st = os.stat(real_path)
+        return (real_path, st.st_mtime_ns, st.st_size)
+
+    def fetch(self, path):
+        """Returns {'hash', 'size', 'base64_content'} for the file at path,
+        with the content as a Base64Content stream"""
+        key = self.key(path)
+        if key in self.entries:
+            self.stats['hits'] += 1
+            return self.entries[key]
+        entry = self.load(key)
+        if entry:
+            self.stats['disk_hits'] += 1
+        else:
+            self.stats['misses'] += 1
+            entry = self.save(key)
+        self.entries[key] = entry
+        return entry
+
+    def temporary(self):
+        """Switches to a temporary cache directory, removed at exit"""
+        self.path = tempfile.mkdtemp(prefix='documents')
+        atexit.register(shutil.rmtree, self.path, True)
+
+    def file_name(self, key):
+        """<sha1 of the real path>.<sha1 of the key>, so the entries of one
+        file share a prefix"""
+        if not self.path: self.temporary()
+        return os.path.join(self.path, "%s.%s"%(
+            hashlib.sha1(key[0].encode('utf-8')).hexdigest(),
+            hashlib.sha1(repr(key).encode('utf-8')).hexdigest()))
+
+    def prune(self, key):
+        """Removes the entries of earlier versions of the file from disk"""
+        name = self.file_name(key)
+        prefix = name[:name.rindex('.')]
+        for old in glob.glob(glob.escape(prefix)+'.*'):
+            # Leave the files other workers are still writing
+            if old.startswith(name+'.') or old.endswith('.tmp'): continue
+            try:
+                os.remove(old)
+            except OSError: pass
+
+    def load(self, key):
+        name = self.file_name(key)
+        try:
+            with open(name+'.json') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if not os.path.exists(name+'.b64'): return None
+        entry['base64_content'] = Base64Content(name+'.b64')
+        return entry
+
+    def save(self, key):
+        """Encodes the file in a single pass into the cache and returns its entry"""
+        name = self.file_name(key)
+        directory = os.path.dirname(name)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        # Write to temporary files first so concurrent workers never see a
+        # partial entry; the metadata goes last as it marks the entry valid
+        tmp = "%s.%d.tmp"%(name, os.getpid())
+        with open(tmp, 'wb') as f:
+            hash, size = encode_file(key[0], f)
+        os.replace(tmp, name+'.b64')
+        with open(tmp, 'w') as f:
+            json.dump({'path': key[0], 'hash': hash, 'size': size}, f)
+        os.replace(tmp, name+'.json')
+        self.prune(key)
+        return {'hash': hash, 'size': size, 'base64_content': Base64Content(name+'.b64')}
+
+    def report(self):
+        return "Document cache: %d hits (%d from disk), %d misses"%(
+            self.stats['hits']+self.stats['disk_hits'], self.stats['disk_hits'], self.stats['misses'])
+
+cache = DocumentCache()
+
+def fetch_document(pid, filename):
+    path = os.path.join(BASE_DOCUMENTS_PATH, pid, filename)
+    with instrument.stage('fetch_document') as s:
+        data = cache.fetch(path)
+        s.bytes = data['size']
+    return {'path': path, 'hash': data['hash'], 'size': data['size'], 'base64_content': data['base64_content']}
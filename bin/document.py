@@ -1,34 +1,36 @@
 from testdata import DOCUMENTS_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class Document: 
     """Create instances of Document; 
 also maintains complete documents lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'date', 'title', 'mime_type', 'file_name', 'type',
+                 'content', 'size', 'hash', 'binary_id', 'system', 'code', 'display')
+
     documents = {} # Dictionary of documents lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient documents"""
+    def load(cls,pid=None,documents_file_name=DOCUMENTS_FILE):
+      """Loads patient documents (only patient pid's, if given)"""
       
       # Loop through documents and build patient documents lists:
-      probs = csv.reader(open(DOCUMENTS_FILE,'U'),dialect='excel-tab')
-      # header = probs.next() 
-      header = next(probs)
+      header, probs = rowindex.reader(documents_file_name, pid)
 
       for prob in probs:
           cls(dict(zip(header,prob))) # Create a clinical note instance 
 
     def __init__(self,p):
         self.id = p['ID']
-        self.pid = p['PID']
-        self.date = p['DATE']
+        self.pid = intern(p['PID'])
+        self.date = intern(p['DATE'])
         self.title = p['TITLE']
-        self.mime_type = p['MIME_TYPE']
+        self.mime_type = intern(p['MIME_TYPE'])
         self.file_name = p['FILE_NAME']
-        self.type = p['TYPE']
+        self.type = intern(p['TYPE'])
         
         # Append document to the patient's documents list:
         if self.pid in  self.__class__.documents:
@@ -53,7 +55,7 @@ if __name__== '__main__':
      help='display documents for a given patient id (default=2169591)')
   args = parser.parse_args()
  
-  Document.load()
+  Document.load(pid=args.pid)
   if args.pid:
     if not args.pid in Document.documents:
       parser.error("No results found for pid = %s"%args.pid)
@@ -1,33 +1,35 @@
 from testdata import FAMILYHISTORY_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 class FamilyHistory: 
     """Create instances of FamilyHistory and maintain FamilyHistory lists by patient ID"""
 
+    __slots__ = ('id', 'patientid', 'relativecode', 'relativetitle', 'dateofbirth',
+                 'dateofdeath', 'problemcode', 'problemtitle', 'heightcm')
+
     familyHistories = {} # Dictionary of FamilyHistory lists by patient ID
 
     @classmethod
-    def load(cls):
-        """Loads patient family histories"""
+    def load(cls,pid=None,histories_file_name=FAMILYHISTORY_FILE):
+        """Loads patient family histories (only patient pid's, if given)"""
       
         # Loop through family histories and build patient FamilyHistory lists:
-        histories = csv.reader(open(FAMILYHISTORY_FILE,'U'),dialect='excel-tab')
-        # header = histories.next() 
-        header = next(histories)
+        header, histories = rowindex.reader(histories_file_name, pid)
         for history in histories:
             cls(dict(zip(header,history))) # Create a FamilyHistory instance 
 
     def __init__(self,fh):
         self.id = fh['ID']
-        self.patientid = fh['PID']
-        self.relativecode = fh['RELATIVE_CODE']
-        self.relativetitle = fh['RELATIVE_TITLE'] 
-        self.dateofbirth = fh['DATE_OF_BIRTH']
-        self.dateofdeath = fh['DATE_OF_DEATH']
-        self.problemcode = fh['PROBLEM_CODE']
-        self.problemtitle = fh['PROBLEM_TITLE'] 
-        self.heightcm = fh['HEIGHT_CM'] 
+        self.patientid = intern(fh['PID'])
+        self.relativecode = intern(fh['RELATIVE_CODE'])
+        self.relativetitle = intern(fh['RELATIVE_TITLE'])
+        self.dateofbirth = intern(fh['DATE_OF_BIRTH'])
+        self.dateofdeath = intern(fh['DATE_OF_DEATH'])
+        self.problemcode = intern(fh['PROBLEM_CODE'])
+        self.problemtitle = intern(fh['PROBLEM_TITLE'])
+        self.heightcm = intern(fh['HEIGHT_CM'])
         # Append FamilyHistory to the patient's list:
         if self.patientid in self.__class__.familyHistories:
             self.__class__.familyHistories[self.patientid].append(self)
@@ -51,7 +53,7 @@ if __name__ == '__main__':
     group.add_argument('--patientid', nargs='?', const='613876',
         help='display family histories for a given patient id (default=613876)')
     args = parser.parse_args()
-    FamilyHistory.load()
+    FamilyHistory.load(pid=args.patientid)
     if args.patientid:
         if not args.patientid in FamilyHistory.familyHistories:
             parser.error("No results found for patientid = %s"%args.patientid)
@@ -1,4 +1,3 @@
-import datetime
 from allergy import Allergy
 from clinicalnote import ClinicalNote
 from patient import Patient
@@ -15,13 +14,25 @@ from socialhistory import SocialHistory
 from imagingstudy import ImagingStudy
 from testdata import NOTES_PATH
 from testdata import DOCUMENTS_PATH
-from vitalspatientgenerator import generate_patient
+from testdata import currentTime
 from docs import fetch_document
+from ids import HashIds
+from bundlewriter import BundleWriter
+import instrument
+import fhirjson
+import json
 import os
+import time
 import uuid
 
-from jinja2 import Environment, FileSystemLoader
-template_env = Environment(loader=FileSystemLoader('fhir_templates'), autoescape=True)
+import templates
+template_env = templates.environment()
+
+# Precompiled templates, by resource template name (e.g. 'observation').
+# Files starting with '_' are kept for reference only and never rendered.
+TEMPLATES = dict((name[:-len('.xml')], template_env.get_template(name))
+                 for name in template_env.list_templates(extensions=['xml'])
+                 if not name.startswith('_'))
 
 SMOKINGCODES = {
     '428041000124106': 'Current some day smoker',
@@ -31,12 +42,49 @@ SMOKINGCODES = {
     '8517006': 'Former smoker'
 }
 
-base=0
+def bundleFileName(pid, format='xml', part=1):
+    """Name of the bundle file of patient pid in format ('xml' or 'json'),
+    and of the further parts of a patient split over several bundles"""
+    if part > 1:
+        return "patient-%s.fhir-bundle.part%d.%s"%(pid, part, format)
+    return "patient-%s.fhir-bundle.%s"%(pid, format)
+
+def bundleHeader(format, id, now):
+    """The start of a transaction bundle, up to its first entry"""
+    if format == 'json':
+        return ('{"resourceType": "Bundle", "id": %s, "meta": {"lastUpdated": %s}, '
+                '"type": "transaction", "entry": ['%(json.dumps(id), json.dumps(now)))
+    return """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>SMART patient bundle for transactional posting</title>
+  <id>urn:uuid:%s</id>
+  <updated>%s</updated>
+"""%(id, now)
+
+# The end of a transaction bundle, after its last entry
+BUNDLE_FOOTERS = {'xml': "\n</Bundle>\n", 'json': "\n]}\n"}
+
+def writeEntry(writer, format, template, context):
+    """Writes the bundle entry of a resource to a BundleWriter.  XML entries
+    end with a newline; JSON entries are separated by the caller."""
+    if instrument.enabled:
+        start, offset = time.perf_counter(), writer.tell()
+    if format == 'json':
+        writer.writeJSON(fhirjson.entry(template, context))
+    else:
+        # generate() yields the output piece by piece, so large Binary
+        # content is streamed to the file rather than built as one string
+        writer.writelines(TEMPLATES[template].generate(context))
+        writer.write("\n")
+    if instrument.enabled:
+        instrument.record('resource', context['id'].split('/')[0],
+                          time.perf_counter() - start, 1, writer.tell() - offset)
+
 def uid(resource_type=None, id=None, prefix=None):
-    global base
+    # Every resource is named from its source row's id; ids of unnamed
+    # resources come from the patient's allocator (ids.py) instead
     if not id:
-        base += 1
-        id = base
+        raise ValueError("No id for a %s resource"%(resource_type or "referenced"))
     if (resource_type == None):
       return str(id)
     elif (prefix == None):
@@ -56,11 +104,64 @@ def getVital(v, vt, encounter_id):
     'name': vt['name']
     }
 
+# Types of the resources shared by patients rather than scoped to one
+SHARED_TYPES = ('Practitioner', 'Organization')
+
+class BulkExport(object):
+  """Writes resources FHIR Bulk Data style: one <ResourceType>.ndjson file per
+  resource type, appended to as each resource is produced.  Resources shared
+  by patients (the Practitioner) are written once; only their ids are kept,
+  so the patients' own resources are streamed out with no state per record."""
+
+  def __init__(self, path, request=""):
+    self.path = path
+    self.request = request
+    self.files = {}
+    self.counts = {}
+    self.shared = set() # (resource type, id) of the shared resources written
+    self.transactionTime = currentTime().isoformat()
+
+  def write(self, resource):
+    """Appends a resource dict as one line of its type's NDJSON file, and
+    returns the length of the line (0 for a resource already written)"""
+    resource_type = resource['resourceType']
+    if resource_type in SHARED_TYPES:
+      key = (resource_type, resource.get('id'))
+      if key in self.shared: return 0
+      self.shared.add(key)
+    if resource_type not in self.files:
+      self.files[resource_type] = open(os.path.join(self.path, "%s.ndjson"%resource_type), "w")
+      self.counts[resource_type] = 0
+    f = self.files[resource_type]
+    line = json.dumps(resource, default=str)
+    f.write(line)
+    f.write("\n")
+    self.counts[resource_type] += 1
+    return len(line) + 1
+
+  def close(self):
+    """Closes the NDJSON files and writes the bulk data manifest.json"""
+    for f in self.files.values():
+      f.close()
+    manifest = {
+      'transactionTime': self.transactionTime,
+      'request': self.request,
+      'requiresAccessToken': False,
+      'output': [{'type': t, 'url': "%s.ndjson"%t, 'count': self.counts[t]}
+                 for t in sorted(self.counts)],
+      'error': []
+    }
+    with open(os.path.join(self.path, "manifest.json"), "w") as f:
+      json.dump(manifest, f, indent=2)
+    self.files = {}
+
 class FHIRSamplePatient(object):
-  def __init__(self, pid, path, base_url="", tag=""):
+  def __init__(self, pid, path, base_url="", tag="", ids=None):
     self.path = path
     self.pid = pid
     self.tag = tag
+    # Allocates the ids of the unnamed resources (the bundle id)
+    self.ids = ids or HashIds(pid)
 
     if len(base_url) > 0 and not base_url.endswith("/"):
         base_url += "/"
@@ -70,29 +171,85 @@ class FHIRSamplePatient(object):
     return
 
   def writePatientData(self, prefix=None):
+    """Writes the patient bundle as FHIR XML; returns the number of resources
+    and of bytes written"""
 
-    pfile = open(os.path.join(self.path, "patient-%s.fhir-bundle.xml"%self.pid), "w")
-    p = Patient.mpi[self.pid]
+    pfile = BundleWriter(os.path.join(self.path, bundleFileName(self.pid, 'xml')))
 
-    now = datetime.datetime.now().isoformat()
-    base_url = self.base_url
-    tag = self.tag
-
-    if self.pid == '99912345':
-        vpatient = generate_patient()
-        p.dob = vpatient["birthday"]
-        VitalSigns.loadVitalsPatient(vpatient)
+    now = currentTime().isoformat()
 
 #     print >>pfile, """<?xml version="1.0" encoding="UTF-8"?>
 # <Bundle xmlns="http://hl7.org/fhir">
 #     <type value="transaction"/>
 # """
-    print("""<?xml version="1.0" encoding="UTF-8"?>
-<feed xmlns="http://www.w3.org/2005/Atom">
-  <title>SMART patient bundle for transactional posting</title>
-  <id>urn:uuid:%s</id>
-  <updated>%s</updated>
-"""%(uid(), now), end="", file=pfile)
+    pfile.write(bundleHeader('xml', self.ids.next("Bundle"), now))
+
+    count = 0
+    for template, context in self.resources(prefix, now):
+        writeEntry(pfile, 'xml', template, context)
+        count += 1
+
+    # print >>pfile, "\n</Bundle>"
+    pfile.write(BUNDLE_FOOTERS['xml'])
+    pfile.close()
+    return count, pfile.tell()
+
+  def writePatientJSON(self, prefix=None):
+    """Writes the patient bundle as FHIR JSON, one entry at a time; returns
+    the number of resources and of bytes written"""
+
+    pfile = BundleWriter(os.path.join(self.path, bundleFileName(self.pid, 'json')))
+
+    now = currentTime().isoformat()
+
+    pfile.write(bundleHeader('json', self.ids.next("Bundle"), now))
+    separator = "\n"
+    count = 0
+    for template, context in self.resources(prefix, now):
+        pfile.write(separator)
+        writeEntry(pfile, 'json', template, context)
+        separator = ",\n"
+        count += 1
+    pfile.write(BUNDLE_FOOTERS['json'])
+    pfile.close()
+    return count, pfile.tell()
+
+  def writePatientNDJSON(self, export, prefix=None):
+    """Streams the patient's resources into a BulkExport; returns the number
+    of resources and of bytes written, where a shared resource written
+    before counts for neither"""
+
+    now = currentTime().isoformat()
+
+    count = total = 0
+    for template, context in self.resources(prefix, now):
+        if instrument.enabled: start = time.perf_counter()
+        size = export.write(fhirjson.build(template, context))
+        if instrument.enabled and size:
+            instrument.record('resource', context['id'].split('/')[0],
+                              time.perf_counter() - start, 1, size)
+        if size:
+            count += 1
+            total += size
+    return count, total
+
+  def resources(self, prefix=None, now=None):
+    """Generates (template name, render context) for each resource in the bundle.
+
+    Each context holds only the variables its template refers to: the
+    resource id, the patient reference, base_url and tag, plus the
+    resource-specific objects."""
+
+    p = Patient.mpi[self.pid]
+
+    if (prefix == None):
+        pid = "Patient/%s"%self.pid
+    else:
+        pid = "Patient/%s-%s"%(prefix,self.pid)
+
+    def context(id, **kw):
+        kw.update(id=id, pid=pid, base_url=self.base_url, tag=self.tag)
+        return kw
 
     if self.pid in Document.documents:
         for d in [doc for doc in Document.documents[self.pid] if doc.type == 'photograph']:
@@ -100,86 +257,54 @@ class FHIRSamplePatient(object):
             d.content = data['base64_content']
             d.size = data['size']
             d.hash = data['hash']
-            b = d
             id = uid("Binary", "%s-photo" % d.id, prefix)
             d.binary_id = id
-            template = template_env.get_template('binary.xml')
-            # print >>pfile, template.render(dict(globals(), **locals()))
-            print(template.render(dict(globals(), **locals())),file=pfile)
+            yield 'binary', context(id, b=d)
             p.photo_code = d.mime_type
             p.photo_binary_id = d.binary_id
             p.photo_size = d.size
             p.photo_hash = d.hash
             p.photo_title = d.title
 
-    if (prefix == None):
-	    id = "Patient/%s"%self.pid
-    else:
-    	id = "Patient/%s-%s"%(prefix,self.pid)
-    pid = id
-    
-    template = template_env.get_template('patient.xml')
-    # print >>pfile, template.render(dict(globals(), **locals()))
-    print(template.render(dict(globals(), **locals())),file=pfile)
+    yield 'patient', context(pid, p=p)
 
     bps = []
     othervitals = []
 
     if self.pid in VitalSigns.vitals:
-      encounters = []
-      for v in  VitalSigns.vitals[self.pid]:
-          encounter_id = None
-          e = [i for i in encounters if i['date'] == v.start_date and i['type'] == v.encounter_type]
-          if len(e) > 0:
-              encounter_id = e[0]['id']
-          else:
-              encounter_id = uid("Encounter", v.id, prefix)
-              encounters.append ({'date': v.start_date, 'type': v.encounter_type, 'id': encounter_id})
-              id = encounter_id
-              template = template_env.get_template('encounter.xml')
-            #   print >>pfile, template.render(dict(globals(), **locals()))
-              print(template.render(dict(globals(), **locals())),file=pfile)
+      vitals = VitalSigns.vitals[self.pid]
+      encounters = VitalSigns.encounters[self.pid]
+      for n, v in enumerate(vitals):
+          # The first vital of each (start date, type) opens the encounter
+          first = encounters[(v.start_date, v.encounter_type)]
+          encounter_id = uid("Encounter", vitals[first].id, prefix)
+          if n == first:
+              yield 'encounter', context(encounter_id, v=v)
+          # Measurements are floats converted at load, None where missing
           for vt in VitalSigns.vitalTypes:
-              try:
+              if getattr(v, vt['name']) is not None:
                   othervitals.append(getVital(v, vt, encounter_id))
-              except: pass
-          try:
-              systolic = getVital(v, VitalSigns.systolic, encounter_id)
-              diastolic = getVital(v, VitalSigns.diastolic, encounter_id)
+          if v.systolic is not None and v.diastolic is not None:
+              systolic = getVital(v, VitalSigns.systolicType, encounter_id)
+              diastolic = getVital(v, VitalSigns.diastolicType, encounter_id)
               bp = systolic
               bp['systolic'] = int(systolic['value'])
               bp['diastolic'] = int(diastolic['value'])
-              bp['site'] = v.bp_site
               bp['id'] = v.id
-              if bp['site']:
-                for pc in VitalSigns.bpPositionCodes:
-                    if pc['name'] == bp['site']:
-                        bp['site_code'] = pc['code']
-                        bp['site_system'] = pc['system']
-              bp['method'] = v.bp_method
-              if bp['method']:
-                for pc in VitalSigns.bpPositionCodes:
-                    if pc['name'] == bp['method']:
-                        bp['method_code'] = pc['code']
-                        bp['method_system'] = pc['system']
-              bp['position'] = v.bp_position
-              if bp['position']:
-                for pc in VitalSigns.bpPositionCodes:
-                    if pc['name'] == bp['position']:
-                        bp['position_code'] = pc['code']
-                        bp['position_system'] = pc['system']
+              for field in ('site', 'method', 'position'):
+                  bp[field] = getattr(v, 'bp_'+field)
+                  pc = VitalSigns.bpCodes.get(bp[field])
+                  if pc:
+                      bp[field+'_code'] = pc['code']
+                      bp[field+'_system'] = pc['system']
               bps.append(bp)
-          except: pass
 
     for bp in bps:
         systolicid = uid("Observation", "%s-systolic" % bp['id'], prefix)
         diastolicid = uid("Observation", "%s-diastolic" % bp['id'], prefix)
         id = uid("Observation", "%s-bp" % bp['id'], prefix)
-        template = template_env.get_template('blood_pressure.xml')
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'blood_pressure', context(id, bp=bp)
 
-        id = systolicid
         o = {
                 "date": bp['date'],
                 "code": "8480-6",
@@ -191,11 +316,8 @@ class FHIRSamplePatient(object):
                 "categoryCode": "vital-signs",
                 "categoryDisplay": "Vital Signs"
         }
-        template = template_env.get_template('observation.xml')
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'observation', context(systolicid, o=o)
 
-        id = diastolicid
         o = {
                 "date": bp['date'],
                 "code": "8462-4",
@@ -207,81 +329,61 @@ class FHIRSamplePatient(object):
                 "categoryCode": "vital-signs",
                 "categoryDisplay": "Vital Signs"
         }
-        template = template_env.get_template('observation.xml')
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'observation', context(diastolicid, o=o)
 
-    template = template_env.get_template('observation.xml')
     for o in othervitals:
         id = uid("Observation", '-'.join((o["id"], o["name"].lower().replace(' ', '').replace('_', ''))), prefix)
         if "units" in o.keys():
            o["unitsCode"] = o["units"]
            o["categoryCode"] = "vital-signs"
            o["categoryDisplay"] = "Vital Signs"
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'observation', context(id, o=o)
 
     if self.pid in Lab.results:
       for o in Lab.results[self.pid]:
         id = uid("Observation", "%s-lab" % o.id, prefix)
         o.categoryCode = "laboratory"
         o.categoryDisplay = "Laboratory"
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'observation', context(id, o=o)
 
-    medtemplate = template_env.get_template('medication.xml')
-    dispensetemplate = template_env.get_template('medication_dispense.xml')
     if self.pid in Med.meds:
       for m in Med.meds[self.pid]:
-        medid = id = uid("MedicationOrder", m.id, prefix)
-        # print >>pfile, medtemplate.render(dict(globals(), **locals()))
-        print(medtemplate.render(dict(globals(), **locals())),file=pfile)
+        medid = uid("MedicationOrder", m.id, prefix)
+        yield 'medication', context(medid, m=m)
 
         for f in Refill.refill_list(m.pid, m.rxn):
           id = uid("MedicationDispense", f.id, prefix)
-        #   print >>pfile, dispensetemplate.render(dict(globals(), **locals()))
-          print(dispensetemplate.render(dict(globals(), **locals())),file=pfile)
+          yield 'medication_dispense', context(id, m=m, f=f, medid=medid)
 
-    template = template_env.get_template('condition.xml')
     if self.pid in Problem.problems:
       for c in Problem.problems[self.pid]:
         id = uid("Condition", c.id, prefix)
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'condition', context(id, c=c)
 
-    template = template_env.get_template('procedure.xml')
     if self.pid in Procedure.procedures:
       for w in Procedure.procedures[self.pid]:
         id = uid("Procedure", w.id, prefix)
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'procedure', context(id, w=w)
 
-    template = template_env.get_template('immunization.xml')
     if self.pid in Immunization.immunizations:
       for i in Immunization.immunizations[self.pid]:
         id = uid("Immunization", i.id, prefix)
         i.cvx_system, i.cvx_id = i.cvx.rsplit("cvx",1)
         i.cvx_system += "cvx"
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'immunization', context(id, i=i)
 
-    template = template_env.get_template('family_history.xml')
     if self.pid in FamilyHistory.familyHistories:
       for fh in FamilyHistory.familyHistories[self.pid]:
         id = uid("FamilyMemberHistory", fh.id, prefix)
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'family_history', context(id, fh=fh)
 
-    template = template_env.get_template('smoking_status.xml')
     if self.pid in SocialHistory.socialHistories:
         t = SocialHistory.socialHistories[self.pid]
         t.smokingStatusText = SMOKINGCODES[t.smokingStatusCode]
         id = uid("Observation", '-'.join((t.id,"smokingstatus")), prefix)
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'smoking_status', context(id, t=t)
 
     if p.gestage:
-        template = template_env.get_template('observation.xml')
         o = {
             "date": p.dob,
             "code": "18185-9",
@@ -294,8 +396,7 @@ class FHIRSamplePatient(object):
             "categoryDisplay": "Exam"
         }
         id = uid("Observation", "%s-gestage" % self.pid, prefix)
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'observation', context(id, o=o)
 
     if self.pid in Allergy.allergies:
         for al in Allergy.allergies[self.pid]:
@@ -328,28 +429,21 @@ class FHIRSamplePatient(object):
                     else:
                         al.severity = None
                 id = uid("AllergyIntolerance", al.id, prefix)
-                template = template_env.get_template('allergy.xml')
-                # print >>pfile, template.render(dict(globals(), **locals()))
-                print(template.render(dict(globals(), **locals())),file=pfile)
+                yield 'allergy', context(id, al=al)
             elif al.statement == 'negative' and al.type == 'general':
                 if al.code == '160244002':
-                    template = template_env.get_template('no_known_allergies.xml')
                     id = uid("List", al.id, prefix)
                     al.loinc_code = '52473-6'
                     al.loinc_display = 'Allergy'
                     al.text = 'No known allergies'
-                    # print >>pfile, template.render(dict(globals(), **locals()))
-                    print(template.render(dict(globals(), **locals())),file=pfile)
+                    yield 'no_known_allergies', context(id, al=al)
                 elif al.code == '409137002':
-                    template = template_env.get_template('no_known_allergies.xml')
                     id = uid("List", al.id, prefix)
                     al.loinc_code = '11382-9'
                     al.loinc_display = 'Medication allergy'
                     al.text = 'No known history of drug allergy'
-                    # print >>pfile, template.render(dict(globals(), **locals()))
-                    print(template.render(dict(globals(), **locals())),file=pfile)
+                    yield 'no_known_allergies', context(id, al=al)
                 else:
-                    template = template_env.get_template('general_observation.xml')
                     o = {
                         "date": al.start,
                         "system": "http://snomed.info/sct",
@@ -359,59 +453,42 @@ class FHIRSamplePatient(object):
                         "categoryDisplay": "Exam"
                     }
                     id = uid("Observation", "%s-allergy" % al.id, prefix)
-                    # print >>pfile, template.render(dict(globals(), **locals()))
-                    print(template.render(dict(globals(), **locals())),file=pfile)
+                    yield 'general_observation', context(id, o=o)
 
     addedPractitioner = False
 
     if self.pid in ClinicalNote.clinicalNotes:
-        id = 'Practitioner/SMART-1234'
-        template = template_env.get_template('practitioner.xml')
-        # print >>pfile, template.render(dict(globals(), **locals()))
-        print(template.render(dict(globals(), **locals())),file=pfile)
+        yield 'practitioner', context('Practitioner/SMART-1234')
         addedPractitioner = True
         for d in ClinicalNote.clinicalNotes[self.pid]:
             if d.mime_type == 'text/plain':
                 data = fetch_document (self.pid, d.file_name)
                 d.content = data['base64_content']
-                b = d
                 id = uid("Binary", "%s-note" % d.id, prefix)
                 d.binary_id = id
-                template = template_env.get_template('binary.xml')
-                # print >>pfile, template.render(dict(globals(), **locals()))
-                print(template.render(dict(globals(), **locals())),file=pfile)
+                yield 'binary', context(id, b=d)
                 id = uid("DocumentReference", "%s-note" % d.id, prefix)
                 d.system = "http://loinc.org"
                 d.code = '34109-9'
                 d.display = 'Note'
-                template = template_env.get_template('document.xml')
-                # print >>pfile, template.render(dict(globals(), **locals()))
-                print(template.render(dict(globals(), **locals())),file=pfile)
+                yield 'document', context(id, d=d, now=now)
 
     if self.pid in Document.documents:
         if not addedPractitioner:
-            id = 'Practitioner/SMART-1234'
-            template = template_env.get_template('practitioner.xml')
-            # print >>pfile, template.render(dict(globals(), **locals()))
-            print(template.render(dict(globals(), **locals())),file=pfile)
+            yield 'practitioner', context('Practitioner/SMART-1234')
         for d in [doc for doc in Document.documents[self.pid] if doc.type != 'photograph']:
             data = fetch_document (self.pid, d.file_name)
             d.content = data['base64_content']
             d.size = data['size']
             d.hash = data['hash']
-            b = d
             id = uid("Binary", "%s-document" % d.id, prefix)
             d.binary_id = id
-            template = template_env.get_template('binary.xml')
-            # print >>pfile, template.render(dict(globals(), **locals()))
-            print(template.render(dict(globals(), **locals())),file=pfile)
+            yield 'binary', context(id, b=d)
             id = uid("DocumentReference", "%s-document" % d.id, prefix)
             d.system = 'http://smarthealthit.org/terms/codes/DocumentType#'
             d.code = d.type
             d.display = d.type
-            template = template_env.get_template('document.xml')
-            # print >>pfile, template.render(dict(globals(), **locals()))
-            print(template.render(dict(globals(), **locals())),file=pfile)
+            yield 'document', context(id, d=d, now=now)
 
     if self.pid in ImagingStudy.imagingStudies:
         st = {}
@@ -421,12 +498,9 @@ class FHIRSamplePatient(object):
             img.content = data['base64_content']
             img.size = data['size']
             img.hash = data['hash']
-            b = img
             id = uid("Binary", "%s-dicom" % img.id, prefix)
             img.binary_id = id
-            template = template_env.get_template('binary.xml')
-            # print >>pfile, template.render(dict(globals(), **locals()))
-            print(template.render(dict(globals(), **locals())),file=pfile)
+            yield 'binary', context(id, b=img)
             if img.study_oid not in st.keys():
                 st[img.study_oid] = {
                     'id': img.id,
@@ -465,10 +539,5 @@ class FHIRSamplePatient(object):
         for i in st:
             s = st[i]
             id = uid("ImagingStudy", s['id'], prefix)
-            template = template_env.get_template('imagingstudy.xml')
-            # print >>pfile, template.render(dict(globals(), **locals()))
-            print(template.render(dict(globals(), **locals())),file=pfile)
+            yield 'imagingstudy', context(id, s=s)
 
-    # print >>pfile, "\n</Bundle>"
-    print("\n</Bundle>",file=pfile)
-    pfile.close()
@@ -0,0 +1,428 @@
+"""Builds FHIR JSON resources as Python dicts.
+
+Each builder mirrors the XML template of the same name in fhir_templates and
+takes the same render context (see FHIRSamplePatient.resources), so both
+output formats are produced from the same Patient/Lab/Med/VitalSigns objects.
+"""
+from xml.sax.saxutils import escape
+import math
+
+TAG_SYSTEM = "https://smarthealthit.org/tags"
+LOINC = "http://loinc.org"
+SNOMED = "http://snomed.info/sct"
+RXNORM = "http://www.nlm.nih.gov/research/umls/rxnorm"
+UCUM = "http://unitsofmeasure.org"
+OBSERVATION_CATEGORY = "http://hl7.org/fhir/observation-category"
+REFUSAL_REASON = "http://smarthealthit.org/terms/codes/ImmunizationRefusalReason#"
+ADMINISTRATION_STATUS = "http://smarthealthit.org/terms/codes/ImmunizationAdministrationStatus#"
+
+RELATIVES = {
+    '66839005': ('FTH', 'father'),
+    '72705000': ('MTH', 'mother'),
+    '27733009': ('SIS', 'sister'),
+    '70924004': ('BRO', 'brother'),
+    '34871008': ('GRFTH', 'grandfather'),
+    '113157001': ('GRMTH', 'grandmother')
+}
+
+REFUSAL_REASONS = {
+    'http://smartplatforms.org/terms/codes/ImmunizationRefusalReason#allergy':
+        ('allergy', 'Allergy to vaccine/vaccine components, or allergy to eggs'),
+    REFUSAL_REASON+'documentedImmunityOrPreviousDisease':
+        ('documentedImmunityOrPreviousDisease', 'Documented immunity or previous disease'),
+    REFUSAL_REASON+'notIndicatedPerGuidelines':
+        ('notIndicatedPerGuidelines', 'Not indicated per guidelines')
+}
+
+def get(o, name, default=None):
+    """Reads a field from a dict or an attribute from an object, like Jinja"""
+    if isinstance(o, dict):
+        return o.get(name, default)
+    return getattr(o, name, default)
+
+def number(value, default=0.0):
+    """Converts to int or float like the templates' float filter, with a default"""
+    try:
+        f = float(value)
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(f):
+        return default
+    return int(f) if f.is_integer() and '.' not in str(value) else f
+
+def numeric(o, name, default=0.0):
+    """A numeric field converted like number(): from its float column (e.g.
+    the value_num of Lab results) when there is one and it holds a number,
+    from the text otherwise"""
+    f = get(o, name + '_num')
+    if f is None or not math.isfinite(f):
+        return number(get(o, name), default)
+    return int(f) if f.is_integer() and '.' not in str(get(o, name)) else f
+
+def compact(value):
+    """Drops empty strings, lists, dicts and None values, which FHIR JSON forbids"""
+    if isinstance(value, dict):
+        value = dict((k, compact(v)) for k, v in value.items())
+        return dict((k, v) for k, v in value.items() if v not in (None, '', [], {}))
+    if isinstance(value, list):
+        return [v for v in (compact(v) for v in value) if v not in (None, '', [], {})]
+    return value
+
+def narrative(text):
+    return {'status': 'generated',
+            'div': '<div xmlns="http://www.w3.org/1999/xhtml">%s</div>'%text}
+
+def concept(system, code, display, text=None):
+    return {'coding': [{'system': system, 'code': code, 'display': display}],
+            'text': text if text is not None else display}
+
+def quantity(value, unit, code, system=UCUM):
+    return {'value': value, 'unit': unit, 'system': system, 'code': code}
+
+def reference(context, id):
+    return {'reference': "%s%s"%(context['base_url'], id)}
+
+def category(code, display):
+    return concept(OBSERVATION_CATEGORY, code, display)
+
+def resource(context, **fields):
+    """Starts a resource dict with its type, id and optional tag"""
+    resource_type, id = context['id'].split('/', 1)
+    r = {'resourceType': resource_type, 'id': id}
+    if context['tag']:
+        r['meta'] = {'tag': [{'system': TAG_SYSTEM, 'code': context['tag']}]}
+    r.update(fields)
+    return r
+
+def patient(context):
+    p = context['p']
+    name = {'use': 'official', 'family': [p.lname], 'given': [p.fname]}
+    if p.initial:
+        name['given'].append("%s."%p.initial)
+    telecom = []
+    if p.home:
+        telecom.append({'system': 'phone', 'value': p.home, 'use': 'home'})
+    if p.cell:
+        telecom.append({'system': 'phone', 'value': p.cell, 'use': 'mobile'})
+    if p.email:
+        telecom.append({'system': 'email', 'value': p.email})
+    address = []
+    if p.street:
+        address.append({'use': 'home', 'line': [p.street + (p.apartment or '')],
+                        'city': p.city, 'state': p.region,
+                        'postalCode': p.pcode, 'country': p.country})
+    elif p.pcode and p.country:
+        address.append({'use': 'home', 'postalCode': p.pcode, 'country': p.country})
+    r = resource(context,
+        text=narrative("<p>%s %s</p>"%(escape(p.fname), escape(p.lname))),
+        identifier=[{'use': 'usual',
+                     'type': concept("http://hl7.org/fhir/v2/0203", "MR",
+                                     "Medical record number"),
+                     'system': "http://hospital.smarthealthit.org",
+                     'value': p.pid}],
+        name=[name],
+        telecom=telecom,
+        gender=p.gender,
+        birthDate=p.dob,
+        address=address)
+    if get(p, 'photo_title'):
+        r['photo'] = [{'contentType': p.photo_code, 'url': "/%s"%p.photo_binary_id,
+                       'hash': p.photo_hash, 'title': p.photo_title}]
+    r['active'] = True
+    return r
+
+def observation(context):
+    o = context['o']
+    scale = get(o, 'scale')
+    low, high = get(o, 'low'), get(o, 'high')
+    units = get(o, 'units', '')
+    r = resource(context)
+    if low and scale == 'Ord':
+        r['extension'] = [{'url': "http://fhir-registry.smarthealthit.org/StructureDefinition/labs#value-range",
+                           'valueString': '; '.join(low) if isinstance(low, list) else low}]
+    r.update(
+        text=narrative(escape("%s: %s = %s %s"%(get(o, 'date'), get(o, 'name'),
+                                                get(o, 'value'), units))),
+        category=category(get(o, 'categoryCode'), get(o, 'categoryDisplay')),
+        code=concept(LOINC, get(o, 'code'), get(o, 'name')))
+    if scale == 'Qn':
+        r['valueQuantity'] = quantity(numeric(o, 'value'), units, get(o, 'unitsCode'))
+    if scale in ('Ord', 'Nom'):
+        r['valueString'] = get(o, 'value')
+    r.update(effectiveDateTime=get(o, 'date'), status='final',
+             subject=reference(context, context['pid']))
+    if get(o, 'encounter_id'):
+        r['encounter'] = reference(context, get(o, 'encounter_id'))
+    if low and high:
+        r['referenceRange'] = [{
+            'meaning': concept("http://hl7.org/fhir/referencerange-meaning",
+                               "normal", "Normal Range"),
+            'low': quantity(numeric(o, 'low'), units, units),
+            'high': quantity(numeric(o, 'high'), units, units)}]
+    return r
+
+def general_observation(context):
+    o = context['o']
+    r = resource(context,
+        text=narrative(escape(o['name'])),
+        category=category(o['categoryCode'], o['categoryDisplay']),
+        code=concept(o['system'], o['code'], o['name']),
+        effectiveDateTime=o['date'],
+        status='final',
+        subject=reference(context, context['pid']))
+    if o.get('encounter_id'):
+        r['encounter'] = reference(context, o['encounter_id'])
+    return r
+
+def blood_pressure(context):
+    bp = context['bp']
+    r = resource(context)
+    if bp.get('position'):
+        r['extension'] = [{'url': "http://fhir-registry.smarthealthit.org/StructureDefinition/vital-signs#position",
+                           'valueCodeableConcept': concept(bp.get('position_system'),
+                               bp.get('position_code'), bp['position'])}]
+    r.update(
+        text=narrative("%s: Blood pressure %s/%s mmHg"%(bp['date'], bp['systolic'], bp['diastolic'])),
+        category=category("vital-signs", "Vital Signs"),
+        code=concept(LOINC, "55284-4", "Blood pressure systolic and diastolic"),
+        effectiveDateTime=bp['date'],
+        status='final',
+        subject=reference(context, context['pid']))
+    if bp.get('site'):
+        r['bodySite'] = concept(bp.get('site_system'), bp.get('site_code'), bp['site'])
+    if bp.get('method'):
+        r['method'] = concept(bp.get('method_system'), bp.get('method_code'), bp['method'])
+    if bp.get('encounter_id'):
+        r['encounter'] = reference(context, bp['encounter_id'])
+    r['component'] = [
+        {'code': concept(LOINC, "8480-6", "Systolic blood pressure"),
+         'valueQuantity': quantity(bp['systolic'], "mmHg", "mm[Hg]")},
+        {'code': concept(LOINC, "8462-4", "Diastolic blood pressure"),
+         'valueQuantity': quantity(bp['diastolic'], "mmHg", "mm[Hg]")}]
+    return r
+
+def encounter(context):
+    v = context['v']
+    return resource(context,
+        text=narrative(escape("%s: %s encounter"%(v.start_date, v.encounter_type))),
+        status='finished',
+        **{'class': v.encounter_type,
+           'patient': reference(context, context['pid']),
+           'period': {'start': v.start_date, 'end': v.end_date}})
+
+def medication(context):
+    m = context['m']
+    dosage = {}
+    if get(m, 'freqduration'):
+        bounds = {'start': m.start}
+        if m.end:
+            bounds['end'] = m.end
+        dosage['timing'] = {'repeat': {'boundsPeriod': bounds,
+                                       'frequency': number(m.freq, None),
+                                       'period': 1,
+                                       'periodUnits': m.freqduration}}
+    if m.qtt:
+        dosage['doseQuantity'] = quantity(m.qtt, m.qttunit, m.qttunit)
+    if "prn" in m.sig:
+        dosage['asNeededBoolean'] = True
+    dosage['text'] = m.sig
+    r = resource(context,
+        text=narrative(escape("%s (rxnorm: %s)"%(m.name, m.rxn))),
+        status=m.status,
+        patient=reference(context, context['pid']),
+        medicationCodeableConcept=concept(RXNORM, m.rxn, m.name),
+        dosageInstruction=[dosage])
+    if m.refills or m.q or m.days:
+        dispense = {}
+        if m.refills:
+            dispense['numberOfRepeatsAllowed'] = m.refills
+        if m.q:
+            dispense['quantity'] = quantity(number(m.q, None), m.qttunit, m.qttunit)
+        if m.days:
+            dispense['expectedSupplyDuration'] = quantity(number(m.days, None), "days", "d")
+        r['dispenseRequest'] = dispense
+    return r
+
+def medication_dispense(context):
+    m, f = context['m'], context['f']
+    return resource(context,
+        text=narrative(escape("Dispensed %s tablets = %s day supply of %s"%(f.q, f.days, m.name))),
+        status='completed',
+        patient=reference(context, context['pid']),
+        authorizingPrescription=[reference(context, context['medid'])],
+        quantity=quantity(number(f.q, None), "tablets", "{tablets}"),
+        daysSupply=quantity(number(f.days, None), "days", "d"),
+        medicationCodeableConcept=concept(RXNORM, m.rxn, m.name),
+        whenHandedOver=f.date)
+
+def condition(context):
+    c = context['c']
+    r = resource(context,
+        text=narrative(escape(c.name)),
+        patient=reference(context, context['pid']),
+        code=concept(SNOMED, c.snomed, c.name),
+        clinicalStatus='active',
+        verificationStatus='confirmed',
+        onsetDateTime=c.start)
+    if c.end:
+        r['abatementDate'] = c.end
+    return r
+
+def procedure(context):
+    w = context['w']
+    r = resource(context,
+        text=narrative(escape(w.name)),
+        subject=reference(context, context['pid']),
+        code=concept(SNOMED, w.snomed, w.name),
+        performedDateTime=w.date)
+    if w.notes:
+        r['notes'] = w.notes
+    return r
+
+def immunization(context):
+    i = context['i']
+    r = resource(context,
+        text=narrative(escape(i.cvx_title)),
+        patient=reference(context, context['pid']),
+        date=i.date,
+        vaccineCode={'coding': [{'system': i.cvx_system, 'code': i.cvx_id,
+                                 'display': i.cvx_title}]},
+        reported=False)
+    if i.administration_status == ADMINISTRATION_STATUS+'doseGiven':
+        r['wasNotGiven'] = False
+    elif i.administration_status == ADMINISTRATION_STATUS+'notAdministered':
+        r['wasNotGiven'] = True
+        if i.refusal_reason in REFUSAL_REASONS:
+            code, display = REFUSAL_REASONS[i.refusal_reason]
+            r['explanation'] = {'reasonNotGiven': [{'coding': [
+                {'system': REFUSAL_REASON, 'code': code, 'display': display}]}]}
+    return r
+
+def family_history(context):
+    fh = context['fh']
+    r = resource(context)
+    if fh.heightcm:
+        r['extension'] = [{'url': "http://fhir-registry.smarthealthit.org/StructureDefinition/family-history#height",
+                           'valueQuantity': quantity(number(fh.heightcm), "centimeters", "cm")}]
+    r.update(
+        text=narrative(escape("Data on patient's %s"%fh.relativetitle)),
+        patient=reference(context, context['pid']))
+    if fh.relativecode in RELATIVES:
+        code, display = RELATIVES[fh.relativecode]
+        r['relationship'] = {'coding': [{'system': "http://hl7.org/fhir/v3/RoleCode",
+                                         'code': code, 'display': display}]}
+    if fh.dateofbirth:
+        r['bornDate'] = fh.dateofbirth
+    if fh.dateofdeath:
+        r['deceasedDate'] = fh.dateofdeath
+    if fh.problemcode:
+        r['condition'] = [{'code': concept(SNOMED, fh.problemcode, fh.problemtitle)}]
+    return r
+
+def smoking_status(context):
+    t = context['t']
+    return resource(context,
+        text=narrative(escape("Tobacco smoking status: %s"%t.smokingStatusText)),
+        category=category("social-history", "Social History"),
+        code=concept(LOINC, "72166-2", "Tobacco smoking status"),
+        valueCodeableConcept=concept(SNOMED, t.smokingStatusCode, t.smokingStatusText),
+        status='final',
+        subject=reference(context, context['pid']))
+
+def allergy(context):
+    al = context['al']
+    r = resource(context, text=narrative(escape("Sensitivity to %s"%al.allergen)))
+    if get(al, 'criticality'):
+        r['criticality'] = al.criticality
+    r.update(
+        category=get(al, 'typeDescription'),
+        recordedDate=al.start,
+        status='confirmed',
+        patient=reference(context, context['pid']),
+        substance=concept(al.system, al.code, al.allergen))
+    if al.reaction:
+        reaction = {'manifestation': [concept(SNOMED, al.snomed, al.reaction)]}
+        if al.severity:
+            reaction['severity'] = al.severity
+        r['reaction'] = [reaction]
+    return r
+
+def no_known_allergies(context):
+    al = context['al']
+    return resource(context,
+        text=narrative(escape(al.text)),
+        code=concept("http://loinc.org/", al.loinc_code, al.loinc_display),
+        subject=reference(context, context['pid']),
+        date=al.start,
+        mode='snapshot',
+        emptyReason=concept("http://hl7.org/fhir/list-empty-reason", "nilknown", "Nil Known"))
+
+def practitioner(context):
+    return resource(context,
+        text=narrative("Practitioner: John Smith"),
+        name={'use': 'usual', 'family': ['Smith'], 'given': ['John']})
+
+def binary(context):
+    b = context['b']
+    # The content stays a stream (docs.Base64Content) for BundleWriter.writeJSON
+    return resource(context, contentType=b.mime_type, content=b.content)
+
+def document(context):
+    d = context['d']
+    attachment = {}
+    if get(d, 'size') and get(d, 'hash'):
+        attachment.update(size=d.size, hash=d.hash)
+    attachment.update(url="/%s"%d.binary_id, contentType=d.mime_type)
+    return resource(context,
+        text=narrative(escape(d.title)),
+        subject=reference(context, context['pid']),
+        type=concept(d.system, d.code, d.display),
+        author=[{'reference': "Practitioner/SMART-1234"}],
+        created=d.date,
+        indexed=context['now'],
+        status='current',
+        description=d.title,
+        content=[{'attachment': attachment}])
+
+def imagingstudy(context):
+    s = context['s']
+    series = []
+    for oid in s['series']:
+        se = s['series'][oid]
+        series.append({
+            'number': se['number'],
+            'uid': "urn:sampleoid:%s"%se['oid'],
+            'description': se['title'],
+            'numberOfInstances': se['images_count'],
+            'instance': [{'number': img['number'],
+                          'uid': "urn:sampleoid:%s"%img['oid'],
+                          'sopClass': "urn:oid:%s"%img['sop'],
+                          'title': img['title'],
+                          'content': [{'url': img['binary_id']}]}
+                         for img in se['images']]})
+    return resource(context,
+        text=narrative(escape("%s: %s"%(s['date'], s['title']))),
+        started=s['date'],
+        patient=reference(context, context['pid']),
+        uid="urn:sampleoid:%s"%s['oid'],
+        accession={'value': s['accession_number']},
+        description=s['title'],
+        modalityList=[s['modality']],
+        numberOfSeries=s['series_count'],
+        numberOfInstances=s['images_count'],
+        series=series)
+
+BUILDERS = dict((name, globals()[name]) for name in (
+    'allergy', 'binary', 'blood_pressure', 'condition', 'document', 'encounter',
+    'family_history', 'general_observation', 'imagingstudy', 'immunization',
+    'medication', 'medication_dispense', 'no_known_allergies', 'observation',
+    'patient', 'practitioner', 'procedure', 'smoking_status'))
+
+def build(template, context):
+    """Builds the resource dict for a (template, context) pair"""
+    return compact(BUILDERS[template](context))
+
+def entry(template, context):
+    """Builds a transaction bundle entry, as entry.xml does for the XML output"""
+    return {'resource': build(template, context),
+            'request': {'method': 'PUT', 'url': context['id']}}
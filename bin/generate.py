@@ -13,29 +13,138 @@ from socialhistory import SocialHistory
 from familyhistory import FamilyHistory
 from imagingstudy import ImagingStudy
 from document import Document
+from vitalspatientgenerator import generate_patient
+import testdata
+import snapshot
+import docs
+import bundlewriter
+import ids
+import instrument
 import argparse
+import multiprocessing
 import sys
 import os
 
 # Some constant strings:
 FILE_NAME_TEMPLATE = "p%s.xml"  # format for output files: p<patient id>.xml
 
-def initData():
-   """Load data and mappings from Raw data files and mapping files"""
-   Patient.load()
-   Med.load()
-   Problem.load()
-   Lab.load()
-   Refill.load()
-   VitalSigns.load()
-   Immunization.load()
-   Procedure.load()
-   SocialHistory.load()
-   FamilyHistory.load()
-   ClinicalNote.load()
-   Allergy.load()
-   ImagingStudy.load()
-   Document.load()
+VITALS_PATIENT = '99912345' # Gets growth-curve vitals generated on top of its rows
+
+# The data tables, in the order they are loaded
+LOADERS = [Patient, Med, Problem, Lab, Refill, VitalSigns, Immunization, Procedure,
+           SocialHistory, FamilyHistory, ClinicalNote, Allergy, ImagingStudy, Document]
+
+def initData(useSnapshot=True):
+   """Load data and mappings from Raw data files and mapping files, or from
+   the snapshot of them when it is up to date"""
+   loaded = False
+   if useSnapshot:
+     with instrument.stage('snapshot', 'load') as s:
+       loaded = snapshot.load()
+       if loaded: s.resources = sum(snapshot.rows(cls) for cls, name in snapshot.TABLES)
+   if not loaded:
+     for cls in LOADERS:
+       loadTable(cls)
+     if useSnapshot:
+       with instrument.stage('snapshot', 'save'):
+         snapshot.save()
+   initVitalsPatient()
+
+def loadTable(cls):
+   """Loads the table of a loader class, as a stage counting the rows loaded"""
+   with instrument.stage('load', cls.__name__) as s:
+     rows = snapshot.rows(cls)
+     cls.load()
+     s.resources = snapshot.rows(cls) - rows
+
+def initPatientData(pid):
+   """Load a single patient's data, reading only its rows of each data file"""
+   Patient.load(pid=pid)
+   Med.load(pid)
+   Problem.load(pid)
+   Lab.load(pid=pid)
+   Refill.load(pid)
+   VitalSigns.load(pid)
+   Immunization.load(pid)
+   Procedure.load(pid)
+   SocialHistory.load(pid)
+   FamilyHistory.load(pid)
+   ClinicalNote.load(pid)
+   Allergy.load(pid)
+   ImagingStudy.load(pid)
+   Document.load(pid)
+   initVitalsPatient()
+
+def initVitalsPatient():
+   """Adds the generated growth-curve vitals of VITALS_PATIENT to the loaded
+   tables.  Called once per load, after any snapshot is saved, so the
+   snapshot holds only the data files' rows."""
+   if not VITALS_PATIENT in Patient.mpi: return
+   vpatient = generate_patient(testdata.stream('vitals', VITALS_PATIENT))
+   Patient.mpi[VITALS_PATIENT].dob = vpatient["birthday"]
+   VitalSigns.loadVitalsPatient(vpatient)
+
+def initWorker(docCachePath, seed, profile=False):
+   """Pool initializer: loads the data tables once per worker process"""
+   docs.cache.path = docCachePath
+   testdata.SEED = seed
+   instrument.enable(profile)
+   # Forked workers inherit the tables already loaded by the parent
+   if not Patient.mpi: initData()
+
+def writePatient(job):
+   """Writes a single patient bundle; job is (index, pid, path, baseURL, tag, prefix, format, idStrategy).
+   Returns the pid, the document cache and bundle writer counts and the
+   instrument timings for this patient."""
+   import fhir
+   index, pid, path, baseURL, tag, prefix, format, idStrategy = job
+   # The bundle ids depend only on the patient and its index, so they match
+   # a serial run whichever worker writes the bundle
+   patientIds = ids.allocator(idStrategy, pid, index)
+   before = dict(docs.cache.stats, **bundlewriter.stats)
+   timings = instrument.copy() if instrument.enabled else {}
+   with instrument.stage('bundle', format) as s:
+     patient = fhir.FHIRSamplePatient(pid, path, baseURL, tag, patientIds)
+     s.resources, s.bytes = writeBundle(patient, prefix, format)
+   after = dict(docs.cache.stats, **bundlewriter.stats)
+   return pid, dict((k, after[k]-before[k]) for k in before), instrument.diff(timings)
+
+def writePatients(job):
+   """Writes the bundles of a group of patients under a bundle policy; job is
+   (policy, jobs) with jobs as for writePatient.  Bundles are packed within
+   the group only, so the output does not depend on the number of workers.
+   Returns the pids, the document cache and bundle writer counts and the
+   instrument timings."""
+   import fhir
+   from bundlepolicy import BundlePacker
+   policy, jobs = job
+   before = dict(docs.cache.stats, **bundlewriter.stats)
+   timings = instrument.copy() if instrument.enabled else {}
+   path, format = jobs[0][2], jobs[0][6]
+   packer = BundlePacker(path, format, policy, testdata.currentTime().isoformat())
+   for index, pid, path, baseURL, tag, prefix, format, idStrategy in jobs:
+     patientIds = ids.allocator(idStrategy, pid, index)
+     with instrument.stage('bundle', format) as s:
+       patient = fhir.FHIRSamplePatient(pid, path, baseURL, tag, patientIds)
+       s.resources, s.bytes = packer.add(patient, prefix)
+   with instrument.stage('bundle', format) as s:
+     s.bytes = packer.close()
+   after = dict(docs.cache.stats, **bundlewriter.stats)
+   return [job[1] for job in jobs], dict((k, after[k]-before[k]) for k in before), instrument.diff(timings)
+
+def byteSize(text):
+   """Parses a byte count such as 500000, 512K or 20M"""
+   units = {'K': 1024, 'M': 1024*1024, 'G': 1024*1024*1024}
+   text = text.strip().upper()
+   if text[-1:] in units:
+     return int(float(text[:-1])*units[text[-1]])
+   return int(text)
+
+def writeBundle(patient, prefix, format):
+   """Writes a FHIRSamplePatient bundle in the given format ('xml' or 'json');
+   returns the number of resources and of bytes written"""
+   if format == 'json': return patient.writePatientJSON(prefix)
+   else: return patient.writePatientData(prefix)
 
 def displayPatientSummary(pid):
    """writes a patient summary to stdout"""
@@ -64,22 +173,54 @@ if __name__=='__main__':
      help="displays patient summary (default is 'all')")
   group.add_argument('--write-fhir',dest='writeFHIR', metavar='dir', nargs='?', const='.',
      help="writes patient XML files to an FHIR sample data directory dir (default='.')")
+  group.add_argument('--bulk-ndjson',dest='bulkNDJSON', metavar='dir',
+     help="writes FHIR Bulk Data NDJSON files, one per resource type, and a manifest.json to dir")
   parser.add_argument('--id-prefix',dest='prefix', metavar='id_prefix', nargs='?', const='',
      help="adds the given prefix to the FHIR resource IDs (default=none)")
   parser.add_argument('--base-url',dest='baseURL', metavar='base_url', nargs='?', const='',
      help="uses the supplied URL base to generate absolute resource references (default='')")
   parser.add_argument('--tag',dest='tag', metavar='tag', nargs='?', const='',
      help="tags all resources with the given value (default='')")
+  parser.add_argument('--format',dest='format', choices=('xml','json'), default='xml',
+     help="output format of the patient bundles (default=xml)")
+  parser.add_argument('--no-doc-cache',dest='docCache', action='store_false',
+     help="re-encodes document files instead of using the on-disk document cache")
+  parser.add_argument('--no-snapshot',dest='snapshot', action='store_false',
+     help="parses the data files instead of using the snapshot of the loaded data")
+  parser.add_argument('--incremental', action='store_true',
+     help="only rewrites the bundles whose data rows, documents or templates changed since the last run into dir")
+  parser.add_argument('--ids',dest='ids', choices=sorted(ids.STRATEGIES),
+     help="allocates bundle ids by counting patients ('block') or from a hash of the patient id ('hash') (default=block, or hash with a bundle size limit)")
+  parser.add_argument('--max-resources',dest='maxResources', metavar='N', type=int,
+     help="puts at most N resources in a bundle, splitting larger patients and packing smaller ones together (default: no limit)")
+  parser.add_argument('--max-bytes',dest='maxBytes', metavar='size', type=byteSize,
+     help="keeps bundles under size bytes (e.g. 512K, 20M), splitting and packing patients as for --max-resources (default: no limit)")
+  parser.add_argument('--seed',dest='seed', metavar='N', type=int,
+     help="draws every random value from per-patient streams derived from N, so the output is reproducible (default: unseeded)")
+  parser.add_argument('--jobs',dest='jobs', metavar='N', type=int, default=1,
+     help="writes patient files using N worker processes (default=1)")
+  parser.add_argument('--profile',dest='profile', metavar='file.json', nargs='?', const='-',
+     help="times each stage and resource type and prints the report, or writes it as JSON to file.json")
+  parser.add_argument('--profile-sort',dest='profileSort', choices=instrument.FIELDS, default='seconds',
+     help="orders the --profile report by this column, largest first (default=seconds)")
 
   args = parser.parse_args()
+  testdata.SEED = args.seed
+  instrument.enable(bool(args.profile))
+
+  def profileReport():
+    if not args.profile: return
+    if args.profile == '-': print (instrument.report(args.profileSort))
+    else: instrument.save(args.profile, args.profileSort)
 
   # Print a patient summary: 
   if args.summary:
-    initData()
     if args.summary=='all': # Print a summary of all patients
+      initData(args.snapshot)
       for pid in Patient.mpi: displayPatientSummary(pid)
       parser.exit()
     else: # Just print a single patient's summary
+      initPatientData(args.summary)
       if not args.summary in Patient.mpi:
         parser.error("Patient ID = %s not found"%args.summary)
       else: displayPatientSummary(args.summary)
@@ -89,20 +230,86 @@ if __name__=='__main__':
     import fhir
     print ("Writing files to %s:"%args.writeFHIR)
 
-    initData()
+    initData(args.snapshot)
     path = args.writeFHIR
     baseURL = args.baseURL or ""
     if not os.path.exists(path):
       parser.error("Invalid path: '%s'.Path must already exist."%path)
+    if args.jobs < 1:
+      parser.error("Invalid number of jobs: %d"%args.jobs)
     if args.prefix:
     	prefix = args.prefix
     else:
         prefix = None	 
+    if not args.docCache:
+      docs.cache.temporary()
+    from bundlepolicy import BundlePolicy, GROUP_SIZE
+    policy = BundlePolicy(args.maxResources, args.maxBytes)
+    if policy and args.incremental:
+      parser.error("--incremental is not supported with --max-resources or --max-bytes")
+    if policy and args.ids == 'block':
+      parser.error("--ids block gives one bundle id per patient; use --ids hash with a bundle size limit")
+    args.ids = args.ids or ('hash' if policy else 'block')
+    jobs = [(index, pid, path, baseURL, args.tag, prefix, args.format, args.ids)
+            for index, pid in enumerate(Patient.mpi)]
+    if args.incremental:
+      import incremental
+      manifest = incremental.Manifest(path)
+      fingerprints = incremental.fingerprints(list(Patient.mpi),
+                                              (args.format, prefix, baseURL, args.tag, args.ids, args.seed),
+                                              args.ids == 'block')
+      jobs = [job for job in jobs if not manifest.unchanged(job[1], fingerprints[job[1]],
+              os.path.join(path, fhir.bundleFileName(job[1], args.format)))]
+      print ("Skipping %d unchanged patients"%(len(Patient.mpi)-len(jobs)))
+    count, write = len(jobs), writePatient
+    if policy:
+      jobs = [(policy, jobs[i:i+GROUP_SIZE]) for i in range(0, len(jobs), GROUP_SIZE)]
+      write = writePatients
+    if args.jobs > 1:
+      pool = multiprocessing.Pool(args.jobs, initializer=initWorker,
+                                  initargs=(docs.cache.path, args.seed, instrument.enabled))
+      for pid, stats, timings in pool.imap_unordered(write, jobs):
+        instrument.merge(timings)
+        for k in stats:
+          counts = docs.cache.stats if k in docs.cache.stats else bundlewriter.stats
+          counts[k] += stats[k]
+        sys.stdout.flush()
+      pool.close()
+      pool.join()
+    else:
+      for job in jobs:
+        write(job)
+        # Show progress with '.' characters
+        sys.stdout.flush()
+    if args.incremental:
+      manifest.save(fingerprints)
+    print (docs.cache.report())
+    print (bundlewriter.report())
+    profileReport()
+    parser.exit(0,"\nDone writing %d patient FHIR files!\n"%count)
+
+  if args.bulkNDJSON:
+    import fhir
+    print ("Writing NDJSON files to %s:"%args.bulkNDJSON)
+
+    initData(args.snapshot)
+    path = args.bulkNDJSON
+    if not os.path.exists(path):
+      parser.error("Invalid path: '%s'.Path must already exist."%path)
+    if args.jobs != 1:
+      parser.error("--jobs is not supported with --bulk-ndjson")
+    if not args.docCache:
+      docs.cache.temporary()
+    export = fhir.BulkExport(path, "%s$export"%(args.baseURL or ""))
     for pid in Patient.mpi:
-      fhir.FHIRSamplePatient(pid, path, baseURL, args.tag).writePatientData(prefix)
-      # Show progress with '.' characters
+      with instrument.stage('bundle', 'ndjson') as s:
+        patient = fhir.FHIRSamplePatient(pid, path, args.baseURL or "", args.tag)
+        s.resources, s.bytes = patient.writePatientNDJSON(export, args.prefix or None)
       sys.stdout.flush()
-    parser.exit(0,"\nDone writing %d patient FHIR files!\n"%len(Patient.mpi))
+    export.close()
+    print (docs.cache.report())
+    profileReport()
+    parser.exit(0,"\nDone writing %d patients to %d NDJSON files!\n"%(len(Patient.mpi), len(export.counts)))
 
   # Generate a new patients data file, re-randomizing old names, dob, etc:
   # Patient.generate()  
@@ -0,0 +1,46 @@
+"""Allocation of the ids of unnamed resources, such as the bundle ids.
+
+The ids of a patient's bundle depend only on that patient, so bundles can be
+written in any order, in parallel or a few at a time and still get the same
+ids."""
+import uuid
+
+# Namespace of the hash-derived ids
+NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/smart-on-fhir/sample-patients')
+
+class BlockIds(object):
+    """Counts ids from a block of size ids reserved for the patient by its
+    index in the patient order: patient index gets index*size+1 to
+    (index+1)*size.  With the default size of 1 these are the ids the
+    former global counter gave, one bundle id per patient."""
+
+    def __init__(self, pid, index, size=1):
+        self.pid = pid
+        self.next_id = index*size
+        self.stop = (index+1)*size
+
+    def next(self, resource_type):
+        if self.next_id >= self.stop:
+            raise ValueError("Patient %s used up its block of ids"%self.pid)
+        self.next_id += 1
+        return str(self.next_id)
+
+class HashIds(object):
+    """Derives ids from the patient id, the resource type and a count of the
+    ids of that type given to the patient, as name-based (version 5) UUIDs.
+    They do not depend on the patient's index, so they stay the same when
+    patients are added, removed or selected."""
+
+    def __init__(self, pid, index=None):
+        self.pid = pid
+        self.counts = {}
+
+    def next(self, resource_type):
+        n = self.counts[resource_type] = self.counts.get(resource_type, 0) + 1
+        return str(uuid.uuid5(NAMESPACE, "%s/%s/%d"%(self.pid, resource_type, n)))
+
+STRATEGIES = {'block': BlockIds, 'hash': HashIds}
+
+def allocator(strategy, pid, index):
+    """Returns the id allocator of the given strategy for a patient"""
+    return STRATEGIES[strategy](pid, index)
@@ -1,37 +1,41 @@
 from testdata import IMAGINGSTUDIES_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class ImagingStudy: 
     """Create instances of ImagingStudy; 
 also maintains complete imaging studies lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'study_title', 'study_date', 'study_accession_number',
+                 'study_modality', 'study_oid', 'series_title', 'series_oid',
+                 'image_title', 'image_date', 'image_file_name', 'image_oid',
+                 'image_sop', 'mime_type', 'content', 'size', 'hash', 'binary_id')
+
     imagingStudies = {} # Dictionary of imaging studies lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient imaging studies"""
+    def load(cls,pid=None,studies_file_name=IMAGINGSTUDIES_FILE):
+      """Loads patient imaging studies (only patient pid's, if given)"""
       
       # Loop through imaging studies and build patient imaging studies lists:
-      probs = csv.reader(open(IMAGINGSTUDIES_FILE,'U'),dialect='excel-tab')
-      # header = probs.next()
-      header = next(probs)
+      header, probs = rowindex.reader(studies_file_name, pid)
       for prob in probs:
           cls(dict(zip(header,prob))) # Create a clinical note instance 
 
     def __init__(self,p):
         self.id = p['ID']
-        self.pid = p['PID']
-        self.study_title = p['STUDY_TITLE']
-        self.study_date = p['STUDY_DATE']
-        self.study_accession_number = p['STUDY_ACCESSION_NUMBER']
-        self.study_modality = p['STUDY_MODALITY']
-        self.study_oid = p['STUDY_OID']
-        self.series_title = p['SERIES_TITLE']
-        self.series_oid = p['SERIES_OID']
-        self.image_title = p['IMAGE_TITLE']
-        self.image_date = p['IMAGE_DATE']
+        self.pid = intern(p['PID'])
+        self.study_title = intern(p['STUDY_TITLE'])
+        self.study_date = intern(p['STUDY_DATE'])
+        self.study_accession_number = intern(p['STUDY_ACCESSION_NUMBER'])
+        self.study_modality = intern(p['STUDY_MODALITY'])
+        self.study_oid = intern(p['STUDY_OID'])
+        self.series_title = intern(p['SERIES_TITLE'])
+        self.series_oid = intern(p['SERIES_OID'])
+        self.image_title = intern(p['IMAGE_TITLE'])
+        self.image_date = intern(p['IMAGE_DATE'])
         self.image_file_name = p['IMAGE_FILE_NAME']
         self.image_oid = p['IMAGE_OID']
         self.image_sop = p['IMAGE_SOP']
@@ -59,7 +63,7 @@ if __name__== '__main__':
      help='display imaging studies for a given patient id (default=2169591)')
   args = parser.parse_args()
  
-  ImagingStudy.load()
+  ImagingStudy.load(pid=args.pid)
   if args.pid:
     if not args.pid in ImagingStudy.imagingStudies:
       parser.error("No results found for pid = %s"%args.pid)
@@ -1,30 +1,37 @@
 from testdata import IMMUNIZATIONS_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class Immunization: 
     """Create instances of Immunization list entries; 
 also maintains complete Immunization lists by patient id"""
 
+    # The immunizations file columns; each is kept in the attribute of the
+    # same name in lower case
+    columns = ('ID', 'PID', 'date', 'CVX', 'CVX_title', 'VG', 'VG_title', 'VG2',
+               'VG2_title', 'administration_status', 'refusal_reason')
+    __slots__ = tuple(c.lower() for c in columns) + ('cvx_system', 'cvx_id')
+
     immunizations = {} # Dictionary of Immunization lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Immunization observations"""
+    def load(cls,pid=None,immunizations_file_name=IMMUNIZATIONS_FILE):
+      """Loads patient Immunization observations (only patient pid's, if given)"""
       
       # Loop through Immunizations and build patient Immunizations lists:
-      iis = csv.reader(open(IMMUNIZATIONS_FILE,'U'),dialect='excel-tab')
-      # header = iis.next() 
-      header = next(iis)
+      header, iis = rowindex.reader(immunizations_file_name, pid)
       for i in iis:
           cls(dict(zip(header,i))) # Create a Immunization instance (saved in Immunizations.immunizations)
 
     def __init__(self,m):
-        for f in m:
-            setattr(self, f.lower(), m[f])
-
-        self.sourcerow = m
+        # Only the declared columns are kept; any other column of the file
+        # is ignored, and a missing one is a KeyError naming it
+        for c in self.columns:
+            value = m[c]
+            if c != 'ID' and isinstance(value, str): value = intern(value)
+            setattr(self, c.lower(), value)
 
         # Append Immunization to the patient's Immunization list:
         if self.pid in  self.__class__.immunizations:
@@ -32,7 +39,7 @@ also maintains complete Immunization lists by patient id"""
         else: self.__class__.immunizations[self.pid] = [self]
 
     def asTabString(self):
-        return self.sourcerow
+        return dict((c, getattr(self, c.lower())) for c in self.columns)
 
 if __name__== '__main__':
   print ("As main")
@@ -43,7 +50,7 @@ if __name__== '__main__':
      help='display Immunizations for a given patient id (default=1614502)')
   args = parser.parse_args()
   print (args)
-  Immunization.load()
+  Immunization.load(pid=args.pid)
   if args.pid:
     if not args.pid in Immunization.immunizations:
       parser.error("No results found for pid = %s"%args.pid)
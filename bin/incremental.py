@@ -0,0 +1,100 @@
+"""Incremental regeneration: fingerprints of each patient's inputs, compared
+with the manifest of the previous run to skip unchanged bundles"""
+from testdata import DATA_PATH
+from document import Document
+from clinicalnote import ClinicalNote
+from imagingstudy import ImagingStudy
+import docs
+import hashlib
+import glob
+import json
+import csv
+import sys
+import os
+
+MANIFEST_FILE = '.fhir-manifest.json' # In the output directory
+TEMPLATES_PATH = 'fhir_templates'
+
+def rowDigests(data_path=DATA_PATH):
+    """Returns a sha1 of each patient's rows across all the data files, by
+    patient id, from one pass over the files"""
+    digests = {}
+    for file_name in sorted(glob.glob(os.path.join(data_path, '*.txt'))):
+        rows = csv.reader(open(file_name, newline=''), dialect='excel-tab')
+        header = next(rows)
+        if 'PID' not in header: continue
+        pindex = header.index('PID')
+        table = os.path.basename(file_name).encode('utf-8')
+        for row in rows:
+            if len(row) <= pindex: continue
+            h = digests.get(row[pindex])
+            if h is None: h = digests[row[pindex]] = hashlib.sha1()
+            h.update(table + b'\0' + '\t'.join(row).encode('utf-8') + b'\n')
+    return digests
+
+def codeDigest(options):
+    """Returns a sha1 of the templates, the generator's own loaded modules and
+    the output options, which affect every bundle"""
+    h = hashlib.sha1(repr(options).encode('utf-8'))
+    here = os.path.dirname(os.path.abspath(__file__))
+    sources = set(glob.glob(os.path.join(TEMPLATES_PATH, '*')))
+    for module in list(sys.modules.values()):
+        f = getattr(module, '__file__', None)
+        if f and os.path.dirname(os.path.abspath(f)) == here: sources.add(f)
+    for f in sorted(sources, key=os.path.basename):
+        with open(f, 'rb') as source:
+            h.update(os.path.basename(f).encode('utf-8') + b'\0' + source.read())
+    return h.hexdigest()
+
+def documentKeys(pid):
+    """The cache keys (real path, mtime, size) of the document files of a
+    patient, so edited documents change its fingerprint"""
+    names = [d.file_name for d in Document.documents.get(pid, [])]
+    names += [d.file_name for d in ClinicalNote.clinicalNotes.get(pid, [])]
+    names += [i.image_file_name for i in ImagingStudy.imagingStudies.get(pid, [])]
+    keys = []
+    for name in names:
+        try:
+            keys.append(docs.cache.key(os.path.join(docs.BASE_DOCUMENTS_PATH, pid, name)))
+        except OSError:
+            keys.append((name, None))
+    return keys
+
+def fingerprints(pids, options, indexed=True):
+    """Returns the fingerprint of each patient's bundle, by patient id.
+
+    It covers the patient's rows in every data file, its document files,
+    its position in the patient order if indexed (block bundle ids count
+    patients), and the templates, code and options shared by all bundles."""
+    rows = rowDigests()
+    code = codeDigest(options)
+    result = {}
+    for index, pid in enumerate(pids):
+        h = hashlib.sha1(("%s\0%d\0"%(code, index if indexed else -1)).encode('utf-8'))
+        if pid in rows: h.update(rows[pid].digest())
+        h.update(repr(documentKeys(pid)).encode('utf-8'))
+        result[pid] = h.hexdigest()
+    return result
+
+class Manifest(object):
+    """The fingerprints of the bundles written to an output directory"""
+
+    def __init__(self, path):
+        self.file_name = os.path.join(path, MANIFEST_FILE)
+        try:
+            with open(self.file_name) as f:
+                self.fingerprints = json.load(f)['fingerprints']
+        except (IOError, ValueError, KeyError):
+            self.fingerprints = {}
+
+    def unchanged(self, pid, fingerprint, bundle_file):
+        """True if the patient's bundle was written from the same inputs and
+        is still there"""
+        return self.fingerprints.get(pid) == fingerprint and os.path.exists(bundle_file)
+
+    def save(self, fingerprints):
+        self.fingerprints = fingerprints
+        tmp = "%s.%d.tmp"%(self.file_name, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'fingerprints': fingerprints}, f, indent=0, sort_keys=True)
+        os.replace(tmp, self.file_name)
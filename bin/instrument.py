@@ -0,0 +1,112 @@
+"""Timing instrumentation of the generator stages and resource types.
+
+When enabled (generate.py --profile), the instrumented code records the wall
+time, calls, resources and bytes of each stage (loading a table, fetching a
+document, writing a bundle, flushing to the file) and of each resource type
+rendered into a bundle.  Stages nest: the time of a bundle includes the time
+of its resources, document fetches and file writes.
+
+Other code can watch the same measurements with a hook:
+
+    import instrument
+    instrument.addHook(lambda kind, name, seconds, resources, bytes: ...)
+
+Hooks are called in the process doing the work, so with --jobs they run in
+the worker processes."""
+import time
+import json
+
+enabled = False
+
+# Totals by (kind, name): [seconds, calls, resources, bytes]
+timings = {}
+
+hooks = []
+
+FIELDS = ('seconds', 'calls', 'resources', 'bytes')
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+def addHook(hook):
+    """Calls hook(kind, name, seconds, resources, bytes) for each measurement,
+    and turns the instrumentation on"""
+    hooks.append(hook)
+    enable()
+
+def removeHook(hook):
+    hooks.remove(hook)
+
+def record(kind, name, seconds, resources=0, bytes=0, calls=1):
+    t = timings.get((kind, name))
+    if t is None: t = timings[(kind, name)] = [0.0, 0, 0, 0]
+    t[0] += seconds
+    t[1] += calls
+    t[2] += resources
+    t[3] += bytes
+    for hook in hooks:
+        hook(kind, name, seconds, resources, bytes)
+
+class stage(object):
+    """Times a block as a stage, when enabled:
+
+        with instrument.stage('load', 'Lab') as s:
+            ...
+            s.bytes += size
+
+    resources and bytes can be added to while the block runs."""
+
+    def __init__(self, name, detail=None, kind='stage'):
+        self.kind = kind
+        self.name = "%s %s"%(name, detail) if detail else name
+        self.resources = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        if enabled: self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if enabled:
+            record(self.kind, self.name, time.perf_counter() - self.start,
+                   self.resources, self.bytes)
+
+def copy():
+    """The current totals, for diff()"""
+    return dict((k, list(t)) for k, t in timings.items())
+
+def diff(before):
+    """The totals recorded since copy() returned before, as merge() takes them"""
+    return [(k, [t[i] - before.get(k, (0, 0, 0, 0))[i] for i in range(4)])
+            for k, t in timings.items() if t != before.get(k)]
+
+def merge(items):
+    """Adds totals recorded by another process (see diff())"""
+    for (kind, name), (seconds, calls, resources, bytes) in items:
+        t = timings.get((kind, name))
+        if t is None: t = timings[(kind, name)] = [0.0, 0, 0, 0]
+        t[0] += seconds
+        t[1] += calls
+        t[2] += resources
+        t[3] += bytes
+
+def results(sort='seconds'):
+    """The totals as a list of dictionaries, stages first, each kind sorted
+    by the given field, largest first"""
+    rows = [dict(zip(('kind', 'name') + FIELDS, k + tuple(t))) for k, t in timings.items()]
+    rows.sort(key=lambda r: (r['kind'] != 'stage', r['kind'], -r[sort], r['name']))
+    return rows
+
+def report(sort='seconds'):
+    lines = ["%-8s %-28s %10s %9s %10s %12s"%(('kind', 'name') + FIELDS)]
+    for r in results(sort):
+        lines.append("%-8s %-28s %10.3f %9d %10d %12d"%(
+            r['kind'], r['name'], r['seconds'], r['calls'], r['resources'], r['bytes']))
+    return "\n".join(lines)
+
+def save(file_name, sort='seconds'):
+    """Writes the totals to file_name as JSON"""
+    with open(file_name, 'w') as f:
+        json.dump({'timings': results(sort)}, f, indent=2)
+        f.write("\n")
@@ -1,40 +1,68 @@
-from testdata import LABS_FILE, rndAccNum
+from testdata import LABS_FILE, rndAccNum, stream
 from codes import Loinc
+from columns import Row, ColumnStore
+from sys import intern
+import random
+import rowindex
 import argparse
-import csv
 
-class Lab: 
-    """Create instances of lab results; 
-also maintains complete results list (by patient)
+class Lab(Row): 
+    """Views of lab results; 
+also maintains the complete results columns (by patient)
 and a dictionary of loinc code frequencies"""
 
+    __slots__ = ('categoryCode', 'categoryDisplay')
+
+    # Result columns; value, low and high are also held as floats converted
+    # at load time (nan where not numeric) in value_num, low_num and high_num,
+    # which the observation template and fhirjson render instead of the text
+    fields = ('id', 'pid', 'code', 'date', 'name', 'scale', 'value', 'low',
+              'high', 'units', 'acc_num', 'value_num', 'low_num', 'high_num')
+    numeric = ('value_num', 'low_num', 'high_num')
+
     codes = {}   # Dictionary of code frequency indexed by loinc code
-    results = {} # Dictionary of result lists, by patient id 
+    results = None # ColumnStore of results, by patient id (Lab views); set below
 
     @classmethod
-    def load(cls):
-      """Loads patient lab observations"""
+    def load(cls,labs_file_name=LABS_FILE,pid=None):
+      """Loads patient lab observations (only patient pid's, if given)"""
       
-      # First build the codes and frequency dictionary:
-      labs = csv.reader(open(LABS_FILE,'U'),dialect='excel-tab')
-      # header = labs.next()
-      header = next(labs)
+      # Parse the file once, keeping the rows as tuples and building the
+      # codes frequency dictionary as we go:
+      header, labs = rowindex.reader(labs_file_name, pid)
       cindex = header.index('LOINC')  # Locate the LOINC index field
+      rows = []
       for lab in labs:
         code = lab[cindex] # Get the loinc code from the result record
         if code in cls.codes:  # Update the codes dictionary with the count
           cls.codes[code] += 1
         else: cls.codes[code] = 1
+        rows.append(tuple(lab))
 
       # And initialize Loinc.info dictionary to handle these codes:
       Loinc.load(cls.codes.keys())
 
-      # Now loop back through labs and build patient results lists:
-      labs = csv.reader(open(LABS_FILE,'U'),dialect='excel-tab')
-      # header = labs.next() 
-      header = next(labs)
-      for lab in labs:
-          cls(dict(zip(header,lab))) # Create a result instance (saved in Lab.results)
+      # Resolve LOINC names and UCUM units once per code, not once per row:
+      resolved = dict((code, (Loinc.info[code].name, Loinc.info[code].ucum))
+                      for code in cls.codes if code in Loinc.info)
+
+      # Now build the result records, in file order, grouped by patient,
+      # drawing the accession numbers from each patient's own stream:
+      patients = {}
+      streams = {}
+      for lab in rows:
+          o = dict(zip(header,lab))
+          rng = streams.get(o['PID'])
+          if rng is None: rng = streams[o['PID']] = stream('accession', o['PID'])
+          patients.setdefault(o['PID'], []).append(cls.record(o, resolved.get(lab[cindex], ()), rng))
+      rows = None
+      for pid in patients:
+          cls.results.extend(intern(pid), patients[pid])
+
+    @classmethod
+    def add(cls,o,loinc=None):
+      """Adds a result from a row dictionary to Lab.results"""
+      cls.results.extend(intern(o['PID']), [cls.record(o, loinc)])
 
     @classmethod
     def stats(cls):
@@ -56,40 +84,41 @@ and a dictionary of loinc code frequencies"""
        print ("%d patients with lab results"%len(cls.results))
        print ("%d unique tests (LOINC codes)"%len(cls.codes))
 
-    def __init__(self,o):
-        self.id = o['ID']
-        self.pid = o['PID']
-        self.code= o['LOINC'] 
-        self.date = o['DATE']
-        if self.code in Loinc.info.keys():
-            self.name = Loinc.info[self.code].name
-        else: self.name = o['NAME']
-        self.scale = o['SCALE']#Loinc.info[self.code].scale
+    @classmethod
+    def record(cls,o,loinc=None,rng=random):
+        """Returns the values, in field order, of a result from a row
+        dictionary; loinc is the (name, ucum) pair for its code, looked up
+        in Loinc.info when not given, and rng draws the accession number"""
+        pid = intern(o['PID'])
+        code = intern(o['LOINC'])
+        if loinc is None:
+            loinc = (Loinc.info[code].name, Loinc.info[code].ucum) \
+                    if code in Loinc.info else ()
+        if loinc:
+            name = loinc[0]
+        else: name = intern(o['NAME'])
+        scale = intern(o['SCALE'])#Loinc.info[code].scale
         # Handle value and ranges:
-        self.value = o['VALUE']
-        if self.scale=='Qn':
-          self.low=o['LOW']
-          self.high=o['HIGH']
-        if self.scale=='Ord':
+        value = intern(o['VALUE'])
+        low = high = None
+        if scale=='Qn':
+          low=intern(o['LOW'])
+          high=intern(o['HIGH'])
+        if scale=='Ord':
           # The Ord choices are stored in the low value field, separated by ';'
-          self.low = o['LOW'].split('; ')
-          if len (self.low[0]) > 0 and not self.value in self.low:
+          low = [intern(choice) for choice in o['LOW'].split('; ')]
+          if len (low[0]) > 0 and not value in low:
             # Print out error msg if Ord values not formatted properly:
             print ("%s -> Error for code %s: value=%s not in %s"%(
-              self.pid,self.code,self.value,self.low))
+              pid,code,value,low))
 
         # Handle units, update to UCUM if possible:
-        if self.code in Loinc.info.keys() and Loinc.info[self.code].ucum: #if there is a ucum unit available
-          self.units = Loinc.info[self.code].ucum  # Then use it
-        else: self.units = o['UNITS'] # Otherwise, use result units
+        if loinc and loinc[1]: #if there is a ucum unit available
+          units = loinc[1]  # Then use it
+        else: units = intern(o['UNITS']) # Otherwise, use result units
 
-        self.acc_num = rndAccNum()
-        #self.scale = Loinc.info[self.code].scale
-      
-        # Append result to the results dictionary of lists
-        if self.pid in  self.__class__.results:
-          self.__class__.results[self.pid].append(self)
-        else: self.__class__.results[self.pid] = [self]
+        return (o['ID'], pid, code, intern(o['DATE']), name, scale, value, low,
+                high, units, rndAccNum(rng), value, low, high)
 
     def asTabString(self):
        """Returns a tab-separated string representation of lab instance"""
@@ -105,6 +134,8 @@ and a dictionary of loinc code frequencies"""
          s += "%s\t"%v 
        return s[0:-1] # Throw away the last tab
 
+Lab.results = ColumnStore(Lab, Lab.fields, Lab.numeric)
+
 if __name__== '__main__':
 
   parser = argparse.ArgumentParser(description='Test Data Lab Module')
@@ -116,7 +147,7 @@ if __name__== '__main__':
      help='display labs for a given patient id (default=1520204)')
   args = parser.parse_args()
  
-  Lab.load()
+  Lab.load(pid=args.pid)
   if args.stats:
     Lab.stats()
     parser.exit()
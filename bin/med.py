@@ -1,22 +1,24 @@
 from testdata import MEDS_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class Med: 
     """Create instances of Medication list entries; 
 also maintains complete med lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'start', 'end', 'status', 'rxn', 'name', 'sig', 'q',
+                 'days', 'refills', 'qtt', 'qttunit', 'freq', 'frequnit', 'freqduration')
+
     meds = {} # Dictionary of med lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Med observations"""
+    def load(cls,pid=None,meds_file_name=MEDS_FILE):
+      """Loads patient Med observations (only patient pid's, if given)"""
       
       # Loop through meds and build patient med lists:
-      meds = csv.reader(open(MEDS_FILE,'U'),dialect='excel-tab')
-      # header = meds.next()
-      header = next(meds)
+      header, meds = rowindex.reader(meds_file_name, pid)
 
       for med in meds:
           cls(dict(zip(header,med))) # Create a med instance (saved in Med.meds)
@@ -24,21 +26,21 @@ also maintains complete med lists by patient id"""
 
     def __init__(self,m):
         self.id = m['ID']
-        self.pid = m['PID']
-        self.start = m['START_DATE']
-        self.end = m['END_DATE']
+        self.pid = intern(m['PID'])
+        self.start = intern(m['START_DATE'])
+        self.end = intern(m['END_DATE'])
         self.status = "active" if not self.end else "completed"
-        self.rxn= m['RxNorm'] 
-        self.name = m['Name']
-        self.sig = m['SIG']
-        self.q = m['Q']
-        self.days = m['DAYS']
+        self.rxn= intern(m['RxNorm'])
+        self.name = intern(m['Name'])
+        self.sig = intern(m['SIG'])
+        self.q = intern(m['Q'])
+        self.days = intern(m['DAYS'])
         self.refills = int(m['REFILLS']) + 1 if m['REFILLS'] else m['REFILLS']
         self.qtt = m['Q_TO_TAKE_VALUE']
         if(self.qtt != ""): self.qtt = int(float(self.qtt))
-        self.qttunit = m['Q_TO_TAKE_UNIT']
-        self.freq = m['FREQUENCY_VALUE'] 
-        self.frequnit = m['FREQUENCY_UNIT']
+        self.qttunit = intern(m['Q_TO_TAKE_UNIT'])
+        self.freq = intern(m['FREQUENCY_VALUE'])
+        self.frequnit = intern(m['FREQUENCY_UNIT'])
         assert self.frequnit == '' or self.frequnit.startswith('/')
         if self.frequnit.startswith('/'):
             self.freqduration = self.frequnit.split('/')[1]
@@ -65,7 +67,7 @@ if __name__== '__main__':
      help='display meds for a given patient id (default=1520204)')
   args = parser.parse_args()
  
-  Med.load()
+  Med.load(pid=args.pid)
   if args.pid:
     if not args.pid in Med.meds:
       parser.error("No results found for pid = %s"%args.pid)
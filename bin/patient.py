@@ -1,67 +1,72 @@
 from testdata import PATIENTS_FILE, RI_PATIENTS_FILE
-from testdata import rndDate, rndName, rndAddress, rndTelephone, toEmail, rndGestAge
-from random import randint
+from testdata import rndDate, rndName, rndAddress, rndTelephone, toEmail, rndGestAge, stream
+from sys import intern
 import datetime
+import rowindex
 import argparse
 import csv
 
 class Patient:
     """Creates patient instances and maintains a dictionary of all patients""" 
 
+    __slots__ = ('pid', 'fname', 'lname', 'gender', 'zip', 'dob', 'initial', 'street',
+                 'apartment', 'city', 'region', 'pcode', 'country', 'email', 'home',
+                 'cell', 'gestage', 'photo_code', 'photo_binary_id', 'photo_size',
+                 'photo_hash', 'photo_title')
+
     mpi = {}  # static dictionary to hold the master patient index.
 
 
     @classmethod
-    def generate(cls,patient_file_name=RI_PATIENTS_FILE):
+    def generate(cls,patient_file_name=RI_PATIENTS_FILE,out_file_name=PATIENTS_FILE):
       """Generates a patient file from raw data; replaces old patients file"""
       # Open the patient data file for writing generated data
-      f = open(PATIENTS_FILE,'w')
+      f = open(out_file_name,'w',encoding='utf-8')
       top = True # Starting at the top of the file (need to write header here...)
 
       # Open the raw data file and read in the first (header) record
-      pats = csv.reader(file(patient_file_name,'U'),dialect='excel-tab')
-      header = pats.next() 
+      pats = csv.reader(open(patient_file_name,newline='',encoding='utf-8'),dialect='excel-tab')
+      header = next(pats)
 
       # Read in patient data:
       for pat in pats: 
         p=dict((zip(header,pat))) # create patient from header and row values     
+        rng = stream('patient', p['PID']) # this patient's random numbers
         # Add synthetic data
-        patient_name = rndName(p['GENDER'])
+        patient_name = rndName(p['GENDER'], rng)
         p['fname']=patient_name[0]
         p['initial']=patient_name[1]
         p['lname']=patient_name[2]
         # Add random day of year to year of birth to get dob value
         # Make it for the prior year so vists, tests come after birth
-        p['dob']=rndDate(int(p['YOB'])-1).isoformat()
+        p['dob']=rndDate(int(p['YOB'])-1, rng).isoformat()
         # Map raw GENDER to SMART encoding values
         # (For the moment, SMART only handles 'male' and 'female'...)
         gender = 'male' if p['GENDER']=='M' else 'female'
         p['gender'] = gender
         p['email'] = toEmail(patient_name)
         # Finally, add a random address:
-        adr = rndAddress()
-        p = dict(p.items() + adr.items())
-        p['home'] = '' if randint(0,1) else rndTelephone()
-        p['cell'] = '' if randint(0,1) else rndTelephone()
-        p['gestage'] = '' if randint(0,1) else rndGestAge()
+        adr = rndAddress(rng)
+        p = {**p, **adr}
+        p['home'] = '' if rng.randint(0,1) else rndTelephone(rng)
+        p['cell'] = '' if rng.randint(0,1) else rndTelephone(rng)
+        p['gestage'] = '' if rng.randint(0,1) else rndGestAge(rng)
         
         # Write out the new patient data file:
         # Start with the header (writing only once at the top of the file):
         if top:
-          head = p.keys()
-          print >>f, "\t".join(head)
+          head = list(p.keys())
+          print ("\t".join(head), file=f)
           top = False
         # Then write out the row:
-        print >>f, "\t".join([ p[field] for field in head])
+        print ("\t".join([ p[field] for field in head]), file=f)
       f.close()
      
     @classmethod
-    def load(cls,patient_file_name=PATIENTS_FILE):
-      """Load patients from a data file"""
+    def load(cls,patient_file_name=PATIENTS_FILE,pid=None):
+      """Load patients from a data file (only patient pid's, if given)"""
       # Open data file and read in the first (header) record
-      pats = csv.reader(open(patient_file_name,'U'),dialect='excel-tab')
-      # header = pats.next() 
-      header = next(pats)
+      header, pats = rowindex.reader(patient_file_name, pid)
 
       # Now, read in patient data:
       for pat in pats: 
@@ -69,31 +74,29 @@ class Patient:
 
     def __init__(self,patient_dictionary):
       """Patient instance is initalized with a demographics dictionary"""
-      self.demographics = patient_dictionary
-      # Initialize instance vars for backward compatibility
-      self.pid = self.demographics['PID']
-      self.fname = self.demographics['fname']
-      self.lname = self.demographics['lname']
-      self.gender= self.demographics['gender']
-      self.zip = self.demographics['pcode']
-      self.dob = self.demographics['dob']
+      demographics = patient_dictionary
+      self.pid = intern(demographics['PID'])
+      self.fname = intern(demographics['fname'])
+      self.lname = intern(demographics['lname'])
+      self.gender= intern(demographics['gender'])
+      self.zip = intern(demographics['pcode'])
+      self.dob = demographics['dob']
       
       # Initialize additional instance vars
-      self.initial = self.demographics['initial']
-      self.street = self.demographics['street']
-      self.apartment = self.demographics['apartment']
-      self.city = self.demographics['city']
-      self.region = self.demographics['region']
-      self.pcode = self.demographics['pcode']
-      self.country = self.demographics['country']
-      self.email = self.demographics['email']
-      self.home = self.demographics['home']
-      self.cell = self.demographics['cell']
-      self.gestage = self.demographics['gestage']
+      self.initial = intern(demographics['initial'])
+      self.street = demographics['street']
+      self.apartment = demographics['apartment']
+      self.city = intern(demographics['city'])
+      self.region = intern(demographics['region'])
+      self.pcode = self.zip
+      self.country = intern(demographics['country'])
+      self.email = demographics['email']
+      self.home = demographics['home']
+      self.cell = demographics['cell']
+      self.gestage = intern(demographics['gestage'])
       
       # Insert the patient instance into the Patient mpi store:
-      pid = self.demographics['PID']
-      if not pid in self.__class__.mpi: self.__class__.mpi[pid]=self
+      if not self.pid in self.__class__.mpi: self.__class__.mpi[self.pid]=self
 
     def asTabString(self):
       """Return a string with a tab-separated represention of demographics"""
@@ -1,32 +1,33 @@
 from testdata import PROBLEMS_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class Problem: 
     """Create instances of Problem; 
 also maintains complete problem lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'start', 'end', 'snomed', 'name')
+
     problems = {} # Dictionary of problem lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Problem observations"""
+    def load(cls,pid=None,problems_file_name=PROBLEMS_FILE):
+      """Loads patient Problem observations (only patient pid's, if given)"""
       
       # Loop through problems and build patient problem lists:
-      probs = csv.reader(open(PROBLEMS_FILE,'U'),dialect='excel-tab')
-      # header = probs.next()
-      header = next(probs)
+      header, probs = rowindex.reader(problems_file_name, pid)
       for prob in probs:
           cls(dict(zip(header,prob))) # Create a problem instance 
 
     def __init__(self,p):
         self.id = p['ID']
-        self.pid = p['PID']
-        self.start = p['START_DATE']
-        self.end = p['END_DATE']
-        self.snomed= p['SNOMED'] 
-        self.name = p['NAME']
+        self.pid = intern(p['PID'])
+        self.start = intern(p['START_DATE'])
+        self.end = intern(p['END_DATE'])
+        self.snomed= intern(p['SNOMED'])
+        self.name = intern(p['NAME'])
         # Append problem to the patient's problem list:
         if self.pid in  self.__class__.problems:
           self.__class__.problems[self.pid].append(self)
@@ -50,7 +51,7 @@ if __name__== '__main__':
      help='display problems for a given patient id (default=1520204)')
   args = parser.parse_args()
  
-  Problem.load()
+  Problem.load(pid=args.pid)
   if args.pid:
     if not args.pid in Problem.problems:
       parser.error("No results found for pid = %s"%args.pid)
@@ -1,30 +1,31 @@
 from testdata import PROCEDURES_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class Procedure: 
     """Create instances of Procedure; also maintains complete procedure lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'date', 'snomed', 'name', 'notes')
+
     procedures = {} # Dictionary of procedure lists, by patient id 
 
     @classmethod
-    def load(cls):
-      """Loads patient Procedure observations"""
+    def load(cls,pid=None,procedures_file_name=PROCEDURES_FILE):
+      """Loads patient Procedure observations (only patient pid's, if given)"""
       
       # Loop through procedures and build patient procedure lists:
-      procs = csv.reader(open(PROCEDURES_FILE,'U'),dialect='excel-tab')
-      # header = procs.next()
-      header = next(procs)
+      header, procs = rowindex.reader(procedures_file_name, pid)
       for proc in procs:
           cls(dict(zip(header,proc))) # Create a procedure instance 
 
     def __init__(self,p):
         self.id = p['ID']
-        self.pid = p['PID']
-        self.date = p['DATE']
-        self.snomed= p['SNOMED'] 
-        self.name = p['NAME']
+        self.pid = intern(p['PID'])
+        self.date = intern(p['DATE'])
+        self.snomed= intern(p['SNOMED'])
+        self.name = intern(p['NAME'])
         self.notes = p['NOTES']
         # Append procedure to the patient's procedure list:
         if self.pid in  self.__class__.procedures:
@@ -49,7 +50,7 @@ if __name__== '__main__':
      help='display procedures for a given patient id (default=1520204)')
   args = parser.parse_args()
  
-  Procedure.load()
+  Procedure.load(pid=args.pid)
   if args.pid:
     if not args.pid in Procedure.procedures:
       parser.error("No results found for pid = %s"%args.pid)
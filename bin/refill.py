@@ -1,42 +1,53 @@
 from testdata import REFILLS_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class Refill: 
     """Create instances of a med refill; 
 also maintains complete refills lists by patient id"""
 
+    __slots__ = ('id', 'pid', 'date', 'rxn', 'days', 'q')
+
     refills = {} # Dictionary of refills, by patient id 
+    index = {}   # Dictionary of refill histories, by (patient id, rxn)
 
     @classmethod
-    def load(cls):
-      """Loads med refills"""
+    def load(cls,pid=None,refills_file_name=REFILLS_FILE):
+      """Loads med refills (only patient pid's, if given)"""
       
       # Loop through refills and build med refill list:
-      refills = csv.reader(open(REFILLS_FILE,'U'),dialect='excel-tab')
-      # header = refills.next() 
-      header = next(refills)
+      header, refills = rowindex.reader(refills_file_name, pid)
       for refill in refills:
           cls(dict(zip(header,refill))) # Create a refill instance 
+      cls.buildIndex()
+
+    @classmethod
+    def buildIndex(cls):
+       """Builds the refill histories returned by refill_list"""
+       histories = {}
+       for pid in cls.refills:
+         for med in cls.refills[pid]:
+           if int(med.q): # non-zero quantity
+             # and only one rxn per day (the last one listed)
+             histories.setdefault((pid, med.rxn), {})[med.date] = med
+       cls.index = dict((key, [days[date] for date in sorted(days)])
+                        for key, days in histories.items())
 
     @classmethod
     def refill_list(cls,pid,rxn):
-       """Return a refill history for patient, pid, and for med, rxn""" 
-       refills = {}
-       if not pid in cls.refills: return []
-       for med in cls.refills[pid]:
-         if int(med.q) and med.rxn==rxn: # non-zero quantity
-           refills[rxn+med.date]=med # and only one rnx per day
-       return refills.values()
+       """Return a refill history for patient, pid, and for med, rxn,
+       ordered by date (the list is shared, do not modify it)""" 
+       return cls.index.get((pid, rxn), [])
 
     def __init__(self,p):
         self.id = p['ID']
-        self.pid = p['PID']
-        self.date = p['DATE']
-        self.rxn= p['RXN'] 
-        self.days = p['DAYS']
-        self.q = p['Q']
+        self.pid = intern(p['PID'])
+        self.date = intern(p['DATE'])
+        self.rxn= intern(p['RXN'])
+        self.days = intern(p['DAYS'])
+        self.q = intern(p['Q'])
         # Append refill to the refills list:
         if self.pid in  self.__class__.refills:
           self.__class__.refills[self.pid].append(self)
@@ -60,7 +71,7 @@ if __name__== '__main__':
      help='display refills for a given patient id (default=1288992)')
   args = parser.parse_args()
  
-  Refill.load()
+  Refill.load(pid=args.pid)
   if args.pid:
     if not args.pid in Refill.refills:
       parser.error("No results found for pid = %s"%args.pid)
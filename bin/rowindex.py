@@ -0,0 +1,99 @@
+"""Per-patient byte-offset index over the tab-separated data files, so a
+single patient's rows can be read without parsing the whole file.
+
+connect() keeps any SQLite index of a file up to date with the file; the
+LOINC index (codes.py) is built through it too."""
+from testdata import ROW_INDEX_PATH
+import hashlib
+import sqlite3
+import csv
+import os
+
+def lines(f, position):
+    """Yields the decoded lines of the binary file f, keeping position[0] at
+    the offset just past the last line yielded"""
+    for line in f:
+        position[0] += len(line)
+        yield line.decode('utf-8')
+
+def index_file(file_name, index_path=ROW_INDEX_PATH):
+    """The row index file of a data file, named after the file and a digest
+    of its path, so files of the same name in different directories get
+    their own index"""
+    path = os.path.abspath(file_name)
+    return os.path.join(index_path, "%s-%s.sqlite"%(os.path.basename(path),
+        hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]))
+
+def index(file_name, index_path=ROW_INDEX_PATH):
+    """Returns a connection to the SQLite row index of a data file,
+    (re)building it first if it is missing or older than the file"""
+    return connect(file_name, index_file(file_name, index_path), fill)
+
+def connect(file_name, index_file_name, fill):
+    """Returns a connection to the SQLite index of a file in index_file_name,
+    (re)building it with fill first if it is missing or older than the file"""
+    st = os.stat(file_name)
+    source = [os.path.abspath(file_name), st.st_mtime_ns, st.st_size]
+    if os.path.exists(index_file_name):
+        db = sqlite3.connect(index_file_name)
+        try:
+            if list(db.execute("SELECT path, mtime, size FROM source").fetchone()) == source:
+                return db
+        except sqlite3.Error: pass
+        db.close()
+    build(file_name, index_file_name, source, fill)
+    return sqlite3.connect(index_file_name)
+
+def build(file_name, index_file_name, source, fill):
+    """Builds the index of a file: fill(db, file_name) creates and fills its
+    tables, and the source table records the file it was built from"""
+    directory = os.path.dirname(index_file_name)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    # Build into a temporary file and swap it in, so readers never see
+    # a partial index
+    tmp = "%s.%d.tmp"%(index_file_name, os.getpid())
+    if os.path.exists(tmp): os.remove(tmp)
+    db = sqlite3.connect(tmp)
+    fill(db, file_name)
+    db.execute("CREATE TABLE source (path TEXT, mtime INTEGER, size INTEGER)")
+    db.execute("INSERT INTO source VALUES (?,?,?)", source)
+    db.commit()
+    db.close()
+    os.replace(tmp, index_file_name)
+
+def fill(db, file_name):
+    """Fills the row index of a data file: the byte offset of every row,
+    keyed by the row's PID"""
+    db.execute("CREATE TABLE rows (pid TEXT, offset INTEGER, PRIMARY KEY (pid, offset)) WITHOUT ROWID")
+    with open(file_name, 'rb') as f:
+        position = [0]
+        rows = csv.reader(lines(f, position), dialect='excel-tab')
+        pindex = next(rows).index('PID')
+        def offsets():
+            # A row starts where the previous one ended (rows may span lines)
+            while True:
+                offset = position[0]
+                try: row = next(rows)
+                except StopIteration: return
+                if len(row) > pindex: yield (row[pindex], offset)
+        db.executemany("INSERT INTO rows VALUES (?,?)", offsets())
+
+def reader(file_name, pid=None, index_path=ROW_INDEX_PATH):
+    """Returns the header and an iterator over the rows of a data file.
+    With pid, only that patient's rows are read, by seeking to them through
+    the row index in index_path."""
+    if pid is None:
+        rows = csv.reader(open(file_name, newline='', encoding='utf-8'),dialect='excel-tab')
+        return next(rows), rows
+    db = index(file_name, index_path)
+    offsets = [o for (o,) in db.execute("SELECT offset FROM rows WHERE pid = ? ORDER BY offset", (pid,))]
+    db.close()
+    f = open(file_name, 'rb')
+    header = next(csv.reader(lines(f, [0]), dialect='excel-tab'))
+    def rows():
+        with f:
+            for offset in offsets:
+                f.seek(offset)
+                yield next(csv.reader(lines(f, [offset]), dialect='excel-tab'))
+    return header, rows()
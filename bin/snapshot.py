@@ -0,0 +1,95 @@
+"""Snapshot of the fully loaded data tables, for fast startup"""
+from testdata import DATA_PATH, LOINC_FILE, SNAPSHOT_FILE
+from patient import Patient
+from med import Med
+from problem import Problem
+from procedure import Procedure
+from refill import Refill
+from clinicalnote import ClinicalNote
+from vitals import VitalSigns
+from immunization import Immunization
+from lab import Lab
+from codes import Loinc
+from allergy import Allergy
+from socialhistory import SocialHistory
+from familyhistory import FamilyHistory
+from imagingstudy import ImagingStudy
+from document import Document
+import testdata
+import columns
+from collections.abc import Sequence
+import pickle
+import glob
+import sys
+import os
+
+# The class-level stores making up the loaded dataset, as (class, attribute)
+STORES = [(Patient, 'mpi'), (Med, 'meds'), (Problem, 'problems'),
+          (Lab, 'codes'), (Lab, 'results'), (Loinc, 'info'),
+          (Refill, 'refills'), (Refill, 'index'),
+          (VitalSigns, 'vitals'), (VitalSigns, 'encounters'),
+          (Immunization, 'immunizations'), (Procedure, 'procedures'),
+          (SocialHistory, 'socialHistories'), (FamilyHistory, 'familyHistories'),
+          (ClinicalNote, 'clinicalNotes'), (Allergy, 'allergies'),
+          (ImagingStudy, 'imagingStudies'), (Document, 'documents')]
+
+# The store of each loader's rows, as (class, attribute)
+TABLES = [(Patient, 'mpi'), (Lab, 'results'), (Med, 'meds'), (Refill, 'refills'),
+          (Problem, 'problems'), (Procedure, 'procedures'), (VitalSigns, 'vitals'),
+          (Immunization, 'immunizations'), (Allergy, 'allergies'),
+          (FamilyHistory, 'familyHistories'), (SocialHistory, 'socialHistories'),
+          (ClinicalNote, 'clinicalNotes'), (Document, 'documents'),
+          (ImagingStudy, 'imagingStudies')]
+
+def countRows(store):
+    """Number of records in a store of per-patient lists (or single records)"""
+    return sum(len(v) if isinstance(v, Sequence) else 1 for v in store.values())
+
+def rows(cls):
+    """Number of rows loaded by a loader class of TABLES"""
+    return countRows(getattr(cls, dict(TABLES)[cls]))
+
+def sources():
+    """The files the stores are built from: the data files, the LOINC map
+    and the modules that load them"""
+    modules = [sys.modules[cls.__module__].__file__ for cls, name in STORES]
+    modules.append(columns.__file__)
+    return sorted(glob.glob(os.path.join(DATA_PATH, '*.txt'))) + [LOINC_FILE] + \
+           sorted(set(modules))
+
+def key():
+    """Identifies the current sources by path, mtime and size, and the seed
+    the random values (the lab accession numbers) were drawn with"""
+    k = [('seed', testdata.SEED)]
+    for f in sources():
+        st = os.stat(f)
+        k.append((os.path.abspath(f), st.st_mtime_ns, st.st_size))
+    return k
+
+def load(file_name=SNAPSHOT_FILE):
+    """Restores the stores from the snapshot if it was built from the current
+    sources.  Returns True if it did, False if the data must be loaded."""
+    try:
+        with open(file_name, 'rb') as f:
+            # The key is pickled on its own first, so a stale snapshot is
+            # detected without reading the stores
+            if pickle.load(f) != key(): return False
+            stores = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return False
+    for (cls, name), store in zip(STORES, stores):
+        setattr(cls, name, store)
+    return True
+
+def save(file_name=SNAPSHOT_FILE):
+    """Writes the loaded stores to the snapshot"""
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+    # Write to a temporary file first, so concurrent runs never read a
+    # partial snapshot
+    tmp = "%s.%d.tmp"%(file_name, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(key(), f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump([getattr(cls, name) for cls, name in STORES], f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, file_name)
@@ -1,30 +1,31 @@
 from testdata import SOCIALHISTORY_FILE
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
 class SocialHistory: 
     """Create instances of SocialHistory; 
 also maintains socialHistory by patient id"""
 
+    __slots__ = ('pid', 'id', 'smokingStatusCode', 'smokingStatusText')
+
     socialHistories = {} # Dictionary of socialHistory by patient ID
 
     @classmethod
-    def load(cls):
-      """Loads patient SocialHistory"""
+    def load(cls,pid=None,histories_file_name=SOCIALHISTORY_FILE):
+      """Loads patient SocialHistory (only patient pid's, if given)"""
       
       # Loop through socialHistories and build patient socialHistory lists:
-      histories = csv.reader(open(SOCIALHISTORY_FILE,'U'),dialect='excel-tab')
-      # header = histories.next()
-      header = next(histories)
+      header, histories = rowindex.reader(histories_file_name, pid)
 
       for history in histories:
           cls(dict(zip(header,history))) # Create a socialHistory instance 
 
     def __init__(self,p):
-        self.pid = p['PID']
+        self.pid = intern(p['PID'])
         self.id = p['ID']
-        self.smokingStatusCode = p['SMOKINGSTATUSCODE']
+        self.smokingStatusCode = intern(p['SMOKINGSTATUSCODE'])
 
         # Append socialHistory to the patient's socialHistory list:
         if self.pid in  self.__class__.socialHistories:
@@ -48,7 +49,7 @@ if __name__== '__main__':
      help='display socialHistories for a given patient id (default=1520204)')
   args = parser.parse_args()
  
-  SocialHistory.load()
+  SocialHistory.load(pid=args.pid)
   if args.pid:
     if not args.pid in SocialHistory.socialHistories:
       parser.error("No results found for pid = %s"%args.pid)
@@ -0,0 +1,101 @@
+"""The Jinja environment of the FHIR templates, with ahead-of-time compilation.
+
+compile() turns every template into a Python module in the template cache
+(Environment.compile_templates), recording a digest of each template's
+source.  The environment then loads a template from its compiled module
+(jinja2.ModuleLoader), which Python imports from cached bytecode, instead of
+parsing and compiling the source on first use in every process.  A template
+whose source changed since it was compiled, or that was never compiled, is
+loaded from source as before, so the cache is never stale, only slower."""
+from testdata import TEMPLATES_CACHE_PATH
+from jinja2 import BaseLoader, Environment, FileSystemLoader, ModuleLoader, TemplateNotFound
+import jinja2
+import compileall
+import argparse
+import hashlib
+import shutil
+import json
+import os
+
+TEMPLATES_PATH = 'fhir_templates'
+MANIFEST_FILE = 'manifest.json' # In the template cache: the digests of the compiled sources
+
+def digest(file_name):
+    with open(file_name, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class PrecompiledLoader(BaseLoader):
+    """Loads templates from their compiled modules in path when these were
+    compiled from the current source with this Jinja version, and from the
+    source files in source_path otherwise"""
+
+    def __init__(self, source_path=TEMPLATES_PATH, path=TEMPLATES_CACHE_PATH):
+        self.source_path = source_path
+        self.source = FileSystemLoader(source_path)
+        self.compiled = ModuleLoader(path)
+        self.stats = {'compiled': 0, 'source': 0}
+        try:
+            with open(os.path.join(path, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = {}
+        self.digests = manifest.get('templates', {}) \
+                       if manifest.get('jinja2') == jinja2.__version__ else {}
+
+    def fresh(self, name):
+        """True if the compiled module of template name is up to date"""
+        if not name in self.digests: return False
+        try:
+            return digest(os.path.join(self.source_path, name)) == self.digests[name]
+        except IOError:
+            return False
+
+    def get_source(self, environment, template):
+        return self.source.get_source(environment, template)
+
+    def list_templates(self):
+        return self.source.list_templates()
+
+    def load(self, environment, name, globals=None):
+        if self.fresh(name):
+            try:
+                template = self.compiled.load(environment, name, globals)
+                self.stats['compiled'] += 1
+                return template
+            except TemplateNotFound: pass
+        self.stats['source'] += 1
+        return self.source.load(environment, name, globals)
+
+def environment(source_path=TEMPLATES_PATH, path=TEMPLATES_CACHE_PATH):
+    """The environment the FHIR templates are rendered in"""
+    return Environment(loader=PrecompiledLoader(source_path, path), autoescape=True)
+
+def compile(source_path=TEMPLATES_PATH, path=TEMPLATES_CACHE_PATH):
+    """Compiles every template in source_path into modules in path, replacing
+    any previous ones.  Returns the number of templates compiled."""
+    env = Environment(loader=FileSystemLoader(source_path), autoescape=True)
+    names = env.list_templates(extensions=['xml'])
+    if os.path.exists(path): shutil.rmtree(path)
+    os.makedirs(path)
+    # Digest the sources first, so a template edited while compiling is
+    # recorded as stale rather than as fresh
+    digests = dict((name, digest(os.path.join(source_path, name))) for name in names)
+    env.compile_templates(path, extensions=['xml'], zip=None, ignore_errors=False)
+    # And on to bytecode, which the imports of the modules then use
+    compileall.compile_dir(path, quiet=1)
+    with open(os.path.join(path, MANIFEST_FILE), 'w') as f:
+        json.dump({'jinja2': jinja2.__version__, 'templates': digests}, f, indent=2)
+    return len(names)
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='FHIR Template Compiler')
+  parser.add_argument('--clear', action='store_true',
+     help="removes the compiled templates, so templates are loaded from source")
+  args = parser.parse_args()
+
+  if args.clear:
+    shutil.rmtree(TEMPLATES_CACHE_PATH, True)
+    parser.exit(0, "Removed %s\n"%TEMPLATES_CACHE_PATH)
+  count = compile()
+  print ("Compiled %d templates to %s"%(count, TEMPLATES_CACHE_PATH))
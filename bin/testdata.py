@@ -1,6 +1,8 @@
-from random import randint, choice
 from string import ascii_uppercase
 import datetime
+import hashlib
+import random
+import os
 
 # Constants for building test data from data 
 
@@ -8,6 +10,7 @@ import datetime
 DATA_PATH  = "../data/"
 MAP_PATH   =   "../maps/"
 RI_PATH   = "../ri-data/"
+CACHE_PATH = "../.cache/"
 
 # Data file names:
 PATIENTS_FILE  = DATA_PATH+'patients.txt'
@@ -28,8 +31,15 @@ CLINICAL_NOTES_FILE = DATA_PATH+'clinicalnotes.txt'
 DOCUMENTS_FILE = DATA_PATH+'documents.txt'
 IMAGINGSTUDIES_FILE = DATA_PATH+'imagingstudies.txt'
 
+# Cache locations (safe to delete, rebuilt on demand):
+DOCUMENTS_CACHE_PATH = CACHE_PATH+'documents'
+SNAPSHOT_FILE = CACHE_PATH+'snapshot.pickle'  # the loaded data tables (see snapshot.py)
+ROW_INDEX_PATH = CACHE_PATH+'rows'  # per-patient row offsets of the data files (see rowindex.py)
+TEMPLATES_CACHE_PATH = CACHE_PATH+'templates'  # the compiled FHIR templates (see templates.py)
+
 # Mapping file names:
 LOINC_FILE = MAP_PATH+'short_loinc.txt'
+LOINC_INDEX = CACHE_PATH+'short_loinc.sqlite'  # built from LOINC_FILE on demand
 
 # Define some values for generating random demographics data
 # These values can be freely altered to change locations and names
@@ -77,52 +87,73 @@ SURNAMES = ('Smith','Johnson','Williams','Jones','Brown','Davis','Miller','Wilso
           'Hughes','Butler','Coleman','Jenkins','Barnes','Ford','Graham','Owens',
           'Cole','West','Diaz','Gibson','Rice','Shaw','Hunt','Black','Palmer')
 
+# Seed of the random streams (set by --seed); None draws everything from
+# the global random module, as unseeded runs always did
+SEED = None
+
 # Utility Functions for generating randomized data
 
-def rndDate(y):
+def stream(*scope):
+   """Returns the random number generator of a scope, such as a generator
+   name and a patient id.  Each scope gets its own stream derived from SEED,
+   so what a patient draws does not depend on the order patients are
+   processed in.  Without a seed this is the global random module."""
+   if SEED is None: return random
+   digest = hashlib.sha256(repr((SEED,) + scope).encode('utf-8')).digest()
+   return random.Random(int.from_bytes(digest[:8], 'big'))
+
+def currentTime():
+   """The current time, or the time given by SOURCE_DATE_EPOCH (seconds
+   since the epoch, in UTC) so timestamps are reproducible too"""
+   epoch = os.environ.get('SOURCE_DATE_EPOCH')
+   if epoch:
+     return datetime.datetime.fromtimestamp(int(epoch), datetime.timezone.utc).replace(tzinfo=None)
+   return datetime.datetime.now()
+
+def rndDate(y, rng=random):
    """Returns a random date within a given year."""
 
    d = datetime.date(y,1,1)      # Start with Jan 1st
    ylen = 366 if y%400 == 0 or (y%4 == 0 and y%100 != 0) else 365    # Adjust year length for leap years
-   r = randint(0,ylen-1)         # Generate random day in year   
+   r = rng.randint(0,ylen-1)         # Generate random day in year   
    return datetime.date.fromordinal(d.toordinal()+r)
 
-def rndName(gender):
+def rndName(gender, rng=random):
    """Returns a random, gender appropriate, common name tuple: (fn,ln)"""
    fnames = MALES if gender=='M' else FEMALES
-   return (fnames[randint(0,len(fnames)-1)],choice(ascii_uppercase),SURNAMES[randint(0,len(SURNAMES)-1)])
+   return (fnames[rng.randint(0,len(fnames)-1)],rng.choice(ascii_uppercase),SURNAMES[rng.randint(0,len(SURNAMES)-1)])
    
 def toEmail (name):
   return "%s.%s@example.com"%((name[0]),(name[2]))
   
-def rndAddress():
+def rndAddress(rng=random):
   """
   Returns a random address"""
-  index = POSTAL_INDEX_CHOICES[randint(0,len(POSTAL_INDEX_CHOICES)-1)]
-  street = ' '.join((str(randint(1,100)),
-                     STREET_NAMES[randint(0,len(STREET_NAMES)-1)],
-                     STREET_TYPES[randint(0,len(STREET_TYPES)-1)]))
+  index = POSTAL_INDEX_CHOICES[rng.randint(0,len(POSTAL_INDEX_CHOICES)-1)]
+  street = ' '.join((str(rng.randint(1,100)),
+                     STREET_NAMES[rng.randint(0,len(STREET_NAMES)-1)],
+                     STREET_TYPES[rng.randint(0,len(STREET_TYPES)-1)]))
   address = POSTAL_DATA[index]
   address['street'] = street
-  address['apartment'] = '' if randint(0,1) else ' '.join(('Apt', str(randint(1,30))))
+  address['apartment'] = '' if rng.randint(0,1) else ' '.join(('Apt', str(rng.randint(1,30))))
   return address
 
-def rndTelephone():
+def rndTelephone(rng=random):
   """
   Returns a random telephone"""
   telephone = '-'.join(( "800",
-                         str(randint(100,999)),
-                         str(randint(1000,9999)) ))
+                         str(rng.randint(100,999)),
+                         str(rng.randint(1000,9999)) ))
   return telephone
   
-def rndGestAge():
+def rndGestAge(rng=random):
   """
   Returns a random gestational age"""
-  gestage = '.'.join(( str(randint(30,45)),
-                         str(randint(0,9)) ))
+  gestage = '.'.join(( str(rng.randint(30,45)),
+                         str(rng.randint(0,9)) ))
   return gestage
   
-def rndAccNum():
+def rndAccNum(rng=random):
   """ Returns a random accession number """
-  return "A%d"%randint(100000000,999999999)
+  return "A%d"%rng.randint(100000000,999999999)
 
@@ -0,0 +1,264 @@
+"""Uploads transaction bundles to a FHIR server.
+
+Bundles are posted to the server's base URL by a few worker threads sharing a
+pool of keep-alive connections, retrying failed posts with exponential
+backoff.  Request bodies can be gzip-compressed.  Bodies are streamed from
+the bundle files (or a spooled compressed copy), so large bundles are never
+read into memory whole."""
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import http.client
+import threading
+import tempfile
+import argparse
+import queue
+import re
+import shutil
+import glob
+import gzip
+import time
+import os
+
+CONTENT_TYPES = {'.xml': 'application/xml+fhir', '.json': 'application/json+fhir'}
+RETRY_STATUSES = (429, 500, 502, 503, 504) # Statuses worth retrying
+BLOCK_SIZE = 1024*1024 # Bytes per socket write of a request body
+SPOOL_SIZE = 8*1024*1024 # Compressed bodies larger than this are spooled to disk
+
+def bundles(paths):
+    """The bundle files in paths: the .xml and .json files of each directory
+    (not manifests or hidden files), and any file named directly"""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for f in sorted(glob.glob(os.path.join(path, '*'))):
+            name = os.path.basename(f)
+            if os.path.splitext(name)[1] in CONTENT_TYPES and name != 'manifest.json':
+                files.append(f)
+    return files
+
+# The part number in the name of a later part of a split patient (see bundlepolicy)
+PART = re.compile(r'\.part(\d+)(?=\.\w+$)')
+
+def sequences(files):
+    """Groups the parts of each split patient, in part order; each group must
+    be posted in order, as later parts refer to resources in earlier ones"""
+    groups = {}
+    for f in files:
+        groups.setdefault(PART.sub('', f), []).append(f)
+    for group in groups.values():
+        group.sort(key=lambda f: int(PART.search(f).group(1)) if PART.search(f) else 1)
+    return list(groups.values())
+
+class ConnectionPool(object):
+    """Keep-alive HTTP(S) connections to one server, at most size of them.
+    A connection is taken for one request at a time and put back after it,
+    or closed and dropped when the request failed."""
+
+    def __init__(self, url, size, timeout=60):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPSConnection if parts.scheme == 'https' \
+                          else http.client.HTTPConnection
+        self.host = parts.netloc
+        self.path = parts.path or '/'
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def get(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock: self.opened += 1
+            conn = self.connection(self.host, timeout=self.timeout)
+            conn.blocksize = BLOCK_SIZE
+            return conn
+
+    def put(self, conn, reuse=True):
+        if reuse: self.idle.put(conn)
+        else: conn.close()
+        self.slots.release()
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+class Uploader(object):
+    """Posts bundle files to a FHIR server through a ConnectionPool"""
+
+    def __init__(self, url, jobs=4, retries=3, backoff=0.5, compress=False, headers=()):
+        self.pool = ConnectionPool(url, jobs)
+        self.jobs = jobs
+        self.retries = retries
+        self.backoff = backoff
+        self.compress = compress
+        self.headers = dict(headers)
+        self.lock = threading.Lock()
+        self.stats = {'bundles': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'sent': 0}
+
+    def count(self, **counts):
+        with self.lock:
+            for k in counts: self.stats[k] += counts[k]
+
+    def body(self, file_name):
+        """Returns the request body of a bundle as an open binary file, and its size"""
+        size = os.path.getsize(file_name)
+        if not self.compress:
+            return open(file_name, 'rb'), size
+        body = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        with open(file_name, 'rb') as f, gzip.GzipFile(fileobj=body, mode='wb') as z:
+            shutil.copyfileobj(f, z, BLOCK_SIZE)
+        return body, body.tell()
+
+    def post(self, file_name):
+        """Posts one bundle, retrying connection errors and RETRY_STATUSES.
+        Returns the final HTTP status, or None if the server never answered."""
+        headers = dict(self.headers)
+        headers['Content-Type'] = CONTENT_TYPES.get(os.path.splitext(file_name)[1],
+                                                    'application/json+fhir')
+        headers['Accept'] = headers['Content-Type']
+        if self.compress: headers['Content-Encoding'] = 'gzip'
+        body, length = self.body(file_name)
+        headers['Content-Length'] = str(length)
+        status = retryAfter = None
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.count(retries=1)
+                    time.sleep(retryAfter or self.backoff * 2**(attempt-1))
+                body.seek(0)
+                status, retryAfter = self.send(body, headers)
+                if status is not None and status not in RETRY_STATUSES: break
+        finally:
+            body.close()
+        ok = status is not None and 200 <= status < 300
+        self.count(bundles=1, failed=0 if ok else 1, bytes=os.path.getsize(file_name),
+                   sent=length if ok else 0)
+        if not ok:
+            print ("%s: %s"%(file_name, status or "no response"))
+        return status
+
+    def postAll(self, files):
+        """Posts files one after the other, giving up after the first failure"""
+        for i, file_name in enumerate(files):
+            status = self.post(file_name)
+            if status is None or not 200 <= status < 300:
+                self.count(bundles=len(files)-i-1, failed=len(files)-i-1)
+                break
+
+    def send(self, body, headers):
+        """One attempt at a post.  Returns the status (None on a connection
+        error) and the Retry-After seconds the server asked for, if any."""
+        conn = self.pool.get()
+        try:
+            conn.request('POST', self.pool.path, body, headers)
+            response = conn.getresponse()
+            response.read() # Drain the response so the connection can be reused
+        except (OSError, http.client.HTTPException):
+            self.pool.put(conn, False)
+            return None, None
+        self.pool.put(conn, not response.will_close)
+        retryAfter = response.getheader('Retry-After')
+        return response.status, float(retryAfter) if retryAfter and retryAfter.isdigit() else None
+
+    def upload(self, files):
+        """Posts the files with up to jobs requests at a time and returns the
+        number of failed bundles.  The parts of a split patient are posted
+        in order by one worker."""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.jobs) as executor:
+            list(executor.map(self.postAll, sequences(files)))
+        self.pool.close()
+        self.seconds = time.perf_counter() - start
+        return self.stats['failed']
+
+    def report(self):
+        s, seconds = self.stats, max(self.seconds, 1e-9)
+        return ("Uploaded %d of %d bundles (%.1f MB, %.1f MB sent) in %.2f s: "
+                "%.1f bundles/s, %.1f MB/s; %d connections, %d retries")%(
+                s['bundles']-s['failed'], s['bundles'], s['bytes']/1e6, s['sent']/1e6,
+                seconds, s['bundles']/seconds, s['bytes']/1e6/seconds,
+                self.pool.opened, s['retries'])
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """A stand-in FHIR server for trying uploads locally: accepts any post on
+    a keep-alive connection and answers with an empty transaction-response.
+    With failEvery set, every failEvery-th request gets a 503 instead."""
+
+    protocol_version = 'HTTP/1.1'
+    failEvery = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        with self.lock:
+            StandInHandler.requests += 1
+            fail = self.failEvery and StandInHandler.requests % self.failEvery == 0
+        if fail:
+            self.answer(503, b'')
+        else:
+            self.answer(200, b'{"resourceType": "Bundle", "type": "transaction-response"}')
+
+    def answer(self, status, data):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json+fhir')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__== '__main__':
+
+  parser = argparse.ArgumentParser(description='FHIR Bundle Uploader')
+  parser.add_argument('url', nargs='?',
+     help="base URL of the FHIR server the transaction bundles are posted to")
+  parser.add_argument('paths', metavar='path', nargs='*', default=['../generated-data', '../custom-data'],
+     help="bundle files or directories of them (default=../generated-data ../custom-data)")
+  parser.add_argument('--jobs', metavar='N', type=int, default=4,
+     help="number of concurrent uploads and pooled connections (default=4)")
+  parser.add_argument('--retries', metavar='N', type=int, default=3,
+     help="retries of a failed post, with exponential backoff (default=3)")
+  parser.add_argument('--backoff', metavar='seconds', type=float, default=0.5,
+     help="delay before the first retry, doubled for each next one (default=0.5)")
+  parser.add_argument('--gzip', dest='compress', action='store_true',
+     help="gzip-compresses the request bodies")
+  parser.add_argument('--header', dest='headers', metavar='name:value', action='append', default=[],
+     help="adds a request header, e.g. 'Authorization: Bearer <token>'")
+  parser.add_argument('--serve', metavar='port', type=int,
+     help="runs a local stand-in server on port instead, to try uploads against")
+  parser.add_argument('--fail-every', dest='failEvery', metavar='N', type=int, default=0,
+     help="with --serve, answers every N-th request with a 503")
+  args = parser.parse_args()
+
+  if args.serve:
+    StandInHandler.failEvery = args.failEvery
+    server = ThreadingHTTPServer(('localhost', args.serve), StandInHandler)
+    print ("Stand-in FHIR server on http://localhost:%d/"%args.serve)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    parser.exit()
+
+  if not args.url:
+    parser.error("No server URL given")
+  if args.jobs < 1:
+    parser.error("Invalid number of jobs: %d"%args.jobs)
+  headers = []
+  for h in args.headers:
+    if not ':' in h: parser.error("Invalid header: '%s'"%h)
+    name, value = h.split(':', 1)
+    headers.append((name.strip(), value.strip()))
+  files = bundles(args.paths)
+  uploader = Uploader(args.url, args.jobs, args.retries, args.backoff, args.compress, headers)
+  failed = uploader.upload(files)
+  print (uploader.report())
+  parser.exit(1 if failed else 0)
@@ -1,11 +1,13 @@
 from testdata import VITALS_FILE
+from columns import Row, ColumnStore
+from sys import intern
+import rowindex
 import argparse
-import csv
 
 
-class VitalSigns: 
-    """Create instances of VitalSigns list entries; 
-also maintains complete VitalSigns lists by patient id"""
+class VitalSigns(Row): 
+    """Views of VitalSigns list entries; 
+also maintains the complete VitalSigns columns by patient id"""
         
     vitalTypes = [{'name': 'height',
                         'uri': 'http://purl.bioontology.org/ontology/LNC/8302-2',
@@ -41,7 +43,7 @@ also maintains complete VitalSigns lists by patient id"""
                         'predicate': 'headCircumference'}
                         ]
 
-    systolic, diastolic = [
+    systolicType, diastolicType = [
                       {'name': 'systolic',
                         'uri': 'http://purl.bioontology.org/ontology/LNC/8480-6',
                         'unit': 'mm[Hg]',
@@ -86,25 +88,45 @@ also maintains complete VitalSigns lists by patient id"""
                     'system': 'http://smarthealthit.org/terms/codes/BloodPressureMethod#',
                     'code': 'auscultation'}
                     ]
+    bpCodes = dict((pc['name'], pc) for pc in bpPositionCodes) # By name
 
-    vitals = {} # Dictionary of VitalSign lists, by patient id 
+    __slots__ = ()
+
+    # The vitals file columns; each is kept in the field of the same name in
+    # lower case.  The measurements are numeric fields, converted to float
+    # at load time (nan where empty)
+    columns = ('ID', 'PID', 'TIMESTAMP', 'START_DATE', 'END_DATE', 'ENCOUNTER_TYPE',
+               'HEART_RATE', 'RESPIRATORY_RATE', 'TEMPERATURE', 'WEIGHT', 'HEIGHT',
+               'BMI', 'SYSTOLIC', 'DIASTOLIC', 'OXYGEN_SATURATION',
+               'HEAD_CIRCUMFERENCE', 'BP_SITE', 'BP_METHOD', 'BP_POSITION')
+    fields = tuple(c.lower() for c in columns)
+    numeric = ('heart_rate', 'respiratory_rate', 'temperature', 'weight', 'height',
+               'bmi', 'systolic', 'diastolic', 'oxygen_saturation', 'head_circumference')
+
+    vitals = None # ColumnStore of VitalSigns, by patient id (VitalSigns views); set below
+    encounters = {} # Position of the first VitalSign of each (start_date, encounter_type), by patient id
 
     @classmethod
-    def load(cls):
-      """Loads patient VitalSigns observations"""
+    def load(cls,pid=None,vitals_file_name=VITALS_FILE):
+      """Loads patient VitalSigns observations (only patient pid's, if given)"""
       
       # Loop through VitalSigns and build patient VitalSigns lists:
-      VitalSigns = csv.reader(open(VITALS_FILE,'U'),dialect='excel-tab')
-      # header = VitalSigns.next()
-      header = next(VitalSigns)
+      header, VitalSigns = rowindex.reader(vitals_file_name, pid)
+      patients = {}
       for VitalSign in VitalSigns:
-          cls(dict(zip(header,VitalSign))) # Create a VitalSign instance (saved in VitalSigns.vitals)
+          m = dict(zip(header,VitalSign))
+          patients.setdefault(m['PID'], []).append(cls.record(m))
+      for pid in patients:
+          cls.extend(pid, patients[pid]) # Saved in VitalSigns.vitals
 
     @classmethod
-    def loadVitalsPatient (cls, vp):
+    def vitalsPatientRows (cls, vp, id_prefix="vp-"):
+        """Returns the vitals of a generated patient (see
+        vitalspatientgenerator) as row dictionaries of the vitals file"""
         vitals = vp['vitals']
+        rows = []
         for (i, v) in enumerate(vitals):
-            id = "vp-%s" % (i+1)
+            id = "%s%s" % (id_prefix, i+1)
             m = {}
             if 'height' in v.keys():
                 m = {'WEIGHT': '', 'TEMPERATURE': '', 'RESPIRATORY_RATE': '', 'HEAD_CIRCUMFERENCE': '', 'HEART_RATE': '', 'OXYGEN_SATURATION': '', 'BMI': '',
@@ -134,20 +156,46 @@ also maintains complete VitalSigns lists by patient id"""
                     'BP_SITE': v['site'],
                     'SYSTOLIC': v['sbp'],
                     'DIASTOLIC': v['dbp']}
-            cls(m)
+            rows.append(m)
+        return rows
 
-    def __init__(self,m):
-        for f in m:
-            setattr(self, f.lower(), m[f])
-        self.sourcerow = m
+    @classmethod
+    def loadVitalsPatient (cls, vp):
+        cls.extend(vp['pid'], [cls.record(m) for m in cls.vitalsPatientRows(vp)])
 
-        # Append VitalSign to the patient's VitalSign list:
-        if self.pid in  self.__class__.vitals:
-          self.__class__.vitals[self.pid].append(self)
-        else: self.__class__.vitals[self.pid] = [self]
+    @classmethod
+    def add(cls,m):
+        """Adds a VitalSign from a row dictionary to VitalSigns.vitals"""
+        cls.extend(intern(m['PID']), [cls.record(m)])
+
+    @classmethod
+    def record(cls,m):
+        """Returns the values of a row dictionary in field order"""
+        return tuple(intern(m[c]) if c != 'ID' and isinstance(m[c], str) else m[c]
+                     for c in cls.columns)
+
+    @classmethod
+    def extend(cls,pid,records):
+        """Appends records to the patient's VitalSigns and indexes the
+        encounters they open"""
+        first = len(cls.vitals[pid]) if pid in cls.vitals else 0
+        cls.vitals.extend(pid, records)
+        encounters = cls.encounters.setdefault(pid, {})
+        start, type = cls.fields.index('start_date'), cls.fields.index('encounter_type')
+        for n, record in enumerate(records, first):
+            encounters.setdefault((record[start], record[type]), n)
 
     def asTabString(self):
-        return self.sourcerow
+        row = {}
+        for c in self.columns:
+            value = getattr(self, c.lower())
+            if value is None: value = ''
+            elif isinstance(value, float):
+                value = '%d'%value if value.is_integer() else repr(value)
+            row[c] = value
+        return row
+
+VitalSigns.vitals = ColumnStore(VitalSigns, VitalSigns.fields, VitalSigns.numeric)
 
 if __name__== '__main__':
 
@@ -158,7 +206,7 @@ if __name__== '__main__':
      help='display VitalSigns for a given patient id (default=1520204)')
   args = parser.parse_args()
  
-  VitalSigns.load()
+  VitalSigns.load(pid=args.pid)
   if args.pid:
     if not args.pid in VitalSigns.vitals:
       parser.error("No results found for pid = %s"%args.pid)
@@ -1,4 +1,7 @@
 import random
+from bisect import bisect_right
+from itertools import repeat
+from math import sqrt, log, cos, sin, pi
 from datetime import datetime, timedelta, date, time
 
 f = """male,2,0.88,90,42
@@ -28,63 +31,101 @@ stats = [[float(x) for x in l.split(',')[1:]] for l in ll]
 start = stats[0][1]
 finish = stats[-1][1]
 
+# Ages of the stats rows, searched by bisection.  The rows are in age order
+# except for the last one, which only bounds the sampled ages.
+ages = [s[0] for s in stats[:-1]]
+
 def interpolate(t):
-  for i in range(1, len(stats)):
-    if stats[i-1][0] <= t and stats[i][0] > t:
-      return ((t-stats[i-1][0])*1.0 / (stats[i][0]-stats[i-1][0]), stats[i-1], stats[i])
+  i = bisect_right(ages, t)
+  if 0 < i < len(ages):
+    return ((t-stats[i-1][0])*1.0 / (stats[i][0]-stats[i-1][0]), stats[i-1], stats[i])
+
+  assert False, "couldn't interpolate %s"%t
+
+class Growth(object):
+  """Interpolates and jitters a stats table for many ages at once.
+
+  The coefficients of each interval between two rows are worked out once, so
+  each age costs a bisection, the interpolation and a pair of Gaussian
+  deviates from two uniform draws."""
 
-  assert false, "couldn't interpolate %s"%t
+  def __init__(self, table):
+    self.low, self.high = table[0][0], table[-1][0]  # range of the sampled ages
+    self.ages = [s[0] for s in table[:-1]]  # searched by bisection, as ages above
+    # For interval i (rows i-1 and i): the rows, 1/width and the standard
+    # deviations of the sbp and dbp jitter, as in fuzz().  Bisection never
+    # lands in the empty interval between rows of the same age.
+    self.intervals = [None] + [(table[i-1], table[i], 1.0 / ((table[i][0]-table[i-1][0]) or 1),
+                                (table[i-1][2]-table[i][2])/3, (table[i-1][3]-table[i][3])/3)
+                               for i in range(1, len(self.ages))]
 
-def fuzz(ratio, t1, t2):
+  def rows(self, ts, rng=random):
+    """Returns the [age, height, sbp, dbp] row of each age in ts, with the
+    same interpolation and jitter as fuzz(interpolate(t))"""
+    if ts and not (self.ages[0] <= min(ts) and max(ts) < self.ages[-1]):
+      raise ValueError("couldn't interpolate ages outside %s-%s"%(self.ages[0], self.ages[-1]))
+    intervals, uniform = self.intervals, rng.random
+    rows = []
+    for t, i in zip(ts, map(bisect_right, repeat(self.ages), ts)):
+      t1, t2, inverse, ssbp, sdbp = intervals[i]
+      r = (t-t1[0]) * inverse
+      q = 1.0-r
+      # Box-Muller: one pair of uniform draws gives both normal deviates
+      m, a = sqrt(-2.0*log(1.0-uniform())), 2.0*pi*uniform()
+      rows.append([q*t1[0] + r*t2[0], q*t1[1] + r*t2[1],
+                   q*t1[2] + r*t2[2] + m*cos(a)*ssbp, q*t1[3] + r*t2[3] + m*sin(a)*sdbp])
+    return rows
+
+  def sample(self, n, rng=random):
+    """Returns the rows of n ages drawn uniformly from the table's range"""
+    return self.rows([rng.uniform(self.low, self.high) for i in range(n)], rng)
+
+growth = Growth(stats)
+
+def fuzz(ratio, t1, t2, rng=random):
   ret = []
   for i in range(len(t1)):
     v = (1.0-ratio) * t1[i] + 1.0*ratio* t2[i]
     if i >1:  # don't allow date or height to jitter randomly
-      v += random.gauss(0, (t1[i] - t2[i])/3)
+      v += rng.gauss(0, (t1[i] - t2[i])/3)
     ret.append(v)
   return ret
 
 def add_years(d1, y):
   return d1 + timedelta(days=int(365*y))
 
-def choose_random (optionA, optionB, probability):
-    n = random.uniform(0, 1)
+def choose_random (optionA, optionB, probability, rng=random):
+    n = rng.uniform(0, 1)
     if n < probability:
         return optionA
     return optionB
 
-def generate_vital (v, birthday):
-    e = {'date': add_years(birthday, v[0]).isoformat(),
-         'start_date': add_years(birthday, v[0]).isoformat(),
-         'end_date': add_years(birthday, v[0]).isoformat(),
-         'type': choose_random ("inpatient", "ambulatory", .25)}
+def generate_vital (v, birthday, rng=random):
+    d = add_years(birthday, v[0]).isoformat()
+    e = {'date': d,
+         'start_date': d,
+         'end_date': d,
+         'type': choose_random ("inpatient", "ambulatory", .25, rng)}
     
-    if random.random()<0.2:
+    if rng.random()<0.2:
         return {'height': round(v[1] * 100,1), 'encounter': e}
     else:
         return {'sbp': int(v[2]),
                 'dbp': int(v[3]),
-                'site': choose_random ("right arm", "left thigh", .8),
-                'method': choose_random ("auscultation", "machine", .5),
+                'site': choose_random ("right arm", "left thigh", .8, rng),
+                'method': choose_random ("auscultation", "machine", .5, rng),
                 'position': 'sitting',
                 'encounter': e}
 
-def generate_patient ():
-    birthday = datetime.combine(date(2011, int(random.uniform(1, 13)), int(random.uniform(1, 26))), time(0, 0)) - timedelta(days=stats[-1][0]*365)
-
-    a = []
-    output = ""
-    for p in range(50):
-      t = random.uniform(stats[0][0], stats[-1][0])
-      r,t1,t2 = interpolate(t)
-      v = fuzz(r,t1,t2)
-      a.append(v)
+def generate_patient (rng=random, pid='99912345', samples=50):
+    birthday = datetime.combine(date(2011, int(rng.uniform(1, 13)), int(rng.uniform(1, 26))), time(0, 0)) - timedelta(days=growth.high*365)
 
+    a = growth.sample(samples, rng)
     a.sort(key=lambda x: x[0])
     
-    patient = {'pid': '99912345', 'birthday': birthday.strftime("%Y-%m-%d"), 'vitals': []}
+    patient = {'pid': pid, 'birthday': birthday.strftime("%Y-%m-%d"), 'vitals': []}
     
     for l in a:
-      patient['vitals'].append( generate_vital(l, birthday) )
+      patient['vitals'].append( generate_vital(l, birthday, rng) )
       
     return patient
@@ -0,0 +1,48 @@
+"""Shared setup of the tests, which run with pytest from the repository root.
+
+The generator's modules are imported from bin and its paths are relative to
+bin (fhir.py reads its templates on import), so the test modules are
+imported and every test runs in bin, and the working directory is restored
+after each.  The data tables are loaded once per session by the data fixture:
+loading them again would add every row a second time."""
+import os
+import sys
+import pytest
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+sys.path.insert(0, BIN)
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_make_collect_report(collector):
+    if not isinstance(collector, pytest.Module):
+        yield
+        return
+    cwd = os.getcwd()
+    os.chdir(BIN)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+@pytest.fixture(autouse=True)
+def bin_directory(monkeypatch):
+    monkeypatch.chdir(BIN)
+
+@pytest.fixture
+def directory(request, tmp_path):
+    """A temporary directory, also set as self.directory of a unittest
+    test case using it"""
+    path = str(tmp_path)
+    if request.instance is not None: request.instance.directory = path
+    return path
+
+@pytest.fixture(scope='session')
+def data():
+    """Loads the data tables from the data files, not the snapshot"""
+    from generate import initData
+    cwd = os.getcwd()
+    os.chdir(BIN)
+    try:
+        initData(useSnapshot=False)
+    finally:
+        os.chdir(cwd)
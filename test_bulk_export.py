@@ -0,0 +1,40 @@
+"""Tests of the FHIR Bulk Data NDJSON output (bin/fhir.py BulkExport)"""
+import os
+import json
+import unittest
+import pytest
+
+from fhir import BulkExport
+
+PRACTITIONER = {'resourceType': 'Practitioner', 'id': 'SMART-1234'}
+
+@pytest.mark.usefixtures('directory')
+class BulkExportTest(unittest.TestCase):
+
+    def lines(self, resource_type):
+        with open(os.path.join(self.directory, "%s.ndjson"%resource_type)) as f:
+            return [json.loads(line) for line in f]
+
+    def test_shared_resources_written_once(self):
+        export = BulkExport(self.directory)
+        for pid in ('1', '2'):
+            self.assertGreater(export.write({'resourceType': 'Patient', 'id': pid}), 0)
+            export.write(dict(PRACTITIONER))
+        self.assertEqual(export.write(dict(PRACTITIONER)), 0)
+        export.close()
+        self.assertEqual(self.lines('Practitioner'), [PRACTITIONER])
+        self.assertEqual([p['id'] for p in self.lines('Patient')], ['1', '2'])
+        with open(os.path.join(self.directory, 'manifest.json')) as f:
+            counts = dict((o['type'], o['count']) for o in json.load(f)['output'])
+        self.assertEqual(counts, {'Patient': 2, 'Practitioner': 1})
+
+    def test_patient_resources_not_kept(self):
+        """Only the shared resources are remembered; a patient's resources
+        are streamed out as they come"""
+        export = BulkExport(self.directory)
+        for i in range(100):
+            export.write({'resourceType': 'Observation', 'id': str(i)})
+        export.write(dict(PRACTITIONER))
+        export.close()
+        self.assertEqual(export.shared, set([('Practitioner', 'SMART-1234')]))
+        self.assertEqual(len(self.lines('Observation')), 100)
@@ -0,0 +1,91 @@
+"""Tests of splitting and packing bundles under a policy (bin/bundlepolicy.py)"""
+import os
+import json
+import unittest
+import pytest
+
+from bundlepolicy import BundlePolicy, BundlePacker
+from patient import Patient
+from clinicalnote import ClinicalNote
+from document import Document
+import fhir
+
+NOW = '2020-01-01T00:00:00'
+
+@pytest.mark.usefixtures('data', 'directory')
+class BundlePackerTest(unittest.TestCase):
+
+    def setUp(self):
+        # Patients with notes or documents, which refer to the Practitioner
+        self.pids = sorted(pid for pid in Patient.mpi
+                           if pid in ClinicalNote.clinicalNotes or pid in Document.documents)[:3]
+
+    def write(self, policy, pids):
+        packer = BundlePacker(self.directory, 'json', policy, NOW)
+        for pid in pids:
+            packer.add(fhir.FHIRSamplePatient(pid, self.directory))
+        packer.close()
+
+    def bundles(self):
+        bundles = {}
+        for name in sorted(os.listdir(self.directory)):
+            with open(os.path.join(self.directory, name)) as f:
+                bundles[name] = [e['request']['url']
+                                 for e in json.load(f)['entry']]
+        return bundles
+
+    def ids(self, pid):
+        return [context['id'] for template, context
+                in fhir.FHIRSamplePatient(pid, self.directory).resources(None, NOW)]
+
+    def test_packed(self):
+        self.write(BundlePolicy(maxResources=10000), self.pids)
+        bundles = self.bundles()
+        self.assertEqual(list(bundles),
+                         ["patients-%s-%s.fhir-bundle.json"%(self.pids[0], self.pids[-1])])
+        entries = bundles.popitem()[1]
+        # The Practitioner every patient refers to is written once
+        expected = []
+        for pid in self.pids:
+            expected += [id for id in self.ids(pid) if not id in expected]
+        self.assertEqual(sorted(entries), sorted(expected))
+        self.assertEqual(len(entries), len(set(entries)))
+        self.assertEqual(entries.count('Practitioner/SMART-1234'), 1)
+
+    def test_split(self):
+        pid = self.pids[0]
+        ids = self.ids(pid)
+        self.write(BundlePolicy(maxResources=5), [pid])
+        bundles = self.bundles()
+        parts = (len(ids) + 4)//5
+        self.assertGreater(parts, 1)
+        names = [fhir.bundleFileName(pid, 'json', part) for part in range(1, parts+1)]
+        self.assertEqual(sorted(bundles), sorted(names))
+        for name in names:
+            self.assertLessEqual(len(bundles[name]), 5)
+        # The Patient leads the first part and every resource is in one part
+        self.assertEqual(bundles[names[0]][0], "Patient/%s"%pid)
+        entries = sum((bundles[name] for name in names), [])
+        self.assertEqual(sorted(entries), sorted(ids))
+
+    def test_split_patient_not_shared(self):
+        """A patient too large for one bundle gets bundles of its own, and
+        the next patients are packed into a new bundle"""
+        small = [pid for pid in sorted(Patient.mpi) if len(self.ids(pid)) <= 40]
+        large = [pid for pid in sorted(Patient.mpi) if len(self.ids(pid)) > 40]
+        self.write(BundlePolicy(maxResources=40), [large[0], small[0]])
+        bundles = self.bundles()
+        self.assertIn(fhir.bundleFileName(large[0], 'json'), bundles)
+        self.assertIn(fhir.bundleFileName(small[0], 'json'), bundles)
+        self.assertFalse([name for name in bundles if name.startswith('patients-')])
+
+    def test_max_bytes(self):
+        pid = self.pids[0]
+        limit = 20000
+        self.write(BundlePolicy(maxBytes=limit), [pid])
+        for name in os.listdir(self.directory):
+            size = os.path.getsize(os.path.join(self.directory, name))
+            with open(os.path.join(self.directory, name)) as f:
+                entries = len(json.load(f)['entry'])
+            # Only a single resource larger than the limit may exceed it
+            if entries > 1: self.assertLessEqual(size, limit)
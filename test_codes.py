@@ -0,0 +1,33 @@
+"""Tests of the LOINC code index (bin/codes.py)"""
+import os
+import unittest
+import pytest
+
+from codes import Loinc
+
+LOINCS = "LOINC_NUM\tSHORTNAME\n2345-7\tGlucose SerPl-mCnc\n718-7\tHgb Bld-mCnc\n"
+
+@pytest.mark.usefixtures('directory')
+class LoincIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file_name = os.path.join(self.directory, 'loinc.txt')
+        self.index_file_name = os.path.join(self.directory, 'loinc.sqlite')
+        with open(self.file_name, 'w', encoding='utf-8') as f:
+            f.write(LOINCS)
+
+    def lookup(self, code):
+        db = Loinc.index(self.file_name, self.index_file_name)
+        row = db.execute("SELECT SHORTNAME FROM loinc WHERE LOINC_NUM = ?", (code,)).fetchone()
+        db.close()
+        return row and row[0]
+
+    def test_lookup(self):
+        self.assertEqual(self.lookup('718-7'), 'Hgb Bld-mCnc')
+        self.assertEqual(self.lookup('0000-0'), None)
+
+    def test_rebuilt_when_file_changes(self):
+        self.lookup('718-7')
+        with open(self.file_name, 'a', encoding='utf-8') as f:
+            f.write("1234-5\tNew code\n")
+        self.assertEqual(self.lookup('1234-5'), 'New code')
@@ -0,0 +1,98 @@
+"""Tests of the columnar store of lab results and vitals (bin/columns.py)"""
+import unittest
+
+from columns import ColumnStore, Row
+from lab import Lab
+import fhirjson
+import fhir
+
+class Reading(Row):
+    __slots__ = ()
+
+def rows(store, pid):
+    return [(r.id, r.value) for r in store[pid]]
+
+class ColumnStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ColumnStore(Reading, ('id', 'value'), numeric=('value',))
+
+    def test_patient_rows(self):
+        self.store.extend('1', [('a', '1.5'), ('b', '')])
+        self.store.extend('2', [('c', '3')])
+        self.assertEqual(rows(self.store, '1'), [('a', 1.5), ('b', None)])
+        self.assertEqual(rows(self.store, '2'), [('c', 3.0)])
+        self.assertEqual(self.store.offsets, {'1': (0, 2), '2': (2, 3)})
+        self.assertEqual(sorted(self.store), ['1', '2'])
+        self.assertNotIn('3', self.store)
+        self.assertEqual(self.store['1'].column('id'), ['a', 'b'])
+        self.assertEqual(self.store['1'][-1].id, 'b')
+        self.assertEqual([r.id for r in self.store['1'][1:]], ['b'])
+        with self.assertRaises(IndexError): self.store['2'][1]
+
+    def test_extend_last_patient_in_place(self):
+        self.store.extend('1', [('a', '1')])
+        self.store.extend('1', [('b', '2')])
+        self.assertEqual(self.store.offsets['1'], (0, 2))
+        self.assertEqual(self.store.size, 2)
+
+    def test_extend_earlier_patient_relocates(self):
+        """Adding to a patient whose rows are followed by another's moves
+        its rows to the end, so they stay contiguous"""
+        self.store.extend('1', [('a', '1'), ('b', '2')])
+        self.store.extend('2', [('c', '3')])
+        self.store.extend('1', [('d', '4')])
+        self.assertEqual(rows(self.store, '1'), [('a', 1.0), ('b', 2.0), ('d', 4.0)])
+        self.assertEqual(rows(self.store, '2'), [('c', 3.0)])
+        self.assertEqual(self.store.offsets, {'1': (3, 6), '2': (2, 3)})
+        self.assertEqual(self.store.size, 6)
+        self.assertEqual(len(self.store.columns['id']), 6)
+
+    def test_clear(self):
+        self.store.extend('1', [('a', '1')])
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.store.size, 0)
+
+class NumericRenderTest(unittest.TestCase):
+    """Lab values are rendered from the numeric columns converted at load
+    time, and from the text where these hold no number"""
+
+    def setUp(self):
+        # A store of its own, leaving any loaded results alone
+        self.results = Lab.results
+        Lab.results = ColumnStore(Lab, Lab.fields, Lab.numeric)
+
+    def tearDown(self):
+        Lab.results = self.results
+
+    def lab(self, value, low, high):
+        Lab.results.extend('1', [('1', '1', '2345-7', '2010-01-01', 'Glucose', 'Qn',
+                                  value, low, high, 'mg/dL', 'acc', value, low, high)])
+        return Lab.results['1'][-1]
+
+    def render(self, o):
+        context = dict(id='Observation/1', pid='Patient/1', base_url='', tag='', o=o)
+        return fhir.TEMPLATES['observation'].render(context), fhirjson.observation(context)
+
+    def test_from_numeric_columns(self):
+        lab = self.lab('95', '70', '110.5')
+        # The columns, not the text, are read
+        Lab.results.columns['value_num'][-1] = 96.0
+        xml, resource = self.render(lab)
+        self.assertIn('<value value="96.0"/>', xml)
+        self.assertIn('<value value="70.0"/>', xml)
+        self.assertIn('<value value="110.5"/>', xml)
+        self.assertEqual(resource['valueQuantity']['value'], 96)
+        self.assertEqual(resource['referenceRange'][0]['high']['value'], 110.5)
+
+    def test_text_fallback(self):
+        xml, resource = self.render(self.lab('positive', '70', '110'))
+        self.assertIn('<value value="0"/>', xml) # float(0), as before
+        self.assertEqual(resource['valueQuantity']['value'], 0.0)
+
+    def test_vitals_dictionaries(self):
+        xml, resource = self.render({'date': '2010-01-01', 'code': '8480-6', 'name': 'Systolic',
+                                     'scale': 'Qn', 'value': 120, 'units': 'mm[Hg]'})
+        self.assertIn('<value value="120.0"/>', xml)
+        self.assertEqual(resource['valueQuantity']['value'], 120)
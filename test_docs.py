@@ -0,0 +1,72 @@
+"""Tests of the document cache (bin/docs.py)"""
+import os
+import base64
+import unittest
+import pytest
+
+from docs import DocumentCache
+
+@pytest.mark.usefixtures('directory')
+class DocumentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_path = os.path.join(self.directory, 'cache')
+        self.document = os.path.join(self.directory, 'document.txt')
+        self.write(b'first version')
+
+    def write(self, data):
+        with open(self.document, 'wb') as f:
+            f.write(data)
+
+    def entries(self):
+        return sorted(os.listdir(self.cache_path))
+
+    def test_hits(self):
+        cache = DocumentCache(self.cache_path)
+        entry = cache.fetch(self.document)
+        self.assertEqual(str(entry['base64_content']), base64.b64encode(b'first version').decode())
+        self.assertEqual(entry['size'], 13)
+        cache.fetch(self.document)
+        self.assertEqual(cache.stats, {'hits': 1, 'disk_hits': 0, 'misses': 1})
+
+    def test_disk_hit(self):
+        DocumentCache(self.cache_path).fetch(self.document)
+        cache = DocumentCache(self.cache_path)
+        entry = cache.fetch(self.document)
+        self.assertEqual(cache.stats, {'hits': 0, 'disk_hits': 1, 'misses': 0})
+        self.assertEqual(str(entry['base64_content']), base64.b64encode(b'first version').decode())
+
+    def test_edited_file_is_reencoded(self):
+        cache = DocumentCache(self.cache_path)
+        first = cache.fetch(self.document)
+        self.write(b'second, longer version')
+        second = cache.fetch(self.document)
+        self.assertEqual(cache.stats['misses'], 2)
+        self.assertNotEqual(first['hash'], second['hash'])
+        self.assertEqual(str(second['base64_content']),
+                         base64.b64encode(b'second, longer version').decode())
+
+    def test_edited_file_prunes_old_entry(self):
+        DocumentCache(self.cache_path).fetch(self.document)
+        self.assertEqual(len(self.entries()), 2) # .b64 and .json
+        self.write(b'second, longer version')
+        cache = DocumentCache(self.cache_path)
+        cache.fetch(self.document)
+        self.assertEqual(len(self.entries()), 2)
+        self.assertEqual(cache.stats['misses'], 1)
+        # The remaining entry is the new version's
+        cache = DocumentCache(self.cache_path)
+        cache.fetch(self.document)
+        self.assertEqual(cache.stats['disk_hits'], 1)
+
+    def test_other_files_kept(self):
+        other = os.path.join(self.directory, 'other.txt')
+        with open(other, 'wb') as f:
+            f.write(b'other')
+        cache = DocumentCache(self.cache_path)
+        cache.fetch(other)
+        cache.fetch(self.document)
+        self.write(b'second, longer version')
+        cache.fetch(self.document)
+        self.assertEqual(len(self.entries()), 4)
+        self.assertEqual(DocumentCache(self.cache_path).fetch(other)['size'], 5)
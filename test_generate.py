@@ -0,0 +1,20 @@
+"""Tests of loading the data tables for bundle generation (bin/generate.py)"""
+import unittest
+import pytest
+
+from generate import VITALS_PATIENT
+from vitals import VitalSigns
+import fhir
+
+@pytest.mark.usefixtures('data')
+class VitalsPatientTest(unittest.TestCase):
+
+    def test_generated_once(self):
+        """The generated vitals are loaded with the tables, so listing the
+        patient's resources again gives the same resources"""
+        rows = len(VitalSigns.vitals[VITALS_PATIENT])
+        self.assertGreater(rows, 1)
+        patient = fhir.FHIRSamplePatient(VITALS_PATIENT, '.')
+        counts = [sum(1 for r in patient.resources()) for i in range(3)]
+        self.assertEqual(counts, [counts[0]]*3)
+        self.assertEqual(len(VitalSigns.vitals[VITALS_PATIENT]), rows)
@@ -0,0 +1,54 @@
+"""Tests of the bundle ids (bin/ids.py) and the resource ids (bin/fhir.py uid)"""
+import uuid
+import unittest
+
+from ids import BlockIds, HashIds, allocator
+from fhir import uid
+
+class BlockIdsTest(unittest.TestCase):
+
+    def test_former_counter(self):
+        """With blocks of one id, patient index gets id index+1"""
+        self.assertEqual([BlockIds('p%d'%i, i).next('Bundle') for i in range(3)],
+                         ['1', '2', '3'])
+
+    def test_blocks(self):
+        ids = BlockIds('p', 2, size=3)
+        self.assertEqual([ids.next('Bundle') for i in range(3)], ['7', '8', '9'])
+        self.assertRaises(ValueError, ids.next, 'Bundle')
+
+    def test_order_independent(self):
+        first = [BlockIds(pid, i, 2).next('Bundle') for i, pid in enumerate('abc')]
+        second = [BlockIds(pid, i, 2).next('Bundle') for i, pid in reversed(list(enumerate('abc')))]
+        self.assertEqual(first, list(reversed(second)))
+
+class HashIdsTest(unittest.TestCase):
+
+    def test_deterministic(self):
+        first, second = HashIds('1032702'), HashIds('1032702', 5)
+        for resource_type in ('Bundle', 'Bundle', 'List'):
+            self.assertEqual(first.next(resource_type), second.next(resource_type))
+
+    def test_distinct(self):
+        ids = HashIds('1032702')
+        generated = [ids.next('Bundle'), ids.next('Bundle'), ids.next('List'),
+                     HashIds('1081332').next('Bundle')]
+        self.assertEqual(len(set(generated)), len(generated))
+        for id in generated:
+            self.assertEqual(uuid.UUID(id).version, 5)
+
+    def test_allocator(self):
+        self.assertIsInstance(allocator('hash', '1', 0), HashIds)
+        self.assertEqual(allocator('block', '1', 4).next('Bundle'), '5')
+
+class UidTest(unittest.TestCase):
+
+    def test_named(self):
+        self.assertEqual(uid("Condition", "12"), "Condition/Condition-12")
+        self.assertEqual(uid("Condition", "12", "p"), "Condition/p-Condition-12")
+
+    def test_no_id(self):
+        """Without a counter to fall back on, a missing id is an error rather
+        than a reference shared by every resource without one"""
+        self.assertRaises(ValueError, uid, "Condition", None)
+        self.assertRaises(ValueError, uid, "Condition", "")
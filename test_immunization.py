@@ -0,0 +1,31 @@
+"""Tests of the immunization records (bin/immunization.py)"""
+import unittest
+
+from immunization import Immunization
+
+PID = 'test-patient'
+
+class ImmunizationTest(unittest.TestCase):
+
+    def tearDown(self):
+        Immunization.immunizations.pop(PID, None)
+
+    def row(self):
+        row = dict((c, c.lower()) for c in Immunization.columns)
+        row['PID'] = PID
+        return row
+
+    def test_extra_column_ignored(self):
+        row = self.row()
+        row['lot_number'] = '123'
+        i = Immunization(row)
+        self.assertEqual(Immunization.immunizations[PID], [i])
+        self.assertEqual(i.cvx, 'cvx')
+        self.assertEqual(i.asTabString(), dict(self.row(), PID=PID))
+
+    def test_missing_column(self):
+        row = self.row()
+        del row['CVX']
+        with self.assertRaises(KeyError) as e:
+            Immunization(row)
+        self.assertEqual(e.exception.args, ('CVX',))
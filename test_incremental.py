@@ -0,0 +1,91 @@
+"""Tests of the fingerprints and manifest of incremental regeneration (bin/incremental.py)"""
+import os
+import unittest
+import pytest
+
+from incremental import Manifest, fingerprints, rowDigests
+from document import Document
+import docs
+
+OPTIONS = ('xml', None, '', 'hash')
+
+class Doc(object):
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+@pytest.mark.usefixtures('directory')
+class FingerprintTest(unittest.TestCase):
+
+    def test_row_digests(self):
+        def write(rows):
+            with open(os.path.join(self.directory, 'labs.txt'), 'w') as f:
+                f.write("PID\tvalue\n" + "".join("%s\t%s\n"%row for row in rows))
+        write([('1', 'a'), ('2', 'b'), ('1', 'c')])
+        first = rowDigests(self.directory)
+        self.assertEqual(sorted(first), ['1', '2'])
+        write([('1', 'a'), ('2', 'B'), ('1', 'c')])
+        second = rowDigests(self.directory)
+        self.assertEqual(first['1'].hexdigest(), second['1'].hexdigest())
+        self.assertNotEqual(first['2'].hexdigest(), second['2'].hexdigest())
+
+    def test_deterministic(self):
+        pids = ['1032702', '1081332']
+        self.assertEqual(fingerprints(pids, OPTIONS), fingerprints(pids, OPTIONS))
+
+    def test_options_change_every_bundle(self):
+        pids = ['1032702', '1081332']
+        first = fingerprints(pids, OPTIONS)
+        second = fingerprints(pids, ('json',) + OPTIONS[1:])
+        for pid in pids:
+            self.assertNotEqual(first[pid], second[pid])
+
+    def test_position(self):
+        """Block ids depend on the patient's position; hash ids do not"""
+        self.assertNotEqual(fingerprints(['1032702', '1081332'], OPTIONS)['1081332'],
+                            fingerprints(['1081332'], OPTIONS)['1081332'])
+        self.assertEqual(fingerprints(['1032702', '1081332'], OPTIONS, False)['1081332'],
+                         fingerprints(['1081332'], OPTIONS, False)['1081332'])
+
+    def test_edited_document(self):
+        pid = 'test-patient'
+        os.makedirs(os.path.join(self.directory, pid))
+        document = os.path.join(self.directory, pid, 'note.txt')
+        with open(document, 'w') as f:
+            f.write("first")
+        base = docs.BASE_DOCUMENTS_PATH
+        docs.BASE_DOCUMENTS_PATH = self.directory
+        Document.documents[pid] = [Doc('note.txt')]
+        try:
+            first = fingerprints([pid], OPTIONS)[pid]
+            self.assertEqual(fingerprints([pid], OPTIONS)[pid], first)
+            with open(document, 'w') as f:
+                f.write("second")
+            self.assertNotEqual(fingerprints([pid], OPTIONS)[pid], first)
+        finally:
+            docs.BASE_DOCUMENTS_PATH = base
+            del Document.documents[pid]
+
+@pytest.mark.usefixtures('directory')
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bundle = os.path.join(self.directory, 'patient-1.fhir-bundle.xml')
+        open(self.bundle, 'w').close()
+
+    def test_empty(self):
+        self.assertFalse(Manifest(self.directory).unchanged('1', 'abc', self.bundle))
+
+    def test_unchanged(self):
+        Manifest(self.directory).save({'1': 'abc'})
+        manifest = Manifest(self.directory)
+        self.assertTrue(manifest.unchanged('1', 'abc', self.bundle))
+        # A new fingerprint or a missing bundle means rewriting it
+        self.assertFalse(manifest.unchanged('1', 'def', self.bundle))
+        self.assertFalse(manifest.unchanged('2', 'abc', self.bundle))
+        os.remove(self.bundle)
+        self.assertFalse(manifest.unchanged('1', 'abc', self.bundle))
+
+    def test_corrupt(self):
+        with open(os.path.join(self.directory, '.fhir-manifest.json'), 'w') as f:
+            f.write("{")
+        self.assertEqual(Manifest(self.directory).fingerprints, {})
@@ -0,0 +1,68 @@
+"""Tests of the stage counts of the generator's profile (bin/instrument.py)"""
+import os
+import unittest
+import pytest
+
+from generate import loadTable, writePatient, writePatients
+from bundlepolicy import BundlePolicy
+from immunization import Immunization
+import instrument
+import snapshot
+
+PIDS = ['1032702', '1081332']
+
+class StageTest(unittest.TestCase):
+
+    def setUp(self):
+        instrument.timings.clear()
+        instrument.enable()
+
+    def tearDown(self):
+        instrument.enable(False)
+        instrument.timings.clear()
+
+    def stage(self, name):
+        seconds, calls, resources, bytes = instrument.timings[('stage', name)]
+        return calls, resources, bytes
+
+class LoadStageTest(StageTest):
+
+    def test_load(self):
+        loaded = Immunization.immunizations
+        Immunization.immunizations = {}
+        try:
+            loadTable(Immunization)
+            rows = snapshot.rows(Immunization)
+        finally:
+            Immunization.immunizations = loaded
+        self.assertGreater(rows, 0)
+        self.assertEqual(self.stage('load Immunization'), (1, rows, 0))
+        self.assertIn("%9d %10d"%(1, rows), instrument.report())
+
+@pytest.mark.usefixtures('data', 'directory')
+class BundleStageTest(StageTest):
+
+    def sizes(self):
+        return sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in os.listdir(self.directory))
+
+    def job(self, index, format):
+        return (index, PIDS[index], self.directory, '', '', None, format, 'hash')
+
+    def test_bundles(self):
+        for format in ('xml', 'json'):
+            for index in range(len(PIDS)):
+                writePatient(self.job(index, format))
+            calls, resources, bytes = self.stage('bundle %s'%format)
+            self.assertEqual(calls, len(PIDS))
+            self.assertGreater(resources, len(PIDS))
+        self.assertEqual(self.stage('bundle xml')[2] + self.stage('bundle json')[2], self.sizes())
+
+    def test_packed_bundles(self):
+        jobs = [self.job(index, 'json') for index in range(len(PIDS))]
+        writePatients((BundlePolicy(maxResources=10000), jobs))
+        calls, resources, bytes = self.stage('bundle json')
+        self.assertEqual(calls, len(PIDS) + 1) # And the close of the last bundle
+        self.assertGreater(resources, len(PIDS))
+        self.assertEqual(bytes, self.sizes())
+        self.assertEqual(len(os.listdir(self.directory)), 1)
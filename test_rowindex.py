@@ -0,0 +1,38 @@
+"""Tests of the per-patient row index (bin/rowindex.py)"""
+import os
+import unittest
+import pytest
+
+import rowindex
+
+ROWS = "ID\tPID\tNAME\n1\t10\tAspirin\n2\t11\t\"Two\nlines\"\n3\t10\tCafé\n"
+
+@pytest.mark.usefixtures('directory')
+class RowIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file_name = os.path.join(self.directory, 'meds.txt')
+        with open(self.file_name, 'w', encoding='utf-8', newline='') as f:
+            f.write(ROWS)
+        self.index_path = os.path.join(self.directory, 'rows')
+
+    def test_whole_file(self):
+        header, rows = rowindex.reader(self.file_name)
+        self.assertEqual(header, ['ID', 'PID', 'NAME'])
+        self.assertEqual([r[2] for r in rows], ['Aspirin', 'Two\nlines', 'Café'])
+
+    def test_one_patient(self):
+        header, rows = rowindex.reader(self.file_name, '10', self.index_path)
+        self.assertEqual(header, ['ID', 'PID', 'NAME'])
+        self.assertEqual(list(rows), [['1', '10', 'Aspirin'], ['3', '10', 'Café']])
+        header, rows = rowindex.reader(self.file_name, '11', self.index_path)
+        self.assertEqual(list(rows), [['2', '11', 'Two\nlines']])
+        header, rows = rowindex.reader(self.file_name, '12', self.index_path)
+        self.assertEqual(list(rows), [])
+
+    def test_rebuilt_when_file_changes(self):
+        list(rowindex.reader(self.file_name, '10', self.index_path)[1])
+        with open(self.file_name, 'a', encoding='utf-8') as f:
+            f.write("4\t12\tNew\n")
+        header, rows = rowindex.reader(self.file_name, '12', self.index_path)
+        self.assertEqual(list(rows), [['4', '12', 'New']])
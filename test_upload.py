@@ -0,0 +1,108 @@
+"""Tests of posting bundles to a FHIR server (bin/upload.py), against the stand-in server"""
+import io
+import os
+import shutil
+import threading
+import unittest
+import pytest
+from unittest import mock
+
+from http.server import ThreadingHTTPServer
+from upload import Uploader, StandInHandler
+import upload
+
+class RetryAfterHandler(StandInHandler):
+    """Asks for a retry after 7 seconds with each 503"""
+
+    def answer(self, status, data):
+        self.send_response(status)
+        if status == 503: self.send_header('Retry-After', '7')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+@pytest.mark.usefixtures('directory')
+class UploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.files = []
+        for name in ('patient-1.fhir-bundle.json', 'patient-2.fhir-bundle.xml',
+                     'patient-3.fhir-bundle.json'):
+            self.files.append(os.path.join(self.directory, name))
+            with open(self.files[-1], 'w') as f:
+                f.write('{"resourceType": "Bundle"}')
+        StandInHandler.requests = 0
+        self.server = None
+        self.sleeps = []
+        patcher = mock.patch.object(upload.time, 'sleep', self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Failed posts are reported on stdout
+        patcher = mock.patch('sys.stdout', new_callable=io.StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def serve(self, failEvery=0, handler=StandInHandler):
+        handler = type('Handler', (handler,), {'failEvery': failEvery})
+        self.server = ThreadingHTTPServer(('localhost', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://localhost:%d/"%self.server.server_address[1]
+
+    def test_upload(self):
+        uploader = Uploader(self.serve(), jobs=2)
+        self.assertEqual(uploader.upload(self.files), 0)
+        self.assertEqual(StandInHandler.requests, 3)
+        self.assertEqual(uploader.stats['bundles'], 3)
+        self.assertEqual(uploader.stats['retries'], 0)
+        self.assertEqual(self.sleeps, [])
+
+    def test_gzip(self):
+        uploader = Uploader(self.serve(), jobs=1, compress=True)
+        self.assertEqual(uploader.upload(self.files), 0)
+        self.assertEqual(StandInHandler.requests, 3)
+
+    def test_retried(self):
+        uploader = Uploader(self.serve(failEvery=2), jobs=1, retries=1, backoff=0.25)
+        self.assertEqual(uploader.upload(self.files), 0)
+        # Requests 2 and 4 fail and are retried once each
+        self.assertEqual(StandInHandler.requests, 5)
+        self.assertEqual(uploader.stats['retries'], 2)
+        self.assertEqual(self.sleeps, [0.25, 0.25])
+
+    def test_backoff(self):
+        uploader = Uploader(self.serve(failEvery=1), jobs=1, retries=3, backoff=0.5)
+        self.assertEqual(uploader.post(self.files[0]), 503)
+        uploader.pool.close()
+        self.assertEqual(StandInHandler.requests, 4)
+        self.assertEqual(self.sleeps, [0.5, 1.0, 2.0])
+        self.assertEqual(uploader.stats['failed'], 1)
+
+    def test_retry_after(self):
+        uploader = Uploader(self.serve(1, RetryAfterHandler), jobs=1, retries=2, backoff=0.5)
+        self.assertEqual(uploader.post(self.files[0]), 503)
+        uploader.pool.close()
+        self.assertEqual(self.sleeps, [7.0, 7.0])
+
+    def test_no_response(self):
+        url = self.serve()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        uploader = Uploader(url, jobs=1, retries=1, backoff=0.5)
+        self.assertIsNone(uploader.post(self.files[0]))
+        self.assertEqual(self.sleeps, [0.5])
+
+    def test_parts_stop_after_failure(self):
+        """A later part of a split patient is not posted after an earlier one failed"""
+        parts = [os.path.join(self.directory, name) for name in
+                 ('patient-4.fhir-bundle.json', 'patient-4.fhir-bundle.part2.json')]
+        for name in parts:
+            shutil.copy(self.files[0], name)
+        uploader = Uploader(self.serve(failEvery=1), jobs=1, retries=0)
+        self.assertEqual(uploader.upload(parts), 2)
+        self.assertEqual(StandInHandler.requests, 1)